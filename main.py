@@ -1,18 +1,19 @@
 import logging
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Optional
 
 import typer
 from rich.console import Console
-from rich.logging import RichHandler
 
-from src.run_minicactus import CactusRunner
-from src.vg_stats_index import VgIndexStats
-from src.annotation_pangenome import AnnotationRunner
-from src.vg_wgs import VgWgsRunner
-from src.vg_call import CallVariantRunner
 from src.config_loader import ConfigManager
 
+# Runners, the metrics registry, numpy and the rich renderers are imported inside the
+# commands that use them: `--help`, `check` and per-sample job wrappers stay cheap to start.
+# scripts/bench_startup.py guards against a top-level import sneaking back in.
+
 # Initializing Typer and Rich Console
 app = typer.Typer(
     help="""Graph Pangenome Analysis Pipeline:
@@ -28,6 +29,8 @@ console = Console()
 
 def setup_logging():
     """Set up logging with Rich for better visuals."""
+    from rich.logging import RichHandler
+
     # We use force=True to override any previously configured logging
     logging.basicConfig(
         level=logging.INFO,
@@ -37,6 +40,27 @@ def setup_logging():
         force=True
     )
 
+def print_plan(plan: dict):
+    """Render the auto-tune plan as a table."""
+    from rich.table import Table
+    from src.resource_planner import GiB
+
+    machine = plan["machine"]
+    console.print(
+        f"[bold cyan]Machine:[/bold cyan] {machine['cores']} cores, "
+        f"{machine['mem_usable'] / GiB:.1f}/{machine['mem_total'] / GiB:.1f} GiB memory usable, "
+        f"{machine['disk_free'] / GiB:.1f} GiB disk free"
+    )
+    table = Table(title="Auto-tune plan", show_lines=True)
+    table.add_column("Stage", style="bold cyan")
+    table.add_column("Parallel_job", justify="right")
+    table.add_column("Threads", justify="right")
+    table.add_column("Why")
+    for stage in plan["stages"].values():
+        parallel = "-" if stage["Parallel_job"] is None else str(stage["Parallel_job"])
+        table.add_row(f"[{stage['section']}]", parallel, str(stage["Threads"]), "\n".join(stage["reasons"]))
+    console.print(table)
+
 @app.command()
 def run(
     config_file: Optional[str] = typer.Option(
@@ -50,12 +74,25 @@ def run(
     vg: bool = typer.Option(False, "--vg", help="Run vg stats and index module", rich_help_panel="Execution Modules"),
     annotation: bool = typer.Option(False, "--annotation", help="Run annotation module", rich_help_panel="Execution Modules"),
     wgs: bool = typer.Option(False, "--wgs", help="Run vg wgs pipeline", rich_help_panel="Execution Modules"),
+    rna: bool = typer.Option(False, "--rna", help="Run RNA-seq mapping and quantification", rich_help_panel="Execution Modules"),
     call: bool = typer.Option(False, "--call", help="Run vg call variant module", rich_help_panel="Execution Modules"),
+    merge: bool = typer.Option(False, "--merge", help="Merge per-sample VCFs into a cohort VCF", rich_help_panel="Execution Modules"),
+    export: bool = typer.Option(False, "--export", help="Export calls into the memory-mapped genotype store", rich_help_panel="Execution Modules"),
     all: bool = typer.Option(False, "--all", help="Run the full pipeline", rich_help_panel="Execution Modules"),
     
+    # Resource planning
+    auto_tune: bool = typer.Option(False, "--auto-tune", help="Choose Threads/Parallel_job from machine and input sizes", rich_help_panel="Resource Settings"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Only print the auto-tune plan, do not execute", rich_help_panel="Resource Settings"),
+
+    # [Metrics] Overrides
+    metrics_port: Optional[int] = typer.Option(None, "--metrics-port", help="Serve OpenMetrics on this local port", rich_help_panel="Resource Settings"),
+    metrics_textfile: Optional[str] = typer.Option(None, "--metrics-textfile", help="node-exporter textfile to write metrics to", rich_help_panel="Resource Settings"),
+    shard: Optional[str] = typer.Option(None, "--shard", help="Only run shard i of N ('i/N') of the wgs / call samples", rich_help_panel="Resource Settings"),
+
     # [Global] Overrides
     work_dir: Optional[str] = typer.Option(None, "--work-dir", help="Work directory", rich_help_panel="Global Settings"),
     prefix: Optional[str] = typer.Option(None, "--prefix", help="File prefix for outputs", rich_help_panel="Global Settings"),
+    artifact_store: Optional[str] = typer.Option(None, "--artifact-store", help="Shared artifact store for cactus / vg index outputs", rich_help_panel="Global Settings"),
 
     # [Cactus] Overrides
     cactus_seq: Optional[str] = typer.Option(None, "--cactus-seq", help="Cactus seqFile path", rich_help_panel="Cactus Pangenome Settings"),
@@ -75,10 +112,21 @@ def run(
     wgs_data: Optional[str] = typer.Option(None, "--wgs-data", help="DataTable CSV for WGS", rich_help_panel="WGS Mapping Settings"),
     wgs_threads: Optional[int] = typer.Option(None, "--wgs-threads", help="Threads per sample in WGS", rich_help_panel="WGS Mapping Settings"),
     wgs_parallel: Optional[int] = typer.Option(None, "--wgs-parallel", help="Parallel samples in WGS", rich_help_panel="WGS Mapping Settings"),
+    wgs_personalized: bool = typer.Option(False, "--wgs-personalized", help="Map against haplotype-sampled personal graphs", rich_help_panel="WGS Mapping Settings"),
+
+    # [rna] Overrides
+    rna_data: Optional[str] = typer.Option(None, "--rna-data", help="DataTable CSV for RNA-seq", rich_help_panel="RNA-seq Settings"),
+    rna_gff: Optional[str] = typer.Option(None, "--rna-gff", help="GFF3 used to build the spliced indexes", rich_help_panel="RNA-seq Settings"),
+    rna_threads: Optional[int] = typer.Option(None, "--rna-threads", help="Threads per sample in RNA-seq", rich_help_panel="RNA-seq Settings"),
+    rna_parallel: Optional[int] = typer.Option(None, "--rna-parallel", help="Parallel samples in RNA-seq", rich_help_panel="RNA-seq Settings"),
 
     # [call] Overrides
     call_threads: Optional[int] = typer.Option(None, "--call-threads", help="Threads per sample in variant calling", rich_help_panel="Variant Calling Settings"),
     call_parallel: Optional[int] = typer.Option(None, "--call-parallel", help="Parallel samples in variant calling", rich_help_panel="Variant Calling Settings"),
+    call_mode: Optional[str] = typer.Option(None, "--call-mode", help="'denovo' or 'known' (genotype cactus VCF sites)", rich_help_panel="Variant Calling Settings"),
+
+    # [merge] Overrides
+    merge_parallel: Optional[int] = typer.Option(None, "--merge-parallel", help="Parallel contigs in VCF merge", rich_help_panel="Variant Calling Settings"),
 ):
     """
     Run the pipeline. Parameters provided via CLI will override those in the config file.
@@ -102,12 +150,18 @@ def run(
         "VgIndex": {},
         "Annotation": {},
         "wgs": {},
+        "rna": {},
         "call": {},
+        "merge": {},
+        "Metrics": {},
+        "ArtifactStore": {},
+        "Shard": {},
     }
     
     # Mapping CLI to Dict
     if work_dir: overrides["Global"]["work_dir"] = work_dir
     if prefix: overrides["Global"]["filePrefix"] = prefix
+    if artifact_store: overrides["ArtifactStore"]["path"] = artifact_store
     
     if cactus_seq: overrides["Cactus"]["seqFile"] = cactus_seq
     if cactus_ref: overrides["Cactus"]["reference"] = cactus_ref
@@ -123,9 +177,22 @@ def run(
     if wgs_data: overrides["wgs"]["DataTable"] = wgs_data
     if wgs_threads: overrides["wgs"]["Threads"] = wgs_threads
     if wgs_parallel: overrides["wgs"]["Parallel_job"] = wgs_parallel
+    if wgs_personalized: overrides["wgs"]["Personalized"] = True
+
+    if rna_data: overrides["rna"]["DataTable"] = rna_data
+    if rna_gff: overrides["rna"]["gff3"] = rna_gff
+    if rna_threads: overrides["rna"]["Threads"] = rna_threads
+    if rna_parallel: overrides["rna"]["Parallel_job"] = rna_parallel
 
     if call_threads: overrides["call"]["Threads"] = call_threads
     if call_parallel: overrides["call"]["Parallel_job"] = call_parallel
+    if call_mode: overrides["call"]["mode"] = call_mode
+
+    if merge_parallel: overrides["merge"]["Parallel_job"] = merge_parallel
+
+    if metrics_port: overrides["Metrics"]["port"] = metrics_port
+    if metrics_textfile: overrides["Metrics"]["textfile"] = metrics_textfile
+    if shard: overrides["Shard"]["shard"] = shard
 
     # Clean empty sections in overrides
     overrides = {k: v for k, v in overrides.items() if v}
@@ -141,7 +208,10 @@ def run(
         "vg": vg or all,
         "annotation": annotation or all,
         "wgs": wgs or all,
+        "rna": rna,
         "call": call or all,
+        "merge": merge or all,
+        "export": export or all,
     }
 
     if not any(run_modules.values()):
@@ -154,34 +224,268 @@ def run(
     except ValueError as e:
         console.print(f"[bold red]Config Error:[/bold red] {e}")
         raise typer.Exit(1)
+
+    from src.metrics import MetricsExporter, StepTimer, publish_allocation
+
+    # Auto-tune resources, the plan is always shown before executing
+    if auto_tune or dry_run or config["AutoTune"].get("enable"):
+        from src.resource_planner import ResourcePlanner
+        planner = ResourcePlanner(config)
+        plan = planner.plan(run_modules)
+        print_plan(plan)
+        if dry_run:
+            console.print("[yellow]Dry run, nothing executed.[/yellow]")
+            raise typer.Exit()
+        planner.apply(plan, keep=overrides)
     
-    # 1. Cactus Module
-    if run_modules["cactus"]:
-        logging.info("[bold cyan]>>> Starting Step 1: Cactus Pangenome Construction[/bold cyan]")
-        CactusRunner(config).run_cactus()
+    work_path = Path(config["Global"]["work_dir"]).resolve()
+    publish_allocation(config)
+
+    # metrics endpoint / textfile live as long as the pipeline runs ([Metrics] section)
+    with MetricsExporter(config):
+        # 1. Cactus Module
+        if run_modules["cactus"]:
+            logging.info("[bold cyan]>>> Starting Step 1: Cactus Pangenome Construction[/bold cyan]")
+            with StepTimer("cactus", work_path / "1.cactus"):
+                from src.run_minicactus import CactusRunner
+                CactusRunner(config).run_cactus()
+
+        # 2. VG Stats & Indexing
+        if run_modules["vg"]:
+            logging.info("[bold cyan]>>> Starting Step 2: VG Stats and Indexing[/bold cyan]")
+            with StepTimer("vg", work_path / "3.vg_index"):
+                from src.vg_stats_index import VgIndexStats
+                VgIndexStats(config).run_vg_index_stats()
+
+        # 3. Annotation
+        if run_modules["annotation"]:
+            logging.info("[bold cyan]>>> Starting Step 3: Annotation[/bold cyan]")
+            with StepTimer("annotation", work_path / "4.annotation"):
+                from src.annotation_pangenome import AnnotationRunner
+                AnnotationRunner(config).run_annotation()
+
+        # 4. WGS Mapping
+        if run_modules["wgs"]:
+            logging.info("[bold cyan]>>> Starting Step 4: WGS Pipeline[/bold cyan]")
+            with StepTimer("wgs", work_path / "5.wgs_analysis"):
+                from src.vg_wgs import VgWgsRunner
+                VgWgsRunner(config).run_wgs()
 
-    # 2. VG Stats & Indexing
-    if run_modules["vg"]:
-        logging.info("[bold cyan]>>> Starting Step 2: VG Stats and Indexing[/bold cyan]")
-        VgIndexStats(config).run_vg_index_stats()
+        # 5. Variant Calling
+        if run_modules["call"]:
+            logging.info("[bold cyan]>>> Starting Step 5: Variant Calling[/bold cyan]")
+            with StepTimer("call", work_path / "6.call_variant"):
+                from src.vg_call import CallVariantRunner
+                CallVariantRunner(config).run_vg_call()
 
-    # 3. Annotation
-    if run_modules["annotation"]:
-        logging.info("[bold cyan]>>> Starting Step 3: Annotation[/bold cyan]")
-        AnnotationRunner(config).run_annotation()
+        # 6. Cohort VCF merge
+        if run_modules["merge"]:
+            logging.info("[bold cyan]>>> Starting Step 6: Cohort VCF Merge[/bold cyan]")
+            with StepTimer("merge", work_path / "7.merge_vcf"):
+                from src.merge_vcf import VcfMergeRunner
+                VcfMergeRunner(config).run_merge()
 
-    # 4. WGS Mapping
-    if run_modules["wgs"]:
-        logging.info("[bold cyan]>>> Starting Step 4: WGS Pipeline[/bold cyan]")
-        VgWgsRunner(config).run_wgs()
+        # 7. Genotype store export
+        if run_modules["export"]:
+            logging.info("[bold cyan]>>> Starting Step 7: Genotype Store Export[/bold cyan]")
+            with StepTimer("export", work_path / "8.genotype_store"):
+                from src.genotype_store import GenotypeExportRunner
+                GenotypeExportRunner(config).run_export()
 
-    # 5. Variant Calling
-    if run_modules["call"]:
-        logging.info("[bold cyan]>>> Starting Step 5: Variant Calling[/bold cyan]")
-        CallVariantRunner(config).run_vg_call()
+        # 8. RNA-seq
+        if run_modules["rna"]:
+            logging.info("[bold cyan]>>> Starting Step 8: RNA-seq Quantification[/bold cyan]")
+            with StepTimer("rna", work_path / "9.rna_seq"):
+                from src.vg_rna import VgRnaRunner
+                VgRnaRunner(config).run_rna()
 
     console.print("\n[bold green]Pipeline execution finished successfully![/bold green] :rocket:")
 
+@app.command()
+def query(
+    config_file: Optional[str] = typer.Option(None, "--config", "-c", help="Path to a custom config.toml file", rich_help_panel="Base Configuration", show_default=False),
+    work_dir: Optional[str] = typer.Option(None, "--work-dir", help="Work directory", rich_help_panel="Global Settings"),
+    node: Optional[str] = typer.Option(None, "--node", help="Node ID or range START-END: features on these nodes", rich_help_panel="Query"),
+    feature: Optional[str] = typer.Option(None, "--feature", help="Feature name: node ranges of this feature", rich_help_panel="Query"),
+    genome: Optional[str] = typer.Option(None, "--genome", help="Only the node ranges of this genome (with --feature)", rich_help_panel="Query"),
+):
+    """
+    Query the node <-> feature index of the annotation outputs.
+    """
+    from rich.table import Table
+    from src.annotation_index import AnnotationIndex
+
+    setup_logging()
+    if (node is None) == (feature is None):
+        console.print("[bold red]Error:[/bold red] give exactly one of --node or --feature")
+        raise typer.Exit(1)
+
+    config_mgr = ConfigManager(config_file or str(Path(__file__).parent / "config" / "config.toml"))
+    if work_dir:
+        config_mgr.update_config({"Global": {"work_dir": work_dir}})
+    index = AnnotationIndex(Path(config_mgr.get_config()["Global"]["work_dir"]).resolve() / "4.annotation")
+    if not index.sources():
+        console.print(f"[bold red]Error:[/bold red] no grannot GAF / GFF outputs in {index.anno_dir}")
+        raise typer.Exit(1)
+    # cheap when the outputs did not change
+    index.update()
+
+    if node is not None:
+        try:
+            start, _, end = node.partition("-")
+            start, end = int(start), int(end or start)
+        except ValueError:
+            console.print(f"[bold red]Error:[/bold red] --node expects ID or START-END, got {node}")
+            raise typer.Exit(1)
+        hits = index.features_at(start, end)
+        table = Table(title=f"Features on node {node}")
+        for column in ("feature", "type", "genome", "start_node", "end_node"):
+            table.add_column(column)
+        for hit in hits:
+            table.add_row(*(str(hit[column]) for column in ("feature", "type", "genome", "start_node", "end_node")))
+    else:
+        hits = index.nodes_of(feature, genome)
+        table = Table(title=f"Node ranges of {feature}")
+        for column in ("genome", "start_node", "end_node"):
+            table.add_column(column)
+        for row in hits:
+            table.add_row(*(str(value) for value in row))
+    if not hits:
+        console.print("[yellow]No match.[/yellow]")
+        raise typer.Exit(1)
+    console.print(table)
+
+@app.command("shard-check")
+def shard_check(
+    config_file: Optional[str] = typer.Option(None, "--config", "-c", help="Path to a custom config.toml file", rich_help_panel="Base Configuration", show_default=False),
+    work_dir: Optional[str] = typer.Option(None, "--work-dir", help="Work directory", rich_help_panel="Global Settings"),
+    shards: Optional[int] = typer.Option(None, "--shards", help="Number of shards N (default: the only plan in work_dir/shards)", rich_help_panel="Shard Settings"),
+):
+    """
+    Check that the --shard i/N runs together processed every sample exactly once.
+    """
+    from rich.table import Table
+    from src.sharding import SHARD_DIR, check_shards
+
+    setup_logging()
+    config_mgr = ConfigManager(config_file or str(Path(__file__).parent / "config" / "config.toml"))
+    config_mgr.update_config({"Global": {"work_dir": work_dir}})
+    config = config_mgr.get_config()
+    work_path = Path(config["Global"]["work_dir"]).resolve()
+
+    if shards is None:
+        plans = sorted((work_path / SHARD_DIR).glob("plan_*.json"))
+        if len(plans) != 1:
+            console.print(f"[bold red]Error:[/bold red] {len(plans)} shard plans in {work_path / SHARD_DIR}, give --shards")
+            raise typer.Exit(1)
+        shards = int(plans[0].stem.removeprefix("plan_"))
+
+    cohort = None
+    data_table = config["wgs"].get("DataTable")
+    if data_table and Path(data_table).exists():
+        from src.vg_wgs import VgWgsRunner
+        cohort = {s["SampleID"] for s in VgWgsRunner(config).parser_csv()}
+
+    rows, problems = check_shards(work_path, shards, cohort)
+    table = Table(title=f"Shards of {work_path}")
+    for column in ("stage", "shard", "samples", "done", "failed"):
+        table.add_column(column)
+    for row in rows:
+        table.add_row(*(str(value) for value in row))
+    console.print(table)
+    if problems:
+        for problem in problems:
+            console.print(f"[bold red]✗[/bold red] {problem}")
+        raise typer.Exit(1)
+    console.print(f"[bold green]✓ The {shards} shards cover the cohort exactly once.[/bold green]")
+
+@app.command()
+def watch(
+    config_file: Optional[str] = typer.Option(None, "--config", "-c", help="Path to a custom config.toml file", rich_help_panel="Base Configuration", show_default=False),
+    work_dir: Optional[str] = typer.Option(None, "--work-dir", help="Work directory", rich_help_panel="Global Settings"),
+    prefix: Optional[str] = typer.Option(None, "--prefix", help="File prefix for outputs", rich_help_panel="Global Settings"),
+    input_dir: Optional[str] = typer.Option(None, "--input-dir", help="Delivery directory to watch for FASTQs", rich_help_panel="Watch Settings"),
+    stable_seconds: Optional[int] = typer.Option(None, "--stable-seconds", help="Seconds a sample's files must stay unchanged", rich_help_panel="Watch Settings"),
+    idle_exit: Optional[int] = typer.Option(None, "--idle-exit", help="Stop after this many idle seconds (0 = never)", rich_help_panel="Watch Settings"),
+    wgs_threads: Optional[int] = typer.Option(None, "--wgs-threads", help="Threads per sample in WGS", rich_help_panel="Watch Settings"),
+    wgs_parallel: Optional[int] = typer.Option(None, "--wgs-parallel", help="Parallel samples", rich_help_panel="Watch Settings"),
+    metrics_port: Optional[int] = typer.Option(None, "--metrics-port", help="Serve OpenMetrics on this local port", rich_help_panel="Resource Settings"),
+):
+    """
+    Map and call samples as their FASTQs arrive in a delivery directory.
+    """
+    setup_logging()
+    config_mgr = ConfigManager(config_file or str(Path(__file__).parent / "config" / "config.toml"))
+    config_mgr.update_config({
+        "Global": {"work_dir": work_dir, "filePrefix": prefix},
+        "Watch": {"InputDir": input_dir, "StableSeconds": stable_seconds, "IdleExit": idle_exit},
+        "wgs": {"Threads": wgs_threads, "Parallel_job": wgs_parallel},
+        "Metrics": {"port": metrics_port},
+    })
+    config = config_mgr.get_config()
+    if not config["Watch"].get("InputDir"):
+        console.print("[bold red]Config Error:[/bold red] watch mode requires 'InputDir' (--input-dir)")
+        raise typer.Exit(1)
+
+    from src.metrics import MetricsExporter, StepTimer, publish_allocation
+    from src.watch import WatchRunner
+
+    publish_allocation(config)
+    with MetricsExporter(config), StepTimer("watch", Path(config["Global"]["work_dir"]).resolve() / "6.call_variant"):
+        WatchRunner(config).run_watch()
+
+@app.command()
+def serve(
+    config_file: Optional[str] = typer.Option(None, "--config", "-c", help="Path to a custom config.toml file", rich_help_panel="Base Configuration", show_default=False),
+    work_dir: Optional[str] = typer.Option(None, "--work-dir", help="Work directory", rich_help_panel="Global Settings"),
+    prefix: Optional[str] = typer.Option(None, "--prefix", help="File prefix for outputs", rich_help_panel="Global Settings"),
+    address: Optional[str] = typer.Option(None, "--address", help="Listen address", rich_help_panel="Server Settings"),
+    port: Optional[int] = typer.Option(None, "--port", help="Listen port", rich_help_panel="Server Settings"),
+):
+    """
+    Serve region, path and node coordinate queries over HTTP from a graph loaded once.
+    """
+    setup_logging()
+    config_mgr = ConfigManager(config_file or str(Path(__file__).parent / "config" / "config.toml"))
+    config_mgr.update_config({"Global": {"work_dir": work_dir, "filePrefix": prefix},
+                              "Serve": {"address": address, "port": port}})
+    from src.region_server import RegionServer
+
+    try:
+        server = RegionServer(config_mgr.get_config())
+    except (FileNotFoundError, OSError) as e:
+        console.print(f"[bold red]Error:[/bold red] {e}")
+        raise typer.Exit(1)
+    server.serve()
+
+# required tools -> arguments printing their version
+TOOL_VERSION_ARGS = {
+    "cactus-pangenome": ["--version"],
+    "vg": ["version"],
+    "grannot": ["--version"],
+    "singularity": ["--version"],
+    "bgzip": ["--version"],
+    "samtools": ["--version"],
+    "tabix": ["--version"],
+    "rpvg": ["--version"],
+    "kmc": [],
+}
+TOOL_PROBE_TIMEOUT = 10
+
+def probe_tool(item: tuple[str, list[str]]) -> tuple[str, Optional[str], str]:
+    """(tool, path or None, first line of its version output)"""
+    tool, version_args = item
+    path = shutil.which(tool)
+    if not path:
+        return tool, None, ""
+    try:
+        result = subprocess.run([path] + version_args, capture_output=True, text=True, stdin=subprocess.DEVNULL,
+                                timeout=TOOL_PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired):
+        return tool, path, ""
+    lines = [line.strip() for line in (result.stdout or result.stderr).splitlines() if line.strip()]
+    return tool, path, lines[0] if lines else ""
+
 @app.command()
 def check(
     config_file: Optional[str] = typer.Option(
@@ -213,14 +517,14 @@ def check(
         config = config_mgr.get_config()
         console.print("[green]✓ Configuration loaded and merged successfully.[/green]")
         
-        # Check for required tools
-        tools = ["cactus-pangenome", "vg", "grannot", "singularity"]
+        # Check for required tools, probed concurrently: a singularity or conda wrapper
+        # can take seconds to print its version
         console.print("\n[bold cyan]Checking for required tools in PATH:[/bold cyan]")
-        for tool in tools:
-            import shutil
-            path = shutil.which(tool)
+        with ThreadPoolExecutor(max_workers=len(TOOL_VERSION_ARGS)) as pool:
+            results = pool.map(probe_tool, TOOL_VERSION_ARGS.items())
+        for tool, path, version in results:
             if path:
-                console.print(f"[green]✓ {tool:20}[/green] found at {path}")
+                console.print(f"[green]✓ {tool:20}[/green] found at {path}" + (f" [dim]({version})[/dim]" if version else ""))
             else:
                 console.print(f"[yellow]! {tool:20}[/yellow] [bold yellow]not found[/bold yellow] (ensure it is in your PATH or provided via singularity)")
         
@@ -60,6 +60,11 @@ def prepare_real_yeast_test():
     print(">>> Downloading full WGS data...")
     download_and_save(sources["wgs_r1"], read_dir / "test_sample_R1.fq.gz")
 
+    # PacBio subreads (CLR) are long, error-prone reads: mapped with the r10 giraffe preset
+    with open(base_dir / "datatable.csv", "w") as f:
+        f.write("SampleID,R1,R2,ReadType\n")
+        f.write(f"test_sample,{read_dir.absolute()}/test_sample_R1.fq.gz,,r10\n")
+
     # generate seqfile
     with open(base_dir / "seqfile", "w") as f:
         f.write(f"s288c\t{genome_dir.absolute()}/s288c_chrI.fa.gz\n")
@@ -0,0 +1,84 @@
+import argparse
+import json
+import logging
+import random
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from urllib.request import urlopen
+
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+def random_regions(length: int, n: int, size: int, seed: int) -> list[tuple[int, int]]:
+    rng = random.Random(seed)
+    return [(start, start + size) for start in (rng.randrange(0, max(1, length - size)) for _ in range(n))]
+
+def summarize(name: str, latencies: list[float], wall: float):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    logging.info(f"{name:>12}: {len(latencies)} queries, {len(latencies) / wall:8.1f} queries/s, "
+                 f"p50 {statistics.median(latencies) * 1000:8.1f} ms, p95 {p95 * 1000:8.1f} ms")
+    return len(latencies) / wall
+
+def bench_server(url: str, path: str, regions: list, context: int, concurrency: int) -> float:
+    def query(region):
+        start = time.monotonic()
+        with urlopen(f"{url}/region?path={quote(path)}&start={region[0]}&end={region[1]}&context={context}") as r:
+            r.read()
+        return time.monotonic() - start
+
+    wall = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(query, regions))
+    return summarize("server", latencies, time.monotonic() - wall)
+
+def bench_vg(gbz: str, path: str, regions: list, context: int) -> float:
+    latencies = []
+    wall = time.monotonic()
+    for start, end in regions:
+        t = time.monotonic()
+        # vg chunk ranges are 0-based inclusive
+        subprocess.run(["vg", "chunk", "-x", gbz, "-p", f"{path}:{start}-{end - 1}", "-c", str(context), "-O", "gfa"],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        latencies.append(time.monotonic() - t)
+    return summarize("vg chunk", latencies, time.monotonic() - wall)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the region server with one-shot vg chunk invocations.")
+    parser.add_argument("--url", type=str, default="http://127.0.0.1:8765", help="Region server URL (main.py serve)")
+    parser.add_argument("--path", type=str, required=True, help="Path to draw regions from, e.g. 'sy#0#chr1'")
+    parser.add_argument("--gbz", type=str, default=None, help="GBZ for the vg chunk baseline, skipped when not given")
+    parser.add_argument("--queries", type=int, default=1000, help="Server queries (default: 1000)")
+    parser.add_argument("--vg-queries", type=int, default=20, help="vg chunk runs, each reloads the graph (default: 20)")
+    parser.add_argument("--size", type=int, default=10000, help="Region size in bp (default: 10000)")
+    parser.add_argument("--context", type=int, default=1, help="Context steps (default: 1)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent server clients (default: 8)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the regions (default: 1)")
+    args = parser.parse_args()
+
+    setup_logging()
+    with urlopen(f"{args.url}/paths") as r:
+        lengths = {p['name']: p['length'] for p in json.load(r)}
+    if args.path not in lengths:
+        parser.error(f"path {args.path} not served by {args.url}")
+    # a P line length is only known once the path was parsed, the first region query does it
+    length = lengths[args.path] or args.size * 100
+    regions = random_regions(length, args.queries, args.size, args.seed)
+
+    # the first half of the regions again: a curator re-opening the same loci hits the cache
+    server_rate = bench_server(args.url, args.path, regions + regions[:len(regions) // 2],
+                               args.context, args.concurrency)
+    if args.gbz:
+        vg_rate = bench_vg(args.gbz, args.path, regions[:args.vg_queries], args.context)
+        logging.info(f"server throughput is {server_rate / vg_rate:.1f}x one-shot vg chunk")
+    with urlopen(f"{args.url}/health") as r:
+        logging.info(f"server cache: {json.load(r)['cache']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import argparse
+import json
+import logging
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# modules that must not be loaded by `import main`, they belong to the commands using them
+FORBIDDEN_MODULES = [
+    "numpy",
+    "src.run_minicactus", "src.vg_stats_index", "src.annotation_pangenome", "src.annotation_index",
+    "src.vg_wgs", "src.vg_rna", "src.vg_call", "src.merge_vcf", "src.genotype_store",
+    "src.resource_planner", "src.metrics", "src.region_server", "src.watch", "src.scheduler",
+]
+
+COMMANDS = {
+    "import main": [sys.executable, "-c", "import main"],
+    "main.py --help": [sys.executable, "main.py", "--help"],
+    "run --help": [sys.executable, "main.py", "run", "--help"],
+    "check --help": [sys.executable, "main.py", "check", "--help"],
+}
+
+def setup_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+def time_command(command: list[str], runs: int) -> float:
+    """median wall time in ms, after one warm-up run filling the page cache / __pycache__"""
+    subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+def loaded_modules() -> list[str]:
+    """forbidden modules present in sys.modules after `import main`, in a fresh interpreter"""
+    probe = f"import json, sys, main; print(json.dumps([m for m in {FORBIDDEN_MODULES!r} if m in sys.modules]))"
+    result = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure CLI startup time and check that main.py imports lazily.")
+    parser.add_argument("--runs", type=int, default=10, help="Timed runs per command (default: 10)")
+    parser.add_argument("--max-ms", type=float, default=None,
+                        help="Fail when the median of any command exceeds this many milliseconds")
+    args = parser.parse_args()
+
+    setup_logging()
+    failed = False
+
+    loaded = loaded_modules()
+    if loaded:
+        logging.error(f"`import main` loads modules it should import lazily: {', '.join(loaded)}")
+        failed = True
+    else:
+        logging.info("`import main` loads no runner modules and no numpy")
+
+    for name, command in COMMANDS.items():
+        median = time_command(command, args.runs)
+        logging.info(f"{name:>16}: median {median:8.1f} ms over {args.runs} runs")
+        if args.max_ms is not None and median > args.max_ms:
+            logging.error(f"{name} exceeds --max-ms {args.max_ms:.0f}")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import json
+import logging
+import threading
+from pathlib import Path
+
+# GAF MAPQ column, 255 = not available
+MISSING_MAPQ = 255
+# fragment lengths above are counted in a single overflow bin
+MAX_INSERT = 10000
+TEE_BUFFER = 1024 * 1024
+
+
+class AlignmentQc:
+    """
+    Mapping statistics of one sample collected from the GAF stream of giraffe
+    Unmapped reads are GAF records without a path ("*"). The insert size comes from the
+    fl:i: tag of paired reads and is counted once per pair (on the mate carrying fn:Z:).
+    """
+    def __init__(self):
+        self.reads = 0
+        self.mapped = 0
+        # records with a non-numeric MAPQ / fl:i: value, not counted as reads
+        self.malformed = 0
+        self.mapq: dict[int, int] = {}
+        self.insert: dict[int, int] = {}
+
+    def add(self, line: bytes):
+        """count one GAF record, malformed records are skipped and counted, never raised"""
+        fields = line.rstrip(b"\n").split(b"\t")
+        if len(fields) < 12:
+            return
+        mapped = fields[5] != b"*"
+        fragment = None
+        first_mate = True
+        try:
+            mapq = int(fields[11]) if mapped else None
+            for tag in fields[12:]:
+                if tag.startswith(b"fl:i:"):
+                    fragment = abs(int(tag[5:]))
+                elif tag.startswith(b"fp:Z:"):
+                    first_mate = False
+        except ValueError:
+            self.malformed += 1
+            return
+        self.reads += 1
+        if not mapped:
+            return
+        self.mapped += 1
+        self.mapq[mapq] = self.mapq.get(mapq, 0) + 1
+        if fragment is not None and first_mate:
+            fragment = min(fragment, MAX_INSERT)
+            self.insert[fragment] = self.insert.get(fragment, 0) + 1
+
+    def merge(self, other: "AlignmentQc"):
+        """add the counts of another collector, e.g. of one chunk of a long-read sample"""
+        self.reads += other.reads
+        self.mapped += other.mapped
+        self.malformed += other.malformed
+        for hist, other_hist in ((self.mapq, other.mapq), (self.insert, other.insert)):
+            for value, count in other_hist.items():
+                hist[value] = hist.get(value, 0) + count
+
+    @staticmethod
+    def _quantile(hist: dict[int, int], total: int, q: float) -> int:
+        rank = q * (total - 1)
+        seen = 0
+        for value in sorted(hist):
+            seen += hist[value]
+            if seen > rank:
+                return value
+        return 0
+
+    def summary(self, min_mapq: int = 0) -> dict:
+        """qc.json content, min_mapq is the filter of vg pack"""
+        known = {q: n for q, n in self.mapq.items() if q != MISSING_MAPQ}
+        known_total = sum(known.values())
+        qc = {
+            "reads": self.reads,
+            "mapped": self.mapped,
+            "mapped_fraction": round(self.mapped / self.reads, 4) if self.reads else 0.0,
+            "mean_mapq": round(sum(q * n for q, n in known.items()) / known_total, 2) if known_total else None,
+            # reads counted into the coverage by vg pack
+            "min_mapq": min_mapq,
+            "passing_mapq": sum(n for q, n in known.items() if q >= min_mapq),
+            "mapq_histogram": {str(q): self.mapq[q] for q in sorted(self.mapq)},
+            "malformed": self.malformed,
+        }
+        pairs = sum(self.insert.values())
+        if pairs:
+            mean = sum(v * n for v, n in self.insert.items()) / pairs
+            variance = sum(n * (v - mean) ** 2 for v, n in self.insert.items()) / pairs
+            qc["insert_size"] = {
+                "pairs": pairs,
+                "median": self._quantile(self.insert, pairs, 0.5),
+                "p05": self._quantile(self.insert, pairs, 0.05),
+                "p95": self._quantile(self.insert, pairs, 0.95),
+                "mean": round(mean, 1),
+                "sd": round(variance ** 0.5, 1),
+                "overflow": self.insert.get(MAX_INSERT, 0),
+            }
+        return qc
+
+    def write(self, path: Path, sample_id: str, min_mapq: int = 0):
+        path.write_text(json.dumps({"sample": sample_id, **self.summary(min_mapq)}, indent=2))
+
+
+class AlignmentTee(threading.Thread):
+    """
+    Copy the GAF output of giraffe into vg pack and count every record on the way
+    Both pipe ends are closed when the copy ends: vg pack sees EOF, and giraffe gets
+    SIGPIPE if vg pack died first.
+
+        giraffe = subprocess.Popen(giraffe_cmd, stdout=subprocess.PIPE)
+        pack = subprocess.Popen(["vg", "pack", "--gaf", "-", ...], stdin=subprocess.PIPE)
+        tee = AlignmentTee(giraffe.stdout, pack.stdin, qc)
+        tee.start(); ...; tee.join()
+    """
+    def __init__(self, source, sink, qc: AlignmentQc):
+        super().__init__(daemon=True)
+        self.source = source
+        self.sink = sink
+        self.qc = qc
+        self.error: str | None = None
+
+    def run(self):
+        try:
+            while True:
+                lines = self.source.readlines(TEE_BUFFER)
+                if not lines:
+                    break
+                self.sink.write(b"".join(lines))
+                for line in lines:
+                    self.qc.add(line)
+        except (OSError, ValueError) as e:
+            # BrokenPipeError: vg pack exited, ValueError: I/O on a pipe closed underneath
+            # malformed records do not end up here, AlignmentQc.add skips them
+            self.error = str(e)
+            logging.debug(f"alignment tee stopped: {e}")
+        finally:
+            for stream in (self.sink, self.source):
+                try:
+                    stream.close()
+                except OSError:
+                    pass
@@ -0,0 +1,203 @@
+import json
+import logging
+import re
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+from urllib.parse import unquote
+
+INDEX_VERSION = 1
+INDEX_NAME = "annotation_index.sqlite"
+# grannot outputs that carry node IDs
+GAF_SUFFIXES = (".gaf",)
+GFF_SUFFIXES = (".gff", ".gff3")
+# consecutive node IDs are stored as one range, split at this length so a node lookup
+# only scans the ranges starting at most MAX_RUN nodes before it
+MAX_RUN = 1024
+BATCH_SIZE = 100000
+NODE_PATTERN = re.compile(r"[><]([^><]+)")
+
+
+def node_runs(nodes) -> list[tuple[int, int]]:
+    """sorted, merged (start, end) ranges of node IDs, at most MAX_RUN nodes each"""
+    runs = []
+    for node in sorted(set(nodes)):
+        if runs and node == runs[-1][1] + 1 and node - runs[-1][0] < MAX_RUN:
+            runs[-1][1] = node
+        else:
+            runs.append([node, node])
+    return [(start, end) for start, end in runs]
+
+
+def _gff_name(attributes: str) -> str | None:
+    fields = dict(item.split("=", 1) for item in attributes.split(";") if "=" in item)
+    name = fields.get("ID") or fields.get("Name") or fields.get("Parent")
+    return unquote(name) if name else None
+
+
+class AnnotationIndex:
+    """
+    Node <-> feature index over the grannot outputs of 4.annotation
+    GAF records give the node path of a feature (genome = GAF file name), graph GFF lines
+    (seqid = segment) the features lying on a node. Features map to ranges of consecutive
+    node IDs in an sqlite database; it is rebuilt only when the size or mtime of an indexed
+    file changed.
+
+        index = AnnotationIndex(work_dir / "4.annotation")
+        index.update()
+        index.features_at(12345)          # features on node 12345
+        index.nodes_of("gene:YAL001C")    # [(genome, start, end), ...]
+    """
+    def __init__(self, anno_dir: Path):
+        self.anno_dir = Path(anno_dir)
+        self.db_file = self.anno_dir / INDEX_NAME
+
+    def sources(self) -> list[Path]:
+        return sorted(path for path in self.anno_dir.rglob("*")
+                      if path.is_file() and path.suffix.lower() in GAF_SUFFIXES + GFF_SUFFIXES)
+
+    def fingerprint(self) -> dict:
+        """size and mtime of every indexed file"""
+        fingerprint = {"version": INDEX_VERSION}
+        for path in self.sources():
+            stat = path.stat()
+            fingerprint[str(path.relative_to(self.anno_dir))] = [stat.st_size, stat.st_mtime_ns]
+        return fingerprint
+
+    def is_current(self) -> bool:
+        if not self.db_file.exists():
+            return False
+        try:
+            with closing(self._connect()) as db:
+                stored = db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        except sqlite3.Error:
+            return False
+        return stored is not None and json.loads(stored[0]) == self.fingerprint()
+
+    def update(self, force: bool = False) -> bool:
+        """build the index if the annotation outputs changed, :return: True when rebuilt"""
+        if not force and self.is_current():
+            logging.info(f"Annotation index {self.db_file} is up to date")
+            return False
+        self.build()
+        return True
+
+    def _read_gaf(self, path: Path):
+        """(name, type, nodes) of every GAF record"""
+        with open(path, 'r') as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 12 or fields[5] == "*":
+                    continue
+                nodes = [int(node) for node in NODE_PATTERN.findall(fields[5]) if node.isdigit()]
+                if nodes:
+                    yield fields[0], "", nodes
+
+    def _read_graph_gff(self, path: Path):
+        """(name, type, nodes) of the features of a graph GFF, a feature spans several segment lines"""
+        features: dict[str, tuple[str, list[int]]] = {}
+        linear = 0
+        with open(path, 'r') as f:
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 9:
+                    continue
+                if not fields[0].isdigit():
+                    # linear coordinates (annotation of a target genome), no node IDs
+                    linear += 1
+                    continue
+                name = _gff_name(fields[8])
+                if name:
+                    features.setdefault(name, (fields[2], []))[1].append(int(fields[0]))
+        if linear:
+            logging.info(f"Skipped {linear} lines of {path.name} with linear coordinates (no node IDs)")
+        for name, (feature_type, nodes) in features.items():
+            yield name, feature_type, nodes
+
+    def build(self):
+        """parse every grannot output into a fresh database and swap it in"""
+        self.anno_dir.mkdir(parents=True, exist_ok=True)
+        fingerprint = self.fingerprint()
+        tmp_file = self.db_file.with_name(f".{INDEX_NAME}.tmp")
+        tmp_file.unlink(missing_ok=True)
+        db = sqlite3.connect(tmp_file)
+        # a half-written index is thrown away, no journal needed
+        db.execute("PRAGMA journal_mode = OFF")
+        db.execute("PRAGMA synchronous = OFF")
+        db.executescript("""
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE features (id INTEGER PRIMARY KEY, name TEXT, type TEXT, genome TEXT, source TEXT);
+            CREATE TABLE ranges (feature INTEGER, start_node INTEGER, end_node INTEGER);
+        """)
+        feature_id = 0
+        n_ranges = 0
+        for path in self.sources():
+            is_gaf = path.suffix.lower() in GAF_SUFFIXES
+            records = self._read_gaf(path) if is_gaf else self._read_graph_gff(path)
+            features, ranges = [], []
+            n_file = 0
+            for name, feature_type, nodes in records:
+                feature_id += 1
+                n_file += 1
+                features.append((feature_id, name, feature_type, path.stem, path.name))
+                ranges.extend((feature_id, start, end) for start, end in node_runs(nodes))
+                if len(ranges) >= BATCH_SIZE:
+                    n_ranges += self._insert(db, features, ranges)
+                    features, ranges = [], []
+            n_ranges += self._insert(db, features, ranges)
+            if n_file:
+                logging.info(f"Indexed {n_file} features of {path.name}")
+
+        # indexes are created once after the bulk insert
+        db.executescript("""
+            CREATE INDEX ranges_start ON ranges (start_node, end_node);
+            CREATE INDEX ranges_feature ON ranges (feature);
+            CREATE INDEX features_name ON features (name, genome);
+        """)
+        db.execute("INSERT INTO meta VALUES ('fingerprint', ?)", (json.dumps(fingerprint),))
+        db.execute("INSERT INTO meta VALUES ('max_run', ?)", (str(MAX_RUN),))
+        db.commit()
+        db.close()
+        tmp_file.replace(self.db_file)
+        logging.info(f"Annotation index of {feature_id} features / {n_ranges} node ranges written to {self.db_file}")
+
+    @staticmethod
+    def _insert(db: sqlite3.Connection, features: list, ranges: list) -> int:
+        db.executemany("INSERT INTO features VALUES (?, ?, ?, ?, ?)", features)
+        db.executemany("INSERT INTO ranges VALUES (?, ?, ?)", ranges)
+        return len(ranges)
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self.db_file.exists():
+            raise FileNotFoundError(f"{self.db_file} does not exist, run the annotation step first")
+        return sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True)
+
+    def features_at(self, start: int, end: int | None = None) -> list[dict]:
+        """features overlapping the nodes start..end (a single node when end is None)"""
+        end = start if end is None else end
+        with closing(self._connect()) as db:
+            max_run = int(db.execute("SELECT value FROM meta WHERE key = 'max_run'").fetchone()[0])
+            rows = db.execute("""
+                SELECT DISTINCT f.name, f.type, f.genome, r.start_node, r.end_node
+                FROM ranges r JOIN features f ON f.id = r.feature
+                WHERE r.start_node BETWEEN ? AND ? AND r.end_node >= ?
+                ORDER BY r.start_node, f.name
+            """, (start - max_run + 1, end, start)).fetchall()
+        return [{"feature": name, "type": feature_type, "genome": genome, "start_node": s, "end_node": e}
+                for name, feature_type, genome, s, e in rows]
+
+    def nodes_of(self, feature: str, genome: str | None = None) -> list[tuple[str, int, int]]:
+        """(genome, start node, end node) ranges of a feature, optionally of one genome only"""
+        query = """
+            SELECT f.genome, r.start_node, r.end_node
+            FROM features f JOIN ranges r ON r.feature = f.id
+            WHERE f.name = ?
+        """
+        params = [feature]
+        if genome:
+            query += " AND f.genome = ?"
+            params.append(genome)
+        with closing(self._connect()) as db:
+            return db.execute(query + " ORDER BY f.genome, r.start_node", params).fetchall()
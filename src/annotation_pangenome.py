@@ -3,6 +3,8 @@ import subprocess
 import sys
 from pathlib import Path
 
+from src.annotation_index import AnnotationIndex
+
 class AnnotationRunner:
     def __init__(self, config: dict):
         self.config: dict = config
@@ -95,6 +97,10 @@ class AnnotationRunner:
                 logging.error(f"grannot error: {e.returncode}")
                 sys.exit(1)
 
+        # node <-> feature index for the query command, rebuilt only when the outputs changed
+        if self.annotation.get('index', True):
+            AnnotationIndex(self.anno_dir).update()
+
 if __name__ == "__main__":
     from src.config_loader import ConfigManager
     import sys
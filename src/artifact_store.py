@@ -0,0 +1,238 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from src.metrics import ARTIFACT_LOOKUPS
+
+GiB = 1024 ** 3
+
+
+def detach_links(files: list[Path]) -> int:
+    """
+    unlink the files that share their inode with another link (outputs materialized from
+    the store), so a rebuild writes new files instead of truncating the store entry and
+    every work_dir linked to it
+    :return: number of files unlinked
+    """
+    detached = 0
+    for path in files:
+        if path.is_file() and not path.is_symlink() and path.stat().st_nlink > 1:
+            path.unlink()
+            detached += 1
+    if detached:
+        logging.info(f"Unlinked {detached} artifact store files before rebuilding")
+    return detached
+
+
+def vg_version() -> str:
+    """index formats change between vg releases, so the version is part of the artifact keys of vg indexes"""
+    try:
+        result = subprocess.run(["vg", "version"], capture_output=True, text=True, check=True)
+        return result.stdout.splitlines()[0] if result.stdout else ""
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+class ArtifactStore:
+    """
+    Content-addressed store of step outputs shared by several work directories
+    An entry is keyed by the sha256 of the step name, its parameters and the content of its
+    input files. Entries are materialized into a work_dir by hardlink (or reflink copy), so
+    the same graph and indexes are only stored once.
+
+    Layout:
+        objects/<key[:2]>/<key>/files/...   the artifact files
+        objects/<key[:2]>/<key>/manifest.json
+        objects/<key[:2]>/<key>/last_used   mtime drives the LRU eviction
+        locks/<key>.lock                    held while one run builds the entry
+        store.lock                          shared for reads, exclusive for commit / eviction
+        digests.json                        sha256 of input files by path, size and mtime
+    """
+    def __init__(self, config: dict):
+        self.ArtifactStore: dict = config.get('ArtifactStore', {})
+        path = self.ArtifactStore.get('path')
+        self.root: Path | None = Path(path).resolve() if path else None
+        # 0 = no size bound
+        self.max_size: int = int(self.ArtifactStore.get('MaxSizeGB', 0) * GiB)
+        # "hardlink" falls back to a reflink copy across filesystems, "reflink" always copies
+        self.link: str = self.ArtifactStore.get('Link', "hardlink")
+        self._digests: dict | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.root is not None
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.root / "objects" / key[:2] / key
+
+    @contextmanager
+    def _lock(self, lock_file: Path, exclusive: bool):
+        lock_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_file, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def file_digest(self, path: Path) -> str:
+        """sha256 of a file, cached in the store while its size and mtime are unchanged"""
+        path = Path(path).resolve()
+        stat = path.stat()
+        digests_file = self.root / "digests.json"
+        if self._digests is None:
+            try:
+                self._digests = json.loads(digests_file.read_text())
+            except (OSError, ValueError):
+                self._digests = {}
+        cached = self._digests.get(str(path))
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(4 * 1024 * 1024):
+                digest.update(chunk)
+        self._digests[str(path)] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                                    "sha256": digest.hexdigest()}
+        # concurrent runs may drop each other's entries, which only costs a rehash
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_file = digests_file.with_name(f".digests.{os.getpid()}.tmp")
+        tmp_file.write_text(json.dumps(self._digests))
+        tmp_file.replace(digests_file)
+        return digest.hexdigest()
+
+    def key(self, step: str, params: dict, inputs: list[Path]) -> str:
+        """
+        :param step: step name, part of the key
+        :param params: parameters that change the outputs (not threads / memory)
+        :param inputs: input files, keyed by content so renamed or copied inputs still hit
+        """
+        payload = {
+            "step": step,
+            "params": params,
+            "inputs": [self.file_digest(path) for path in inputs],
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    @contextmanager
+    def building(self, key: str):
+        """
+        held while a run looks up and builds one entry, a second run with the same inputs
+        waits here and then reuses the entry instead of building it again
+        """
+        with self._lock(self.root / "locks" / f"{key}.lock", exclusive=True):
+            yield
+
+    def _place(self, src: Path, dst: Path):
+        """hardlink, or copy with reflink where the filesystem supports it"""
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if dst.exists() or dst.is_symlink():
+            dst.unlink()
+        if self.link == "hardlink":
+            try:
+                os.link(src, dst)
+                return
+            except OSError:
+                # other filesystem (EXDEV) or no hardlink support
+                pass
+        subprocess.run(["cp", "--reflink=auto", "--preserve=timestamps", str(src), str(dst)], check=True)
+
+    def materialize(self, key: str, dest_dir: Path) -> bool:
+        """place the files of an entry into dest_dir, False when the entry does not exist"""
+        entry_dir = self._entry_dir(key)
+        with self._lock(self.root / "store.lock", exclusive=False):
+            manifest_file = entry_dir / "manifest.json"
+            if not manifest_file.exists():
+                ARTIFACT_LOOKUPS.inc(result="miss")
+                return False
+            manifest = json.loads(manifest_file.read_text())
+            for name in manifest['files']:
+                self._place(entry_dir / "files" / name, dest_dir / name)
+            (entry_dir / "last_used").touch()
+        ARTIFACT_LOOKUPS.inc(result="hit")
+        logging.info(f"Reused {manifest['step']} outputs ({len(manifest['files'])} files, "
+                     f"{manifest['size'] / GiB:.1f} GiB) from artifact store entry {key[:12]}")
+        return True
+
+    def publish(self, key: str, step: str, base_dir: Path, files: list[Path]):
+        """
+        add the outputs of a finished step, a failure is logged and leaves the outputs in the work_dir
+        :param base_dir: files are stored relative to it and materialized relative to dest_dir
+        """
+        staging = self.root / "tmp" / f"{key}.{os.getpid()}"
+        try:
+            self._publish(key, step, base_dir, files, staging)
+        except (OSError, subprocess.CalledProcessError) as e:
+            # the step itself succeeded, only the reuse by later runs is lost
+            logging.warning(f"Could not publish {step} outputs to artifact store entry {key[:12]}: {e}")
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def _publish(self, key: str, step: str, base_dir: Path, files: list[Path], staging: Path):
+        entry_dir = self._entry_dir(key)
+        if (entry_dir / "manifest.json").exists():
+            return
+        shutil.rmtree(staging, ignore_errors=True)
+        names = []
+        size = 0
+        for path in files:
+            name = str(path.relative_to(base_dir))
+            self._place(path, staging / "files" / name)
+            # read-only: a tool opening a materialized link for writing fails instead of
+            # changing the entry (root is only protected by detach_links before a rebuild)
+            stored = staging / "files" / name
+            stored.chmod(stored.stat().st_mode & ~0o222)
+            names.append(name)
+            size += path.stat().st_size
+        manifest = {"step": step, "key": key, "files": sorted(names), "size": size, "created": time.time()}
+        (staging / "manifest.json").write_text(json.dumps(manifest, indent=2))
+        (staging / "last_used").touch()
+
+        with self._lock(self.root / "store.lock", exclusive=True):
+            if (entry_dir / "manifest.json").exists():
+                return
+            if entry_dir.exists():
+                # left by an interrupted eviction, an entry without manifest is never read
+                logging.info(f"Removing incomplete artifact store entry {key[:12]}")
+                shutil.rmtree(entry_dir)
+            entry_dir.parent.mkdir(parents=True, exist_ok=True)
+            # same filesystem, readers see either no entry or the complete one
+            staging.rename(entry_dir)
+            logging.info(f"Published {step} outputs ({len(names)} files, {size / GiB:.1f} GiB) "
+                         f"to artifact store entry {key[:12]}")
+            self._evict(keep=key)
+
+    def _evict(self, keep: str):
+        """drop least recently used entries until the store fits MaxSizeGB, store.lock must be held"""
+        if not self.max_size:
+            return
+        entries = []
+        for manifest_file in (self.root / "objects").glob("*/*/manifest.json"):
+            entry_dir = manifest_file.parent
+            try:
+                manifest = json.loads(manifest_file.read_text())
+                last_used = (entry_dir / "last_used").stat().st_mtime
+            except (OSError, ValueError):
+                continue
+            entries.append((last_used, manifest['size'], entry_dir))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_size:
+                break
+            if entry_dir.name == keep:
+                continue
+            # work_dirs keep their hardlinked copies, only the store reference goes away
+            # manifest first: an interrupted removal leaves an entry that is no longer valid
+            (entry_dir / "manifest.json").unlink(missing_ok=True)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            logging.info(f"Evicted artifact store entry {entry_dir.name[:12]} ({size / GiB:.1f} GiB)")
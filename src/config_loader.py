@@ -3,6 +3,8 @@ import logging
 from pathlib import Path
 from typing import Any, Dict, Optional
 
+from src.sharding import parse_shard
+
 class ConfigManager:
     """
     Configuration Manager for Graph Pangenome Pipeline.
@@ -12,15 +14,31 @@ class ConfigManager:
         # Initialize with default structure
         self.config: Dict[str, Any] = {
             "Global": {},
+            "ArtifactStore": {"path": "", "MaxSizeGB": 0, "Link": "hardlink"},
+            "AutoTune": {"enable": False, "ReserveCores": 0, "ReserveMemGB": 4, "MinThreads": 4},
             "Cactus": {"maxCores": 1, "singularityImage": ""},
+            "Preprocess": {"enable": False, "Parallel_job": 1, "Threads": 1},
             "CactusOutFormat": {"vcf": True, "gfa": True, "gbz": True},
             "VgStats": {"stats": True, "paths": True},
-            "VgIndex": {"autoindex": True, "threads": 1},
-            "Annotation": {"singularityImage": ""},
+            "VgIndex": {"autoindex": True, "threads": 1, "longread": "auto"},
+            "Annotation": {"singularityImage": "", "index": True},
             "Gaf": {"Gaf": True},
             "ann": {"annotation": True},
-            "wgs": {"Parallel_job": 1, "Threads": 1, "MinMapQ": 0},
-            "call": {"Parallel_job": 1, "Threads": 1}
+            "wgs": {"Parallel_job": 1, "Threads": 1, "MinMapQ": 0, "Personalized": False, "KmerMemGB": 16,
+                    "BaselineSamples": 0, "LongReadChunks": 1, "ChunkMinGB": 10},
+            "rna": {"Parallel_job": 1, "Threads": 1},
+            "call": {"Parallel_job": 1, "Threads": 1, "mode": "denovo", "BaselineSamples": 0},
+            "merge": {"Parallel_job": 1, "Threads": 1, "MaxOpenFiles": 128, "SortMemory": "1G"},
+            "GenotypeStore": {"ChunkSize": 1000000, "Ploidy": 2, "Parallel_job": 1, "BatchSize": 64},
+            "Admission": {"enable": True, "ReserveMemGB": 2, "MemPerJobGB": 0, "PollInterval": 5},
+            "Progress": {"enable": True, "RefreshInterval": 2, "LogInterval": 300},
+            "Speculation": {"enable": False, "SlowdownFactor": 2.0, "MinPeers": 3, "SimilarSize": 2.0},
+            "Watch": {"InputDir": "", "StableSeconds": 60, "SingleEndAfter": 600, "PollInterval": 30, "IdleExit": 0,
+                      "ReadType": "auto"},
+            "Serve": {"address": "127.0.0.1", "port": 8765, "CacheMB": 256, "MaxPaths": 64, "Context": 1,
+                      "MaxContext": 10, "MaxRegion": 10000000},
+            "Shard": {"shard": ""},
+            "Metrics": {"textfile": "", "port": 0, "address": "127.0.0.1", "Interval": 15}
         }
         if config_path and Path(config_path).exists():
             self.load_config(config_path)
@@ -79,4 +97,17 @@ class ConfigManager:
             if not self.config.get("wgs", {}).get("DataTable"):
                 raise ValueError("WGS module requires 'DataTable' (--wgs-data)")
 
+        if self.config.get("Shard", {}).get("shard"):
+            parse_shard(self.config["Shard"]["shard"])
+            shared = [m for m in ("cactus", "vg", "annotation", "merge", "export", "rna") if run_modules.get(m)]
+            if shared:
+                raise ValueError(f"--shard only splits the per-sample wgs / call steps, run {', '.join(shared)} "
+                                 f"once without it")
+
+        if run_modules.get("rna"):
+            if not self.config.get("rna", {}).get("DataTable"):
+                raise ValueError("RNA-seq module requires 'DataTable' (--rna-data)")
+            if not self.config.get("rna", {}).get("gff3"):
+                raise ValueError("RNA-seq module requires 'gff3' (--rna-gff)")
+
         return True
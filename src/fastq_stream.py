@@ -0,0 +1,143 @@
+import csv
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+# several lane files of one mate in a single DataTable cell
+LANE_SEPARATOR = ";"
+
+
+def split_fastqs(cell: str | None) -> list[str]:
+    """lane files of one DataTable cell (R1 / R2), empty list for an empty cell"""
+    if not cell:
+        return []
+    return [path.strip() for path in cell.split(LANE_SEPARATOR) if path.strip()]
+
+
+def read_data_table(path: str | Path) -> list[dict]:
+    """
+    rows of a sample DataTable (SampleID, R1, R2), shared by the wgs and rna modules
+    rows without SampleID / R1 and rows whose mates have a different number of lanes are skipped,
+    a SampleID listed twice with the same files is kept once, with different files it is an error
+    """
+    samples = []
+    seen: dict[str, dict] = {}
+    conflicts = set()
+    try:
+        with open(path, 'r', newline='') as f:
+            reader = csv.DictReader(f, skipinitialspace=True)
+            for row in reader:
+                if 'SampleID' not in row or 'R1' not in row:
+                    logging.warning("Skipping row (missing SampleID or R1)")
+                    continue
+                r2_lanes = split_fastqs(row.get('R2'))
+                if r2_lanes and len(r2_lanes) != len(split_fastqs(row['R1'])):
+                    logging.warning(f"Skipping {row['SampleID']} (R1 and R2 have a different number of lanes)")
+                    continue
+                first = seen.get(row['SampleID'])
+                if first is not None:
+                    # samples are keyed by SampleID, a second row would silently replace the first job
+                    if (split_fastqs(first['R1']), split_fastqs(first.get('R2'))) != \
+                            (split_fastqs(row['R1']), split_fastqs(row.get('R2'))):
+                        conflicts.add(row['SampleID'])
+                    else:
+                        logging.warning(f"Skipping duplicated row of {row['SampleID']} (same FASTQ files)")
+                    continue
+                seen[row['SampleID']] = row
+                samples.append(row)
+    except Exception as e:
+        logging.error(f"Error parsing CSV: {e}")
+        sys.exit(1)
+    if conflicts:
+        logging.error(f"SampleID listed more than once with different FASTQ files in {path}: "
+                      f"{', '.join(sorted(conflicts))}; use one row per sample, lanes separated by '{LANE_SEPARATOR}'")
+        sys.exit(1)
+    return samples
+
+
+def fastq_bytes(cells: list[str | None]) -> int:
+    """on-disk size of every existing lane file of the given cells"""
+    return sum(Path(path).stat().st_size for cell in cells for path in split_fastqs(cell) if Path(path).exists())
+
+
+def decompress_command(path: str, threads: int) -> list:
+    """pigz decompresses with separate read / write / check threads, gzip is the fallback"""
+    if not path.endswith(".gz"):
+        return ["cat", path]
+    if shutil.which("pigz"):
+        return ["pigz", "-dc", "-p", str(threads), path]
+    return ["gzip", "-dc", path]
+
+
+class LaneStream:
+    """
+    Present the lanes of each mate as one fastq stream
+    A mate with a single file is passed through unchanged. Several lanes are decompressed in
+    order into a fifo, the mates side by side, so the mapper reads one logical input and no
+    merged copy is written. Lane i of R1 and lane i of R2 stay paired because both mates
+    are streamed in DataTable order.
+
+        stream = LaneStream([r1_lanes, r2_lanes], sample_dir)
+        with stream as reads:
+            subprocess.run(["vg", "giraffe", "-f", reads[0], "-f", reads[1], ...])
+        if stream.errors: ...  # a lane failed, the mapper saw a truncated input
+    """
+    def __init__(self, mates: list[list[str]], work_dir: Path, threads: int = 2, name: str = "lanes"):
+        self.mates = [lanes for lanes in mates if lanes]
+        self.work_dir = work_dir
+        self.threads = max(1, threads)
+        self.name = name
+        self.fifos: list[Path] = []
+        self.feeders: list[threading.Thread] = []
+        self.errors: list[str] = []
+
+    def _feed(self, fifo: Path, lanes: list[str]):
+        try:
+            # blocks until the mapper opens its input
+            fd = os.open(fifo, os.O_WRONLY)
+        except OSError as e:
+            self.errors.append(f"{fifo.name}: {e}")
+            return
+        try:
+            for lane in lanes:
+                result = subprocess.run(decompress_command(lane, self.threads), stdout=fd, stderr=subprocess.PIPE)
+                if result.returncode != 0:
+                    self.errors.append(f"{lane}: exit {result.returncode} {result.stderr.decode(errors='replace').strip()}")
+                    break
+        finally:
+            os.close(fd)
+
+    def __enter__(self) -> list[str]:
+        paths = []
+        for mate, lanes in enumerate(self.mates, start=1):
+            if len(lanes) == 1:
+                paths.append(lanes[0])
+                continue
+            fifo = self.work_dir / f".{self.name}.R{mate}.fq"
+            fifo.unlink(missing_ok=True)
+            os.mkfifo(fifo)
+            feeder = threading.Thread(target=self._feed, args=(fifo, lanes), daemon=True)
+            feeder.start()
+            self.fifos.append(fifo)
+            self.feeders.append(feeder)
+            paths.append(str(fifo))
+            logging.info(f"streaming {len(lanes)} lanes of R{mate} through {fifo.name}")
+        return paths
+
+    def __exit__(self, *exc):
+        for fifo, feeder in zip(self.fifos, self.feeders):
+            while feeder.is_alive():
+                # the mapper is gone: a feeder still waiting for a reader is released by a
+                # throwaway reader, a writing one gets EPIPE
+                try:
+                    os.close(os.open(fifo, os.O_RDONLY | os.O_NONBLOCK))
+                except OSError:
+                    pass
+                feeder.join(timeout=1)
+            fifo.unlink(missing_ok=True)
+        return False
+
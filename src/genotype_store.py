@@ -0,0 +1,362 @@
+import json
+import logging
+import mmap
+import os
+import sys
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+STORE_VERSION = 1
+MISSING_ALLELE = -1
+MAX_DEPTH = 65535
+# dtype of every per-chunk array, numpy notation so the files can be opened with numpy.memmap
+DTYPES = {"pos": "<i8", "gt": "<i1", "dp": "<u2"}
+ARRAY_CODES = {"pos": "q", "gt": "b", "dp": "H"}
+
+
+def _parse_gt(gt: str, ploidy: int) -> list[int]:
+    """'0/1' -> [0, 1], missing alleles -> -1, padded/cut to ploidy"""
+    alleles = []
+    for allele in gt.replace("|", "/").split("/"):
+        alleles.append(int(allele) if allele.isdigit() and int(allele) < 128 else MISSING_ALLELE)
+    return (alleles + [MISSING_ALLELE] * ploidy)[:ploidy]
+
+
+def read_sample_calls(vcf: Path, chunk_size: int, ploidy: int) -> dict[tuple[str, int], dict]:
+    """
+    calls of one single-sample VCF grouped by chunk, runs in a worker process
+    :return: {(contig, bin): {(pos, ref, alt): (alleles, depth)}}
+    """
+    chunks: dict[tuple[str, int], dict] = {}
+    with open(vcf, 'r') as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 10:
+                continue
+            contig, pos = fields[0], int(fields[1])
+            values = dict(zip(fields[8].split(":"), fields[9].split(":")))
+            depth = values.get("DP", "")
+            depth = min(int(depth), MAX_DEPTH) if depth.isdigit() else 0
+            key = (pos, fields[3], fields[4])
+            chunks.setdefault((contig, pos // chunk_size), {})[key] = (
+                _parse_gt(values.get("GT", "."), ploidy), depth)
+    return chunks
+
+
+class GenotypeStore:
+    """
+    Chunked, columnar on-disk genotype store
+    Every chunk covers ChunkSize bp of one contig and holds flat little-endian arrays:
+    pos (n_variants), gt (n_samples x n_variants x ploidy) and dp (n_samples x n_variants),
+    sample-major so new samples are appended as rows. REF/ALT/ID live in variants.tsv.
+    """
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.meta_file = self.path / "store.json"
+        if self.meta_file.exists():
+            with open(self.meta_file, 'r') as f:
+                self.meta = json.load(f)
+        else:
+            self.meta = {"version": STORE_VERSION, "ploidy": 2, "chunk_size": 1_000_000,
+                         "dtypes": DTYPES, "samples": [], "contigs": [], "chunks": {}}
+
+    @property
+    def samples(self) -> list[str]:
+        return self.meta['samples']
+
+    @property
+    def ploidy(self) -> int:
+        return self.meta['ploidy']
+
+    def save(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.meta_file.with_suffix(".tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(self.meta, f, indent=1)
+        tmp_file.replace(self.meta_file)
+
+    def chunk_dir(self, chunk: str) -> Path:
+        return self.path / "chunks" / chunk
+
+    def _chunk_name(self, contig: str, bin_index: int) -> str:
+        if contig not in self.meta['contigs']:
+            self.meta['contigs'].append(contig)
+        return f"{self.meta['contigs'].index(contig):04d}_{bin_index:06d}"
+
+    def _file(self, chunk: str, name: str, generation: int | None = None) -> Path:
+        """
+        file of one chunk array (or "variants"), a rebuilt chunk is written as a new generation
+        that store.json switches to, generation 0 keeps the plain names
+        """
+        if generation is None:
+            generation = self.meta['chunks'][chunk].get('generation', 0)
+        suffix = "tsv" if name == "variants" else "bin"
+        tag = f".{generation}" if generation else ""
+        return self.chunk_dir(chunk) / f"{name}{tag}.{suffix}"
+
+    # ---read access---
+    @contextmanager
+    def _mapped(self, chunk: str, name: str):
+        """read-only mmap of one chunk array, None when the array is empty"""
+        with open(self._file(chunk, name), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield None
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                yield m
+
+    @staticmethod
+    def _take(m: mmap.mmap | None, name: str, start: int, count: int) -> array:
+        """values start..start+count of a mapped array, only these pages are read"""
+        values = array(ARRAY_CODES[name])
+        if m is not None and count > 0:
+            values.frombytes(m[start * values.itemsize:(start + count) * values.itemsize])
+        return values
+
+    def _read(self, chunk: str, name: str) -> array:
+        """whole array of a chunk, rows beyond the committed sample count are ignored"""
+        info = self.meta['chunks'][chunk]
+        n_values = info['n_variants']
+        if name == "gt":
+            n_values *= len(self.samples) * self.ploidy
+        elif name == "dp":
+            n_values *= len(self.samples)
+        with self._mapped(chunk, name) as m:
+            return self._take(m, name, 0, n_values)
+
+    def numpy_array(self, chunk: str, name: str):
+        """numpy.memmap of one chunk array, shaped (n_samples, n_variants[, ploidy])"""
+        import numpy as np
+
+        info = self.meta['chunks'][chunk]
+        shape = {
+            "pos": (info['n_variants'],),
+            "gt": (len(self.samples), info['n_variants'], self.ploidy),
+            "dp": (len(self.samples), info['n_variants']),
+        }[name]
+        return np.memmap(self._file(chunk, name), dtype=DTYPES[name], mode='r', shape=shape)
+
+    def variants(self, chunk: str) -> list[tuple[int, str, str]]:
+        """(pos, ref, alt) of a chunk in store order"""
+        with open(self._file(chunk, "variants"), 'r') as f:
+            return [(int(p), r, a) for p, r, a in (line.rstrip("\n").split("\t") for line in f)]
+
+    def chunks_in(self, contig: str, start: int, end: int) -> list[str]:
+        return sorted(
+            name for name, info in self.meta['chunks'].items()
+            if info['contig'] == contig and info['start'] < end and info['end'] > start
+        )
+
+    def region(self, contig: str, start: int, end: int, samples: list[str] | None = None) -> list[dict]:
+        """
+        genotypes of all variants in [start, end) of contig
+        :return: [{"pos", "ref", "alt", "gt": {sample: alleles}, "dp": {sample: depth}}]
+        """
+        samples = samples or self.samples
+        rows = [self.samples.index(s) for s in samples]
+        ploidy = self.ploidy
+        result = []
+        for chunk in self.chunks_in(contig, start, end):
+            n_variants = self.meta['chunks'][chunk]['n_variants']
+            # variants are sorted by position: the sites in range are one slice of every row
+            with self._mapped(chunk, "pos") as m:
+                positions = self._take(m, "pos", 0, n_variants)
+            first, last = bisect_left(positions, start), bisect_left(positions, end)
+            if first == last:
+                continue
+            with self._mapped(chunk, "gt") as gt_map, self._mapped(chunk, "dp") as dp_map:
+                gt = {s: self._take(gt_map, "gt", (r * n_variants + first) * ploidy, (last - first) * ploidy)
+                      for s, r in zip(samples, rows)}
+                dp = {s: self._take(dp_map, "dp", r * n_variants + first, last - first)
+                      for s, r in zip(samples, rows)}
+            for i, (pos, ref, alt) in enumerate(self.variants(chunk)[first:last]):
+                result.append({
+                    "pos": pos, "ref": ref, "alt": alt,
+                    "gt": {s: gt[s][i * ploidy:(i + 1) * ploidy].tolist() for s in samples},
+                    "dp": {s: dp[s][i] for s in samples},
+                })
+        return result
+
+    def sample(self, sample_id: str, contig: str | None = None) -> list[tuple[str, int, list[int], int]]:
+        """non-missing calls of one sample as (contig, pos, alleles, depth)"""
+        row = self.samples.index(sample_id)
+        ploidy = self.ploidy
+        calls = []
+        for chunk in sorted(self.meta['chunks']):
+            info = self.meta['chunks'][chunk]
+            if contig and info['contig'] != contig:
+                continue
+            n_variants = info['n_variants']
+            # only the row of this sample
+            with self._mapped(chunk, "gt") as gt_map, self._mapped(chunk, "dp") as dp_map:
+                gt = self._take(gt_map, "gt", row * n_variants * ploidy, n_variants * ploidy)
+                dp = self._take(dp_map, "dp", row * n_variants, n_variants)
+            for i, (pos, _, _) in enumerate(self.variants(chunk)):
+                alleles = gt[i * ploidy:(i + 1) * ploidy].tolist()
+                if any(a != MISSING_ALLELE for a in alleles):
+                    calls.append((info['contig'], pos, alleles, dp[i]))
+        return calls
+
+    # ---write access---
+    def _write_chunk(self, chunk: str, generation: int, variants: list[tuple[int, str, str]], gt: array, dp: array):
+        """write all files of one chunk generation, not visible until store.json points to it"""
+        self.chunk_dir(chunk).mkdir(parents=True, exist_ok=True)
+        for name, values in (("pos", array("q", [v[0] for v in variants])), ("gt", gt), ("dp", dp)):
+            file = self._file(chunk, name, generation)
+            tmp_file = file.with_name(file.name + ".tmp")
+            with open(tmp_file, 'wb') as f:
+                values.tofile(f)
+            tmp_file.replace(file)
+        file = self._file(chunk, "variants", generation)
+        tmp_file = file.with_name(file.name + ".tmp")
+        with open(tmp_file, 'w') as f:
+            f.writelines(f"{p}\t{r}\t{a}\n" for p, r, a in variants)
+        tmp_file.replace(file)
+
+    def append_samples(self, new_samples: list[str], calls: dict[str, dict]):
+        """
+        append a batch of samples
+        chunks whose variant set is unchanged get new rows appended in place,
+        chunks with new sites are rebuilt with the old rows remapped
+        :param calls: {sample: {(contig, bin): {(pos, ref, alt): (alleles, depth)}}}
+        """
+        ploidy = self.ploidy
+        old_count = len(self.samples)
+        missing = array("b", [MISSING_ALLELE] * ploidy)
+
+        touched: dict[str, tuple[str, int]] = {
+            self._chunk_name(contig, bin_index): (contig, bin_index)
+            for sample_calls in calls.values() for contig, bin_index in sample_calls
+        }
+        # chunks the batch has no call in still need rows for the new samples
+        for chunk, info in self.meta['chunks'].items():
+            touched.setdefault(chunk, (info['contig'], info['start'] // self.meta['chunk_size']))
+
+        # generations replaced by this batch, removed once store.json no longer points to them
+        replaced: list[tuple[str, int]] = []
+        for chunk, (contig, bin_index) in sorted(touched.items()):
+            stored = chunk in self.meta['chunks']
+            known = self.variants(chunk) if stored else []
+            generation = self.meta['chunks'][chunk].get('generation', 0) if stored else 0
+            gt_old = self._read(chunk, "gt") if known else array("b")
+            dp_old = self._read(chunk, "dp") if known else array("H")
+
+            sites = set(known)
+            for sample in new_samples:
+                sites.update(calls[sample].get((contig, bin_index), {}))
+            variants = sorted(sites)
+
+            gt_new, dp_new = array("b"), array("H")
+            for sample in new_samples:
+                sample_calls = calls[sample].get((contig, bin_index), {})
+                for site in variants:
+                    alleles, depth = sample_calls.get(site, (missing, 0))
+                    gt_new.extend(alleles)
+                    dp_new.append(depth)
+
+            if variants == known:
+                # append the new rows to the existing files, dropping rows of an interrupted append
+                for name, values, width in (("gt", gt_new, ploidy), ("dp", dp_new, 1)):
+                    with open(self._file(chunk, name, generation), 'r+b') as f:
+                        f.truncate(old_count * len(known) * width * values.itemsize)
+                        f.seek(0, 2)
+                        values.tofile(f)
+            else:
+                index = {site: i for i, site in enumerate(variants)}
+                gt_all = array("b", [MISSING_ALLELE] * (old_count * len(variants) * ploidy))
+                dp_all = array("H", [0] * (old_count * len(variants)))
+                for row in range(old_count):
+                    for j, site in enumerate(known):
+                        i = index[site]
+                        src, dst = row * len(known) + j, row * len(variants) + i
+                        gt_all[dst * ploidy:(dst + 1) * ploidy] = gt_old[src * ploidy:(src + 1) * ploidy]
+                        dp_all[dst] = dp_old[src]
+                gt_all.extend(gt_new)
+                dp_all.extend(dp_new)
+                # a new generation: until store.json is replaced, readers and an interrupted
+                # run still see the old files with the old samples and sites
+                if stored:
+                    replaced.append((chunk, generation))
+                    generation += 1
+                self._write_chunk(chunk, generation, variants, gt_all, dp_all)
+
+            chunk_size = self.meta['chunk_size']
+            self.meta['chunks'][chunk] = {"contig": contig, "start": bin_index * chunk_size,
+                                          "end": (bin_index + 1) * chunk_size, "n_variants": len(variants),
+                                          "generation": generation}
+
+        self.meta['samples'].extend(new_samples)
+        self.save()
+        for chunk, generation in replaced:
+            for name in ("pos", "gt", "dp", "variants"):
+                self._file(chunk, name, generation).unlink(missing_ok=True)
+
+
+class GenotypeExportRunner:
+    """
+    Export the per-sample vg call VCFs into the genotype store (8.genotype_store)
+    Samples already in the store are skipped, so re-running only appends new samples.
+    """
+    def __init__(self, config: dict):
+        self.config = config
+        self.GenotypeStore: dict = self.config['GenotypeStore']
+        self.work_dir: Path = Path(self.config['Global']['work_dir']).resolve()
+        self.call_dir: Path = self.work_dir / "6.call_variant"
+        self.store_dir: Path = self.work_dir / "8.genotype_store"
+
+    def _parsing_path(self) -> list[Path]:
+        return sorted(self.call_dir.glob("*/*.vcf"))
+
+    def run_export(self):
+        vcf_files = self._parsing_path()
+        if not vcf_files:
+            logging.error(f"No per-sample VCF found in {self.call_dir}. Please run vg call first.")
+            sys.exit(1)
+
+        store = GenotypeStore(self.store_dir)
+        if not store.meta_file.exists():
+            store.meta['chunk_size'] = self.GenotypeStore['ChunkSize']
+            store.meta['ploidy'] = self.GenotypeStore['Ploidy']
+        pending = [vcf for vcf in vcf_files if vcf.stem not in store.samples]
+        if not pending:
+            logging.info(f"All {len(vcf_files)} samples are already in the genotype store.")
+            return
+        logging.info(f"Exporting {len(pending)} new samples into {self.store_dir} "
+                     f"({len(store.samples)} already stored).")
+
+        parallel_job = self.GenotypeStore.get('Parallel_job', 1)
+        batch_size = max(1, self.GenotypeStore['BatchSize'])
+        with ProcessPoolExecutor(max_workers=parallel_job) as executor:
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                future_to_vcf = {
+                    executor.submit(read_sample_calls, vcf, store.meta['chunk_size'], store.ploidy): vcf
+                    for vcf in batch
+                }
+                calls = {}
+                for future in as_completed(future_to_vcf):
+                    vcf = future_to_vcf[future]
+                    try:
+                        calls[vcf.stem] = future.result()
+                    except Exception as e:
+                        logging.error(f">>> Sample {vcf.stem} could not be read: {e}")
+                # keep the input order so that row order is reproducible
+                batch_samples = [vcf.stem for vcf in batch if vcf.stem in calls]
+                store.append_samples(batch_samples, calls)
+                logging.info(f">>> Stored {len(store.samples)} samples, {len(store.meta['chunks'])} chunks")
+
+if __name__ == "__main__":
+    from src.config_loader import ConfigManager
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    # This is mainly for local testing
+    config_path = sys.argv[1] if len(sys.argv) > 1 else "config/config.toml"
+    cfg = ConfigManager(config_path).get_config()
+    runner = GenotypeExportRunner(cfg)
+    runner.run_export()
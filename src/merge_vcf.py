@@ -0,0 +1,384 @@
+import heapq
+import logging
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import IO, Iterator
+
+from src.scheduler import build_scheduler
+from src.resource_planner import GiB
+
+MISSING_GT = "./."
+NS_HEADER = '##INFO=<ID=NS,Number=1,Type=Integer,Description="Number of samples with a call">'
+
+
+def _records(stream: IO[str]) -> Iterator[list[str]]:
+    """vcf body records of a stream as field lists"""
+    for line in stream:
+        if line.startswith("#"):
+            continue
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) >= 8:
+            yield fields
+
+
+def merge_streams(streams: list[Iterator[list[str]]], sample_counts: list[int], out: IO[str]) -> dict[int, int]:
+    """
+    heap based k-way merge of position sorted record streams of one contig
+    records with the same POS/REF/ALT are combined into one line, inputs without the
+    site get missing genotypes. Memory is one record per input.
+    :param sample_counts: number of sample columns of every stream
+    :return: records dropped per stream index, a site repeated inside one stream keeps its last record
+    """
+    dropped: dict[int, int] = {}
+    heap = []
+    for index, stream in enumerate(streams):
+        record = next(stream, None)
+        if record is not None:
+            heap.append((int(record[1]), record[3], record[4], index, record))
+    heapq.heapify(heap)
+
+    while heap:
+        pos, ref, alt, _, _ = heap[0]
+        group: dict[int, list[str]] = {}
+        while heap and heap[0][:3] == (pos, ref, alt):
+            _, _, _, index, record = heapq.heappop(heap)
+            # a duplicated site inside one input: the later record wins
+            if index in group:
+                dropped[index] = dropped.get(index, 0) + 1
+            group[index] = record
+            following = next(streams[index], None)
+            if following is not None:
+                heapq.heappush(heap, (int(following[1]), following[3], following[4], index, following))
+        out.write(_combine(group, sample_counts) + "\n")
+    return dropped
+
+
+def _combine(group: dict[int, list[str]], sample_counts: list[int]) -> str:
+    """one merged line from the records of the same site"""
+    first = group[min(group)]
+    ids = [r[2] for r in group.values() if r[2] != "."]
+    quals = [float(r[5]) for r in group.values() if r[5] != "."]
+    filters = {r[6] for r in group.values()}
+    failed = sorted(f for f in filters if f not in ("PASS", "."))
+
+    # FORMAT is the union of all keys, GT first
+    format_keys = ["GT"]
+    for record in group.values():
+        if len(record) > 8:
+            for key in record[8].split(":"):
+                if key not in format_keys:
+                    format_keys.append(key)
+
+    columns = []
+    called = 0
+    for index, count in enumerate(sample_counts):
+        record = group.get(index)
+        if record is None or len(record) <= 8:
+            columns.extend([MISSING_GT] * count)
+            continue
+        keys = record[8].split(":")
+        for sample in record[9:9 + count]:
+            values = dict(zip(keys, sample.split(":")))
+            gt = values.get("GT", MISSING_GT)
+            if gt.replace("/", "").replace("|", "").strip("."):
+                called += 1
+            columns.append(":".join(values.get(key, ".") for key in format_keys))
+        if len(record) - 9 < count:
+            columns.extend([MISSING_GT] * (count - len(record) + 9))
+
+    fields = [
+        first[0], first[1],
+        ids[0] if ids else ".",
+        first[3], first[4],
+        f"{max(quals):g}" if quals else ".",
+        filters.pop() if len(filters) == 1 else ";".join(failed) or "PASS",
+        f"NS={called}",
+        ":".join(format_keys),
+    ]
+    return "\t".join(fields + columns)
+
+
+class VcfMergeRunner:
+    """
+    Merge the per-sample vg call VCFs into one cohort VCF
+    Inputs are sorted, bgzipped and indexed once, then every contig is merged in parallel
+    by a streaming k-way merge. At most MaxOpenFiles inputs are open per merge, larger
+    cohorts are merged hierarchically through intermediate batch files.
+    """
+    def __init__(self, config: dict):
+        self.config = config
+        self.Global: dict = self.config['Global']
+        self.merge: dict = self.config['merge']
+
+        self.work_dir: Path = Path(self.Global['work_dir']).resolve()
+        self.call_dir: Path = self.work_dir / "6.call_variant"
+        self.merge_dir: Path = self.work_dir / "7.merge_vcf"
+        self.input_dir: Path = self.merge_dir / "inputs"
+        self.tmp_dir: Path = self.merge_dir / "tmp"
+        self.merged_vcf: Path = self.merge_dir / f"{self.Global['filePrefix']}.merged.vcf.gz"
+
+    def _parsing_path(self) -> list[Path]:
+        """per-sample VCFs written by CallVariantRunner"""
+        return sorted(self.call_dir.glob("*/*.vcf"))
+
+    def _prepare_input(self, vcf: Path) -> bool:
+        """sort by contig/position, bgzip and tabix one per-sample vcf (skipped when up to date)"""
+        sample_id = vcf.stem
+        output = self.input_dir / f"{sample_id}.vcf.gz"
+        index = output.with_name(output.name + ".tbi")
+        if index.exists() and output.stat().st_mtime >= vcf.stat().st_mtime:
+            return True
+
+        threads = str(self.merge['Threads'])
+        sort_tmp = self.tmp_dir / f"sort_{sample_id}"
+        sort_tmp.mkdir(parents=True, exist_ok=True)
+        # same order as the merge heap: contig, position, then REF/ALT byte order
+        sort_cmd = ["sort", "-k1,1", "-k2,2n", "-k4,4", "-k5,5", "-S", str(self.merge['SortMemory']), "-T", str(sort_tmp)]
+        try:
+            with open(output, "wb") as out, open(vcf, "r") as f:
+                bgzip = subprocess.Popen(["bgzip", "-@", threads, "-c"], stdin=subprocess.PIPE, stdout=out, text=True)
+                body = None
+                for line in f:
+                    if line.startswith("#"):
+                        bgzip.stdin.write(line)
+                        continue
+                    body = line
+                    break
+                bgzip.stdin.flush()
+                # sort writes only after reading all input, so the header is already in front
+                sort = subprocess.Popen(sort_cmd, stdin=subprocess.PIPE, stdout=bgzip.stdin, text=True,
+                                        env={**os.environ, "LC_ALL": "C"})
+                if body:
+                    sort.stdin.write(body)
+                    shutil.copyfileobj(f, sort.stdin)
+                sort.stdin.close()
+                sort_code = sort.wait()
+                bgzip.stdin.close()
+                bgzip_code = bgzip.wait()
+            if sort_code or bgzip_code:
+                logging.error(f"Sample: [{sample_id}] sort/bgzip error: {sort_code}/{bgzip_code}")
+                return False
+            subprocess.run(["tabix", "-f", "-p", "vcf", str(output)], check=True, stderr=subprocess.PIPE, text=True)
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Sample: [{sample_id}] tabix error: {e.returncode}, stderr: {e.stderr}")
+            return False
+        finally:
+            shutil.rmtree(sort_tmp, ignore_errors=True)
+        return True
+
+    @staticmethod
+    def _read_header(vcf_gz: Path) -> tuple[list[str], list[str]]:
+        """(meta lines, sample names) of a bgzipped vcf"""
+        meta, samples = [], []
+        result = subprocess.run(["tabix", "-H", str(vcf_gz)], check=True, capture_output=True, text=True)
+        for line in result.stdout.splitlines():
+            if line.startswith("##"):
+                meta.append(line)
+            elif line.startswith("#CHROM"):
+                samples = line.split("\t")[9:]
+        return meta, samples
+
+    def _build_header(self, inputs: list[Path]) -> tuple[str, list[int], list[str]]:
+        """
+        union of the input meta lines (INFO replaced by NS) and the cohort sample columns
+        single-sample VCFs are named after their sample directory
+        :return: (header text, sample count per input, contigs in header order)
+        """
+        meta_lines = []
+        seen = set()
+        sample_counts = []
+        sample_names = []
+        for vcf_gz in inputs:
+            meta, samples = self._read_header(vcf_gz)
+            for line in meta:
+                if line.startswith("##INFO") or line.startswith("##fileformat") or line in seen:
+                    continue
+                seen.add(line)
+                meta_lines.append(line)
+            sample_counts.append(max(1, len(samples)))
+            sample_names.extend([vcf_gz.name.removesuffix(".vcf.gz")] if len(samples) <= 1 else samples)
+
+        contigs = [line.split("ID=", 1)[1].split(",")[0].rstrip(">")
+                   for line in meta_lines if line.startswith("##contig=<")]
+        for vcf_gz in inputs:
+            listed = subprocess.run(["tabix", "-l", str(vcf_gz)], check=True, capture_output=True, text=True)
+            for contig in listed.stdout.split():
+                if contig not in contigs:
+                    contigs.append(contig)
+
+        columns = ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO", "FORMAT"] + sample_names
+        header = "\n".join(["##fileformat=VCFv4.2", NS_HEADER] + meta_lines + ["\t".join(columns)]) + "\n"
+        return header, sample_counts, contigs
+
+    def _merge_contig(self, contig_index: int, contig: str, inputs: list[Path],
+                      sample_counts: list[int]) -> Path | None:
+        """
+        merge one contig of all inputs into a headerless bgzip part, runs in a worker process
+        batches of MaxOpenFiles inputs are merged into intermediate files until one stream is left
+        """
+        max_open = max(2, self.merge['MaxOpenFiles'])
+        part = self.merge_dir / "parts" / f"{contig_index:05d}.vcf.gz"
+        contig_tmp = self.tmp_dir / f"{contig_index:05d}"
+        contig_tmp.mkdir(parents=True, exist_ok=True)
+
+        # level 0 sources are tabix region streams, later levels are intermediate text files
+        sources: list[tuple[Path, int]] = list(zip(inputs, sample_counts))
+        level = 0
+        try:
+            while True:
+                batches = [sources[i:i + max_open] for i in range(0, len(sources), max_open)]
+                final = len(batches) == 1
+                next_sources = []
+                for batch_index, batch in enumerate(batches):
+                    target = part if final else contig_tmp / f"level{level}_{batch_index:05d}.vcf"
+                    if not self._merge_batch(contig, batch, level, target, compress=final):
+                        return None
+                    if level > 0:
+                        for source, _ in batch:
+                            source.unlink(missing_ok=True)
+                    if not final:
+                        next_sources.append((target, sum(count for _, count in batch)))
+                if final:
+                    break
+                sources = next_sources
+                level += 1
+        finally:
+            shutil.rmtree(contig_tmp, ignore_errors=True)
+        return part
+
+    @staticmethod
+    def _merge_batch(contig: str, batch: list[tuple[Path, int]], level: int, target: Path, compress: bool) -> bool:
+        """
+        merge one batch of sources into target (bgzip when compress), every reader, writer and
+        child process is closed and reaped on success and on failure
+        """
+        procs, handles, streams = [], [], []
+        bgzip = None
+        ok = False
+        out_file = open(target, "wb" if compress else "w")
+        try:
+            if compress:
+                bgzip = subprocess.Popen(["bgzip", "-c"], stdin=subprocess.PIPE, stdout=out_file, text=True)
+                out = bgzip.stdin
+            else:
+                out = out_file
+            for source, _ in batch:
+                if level == 0:
+                    proc = subprocess.Popen(["tabix", str(source), contig], stdout=subprocess.PIPE, text=True)
+                    procs.append(proc)
+                    streams.append(_records(proc.stdout))
+                else:
+                    handle = open(source, "r")
+                    handles.append(handle)
+                    streams.append(_records(handle))
+            dropped = merge_streams(streams, [count for _, count in batch], out)
+            for index, count in dropped.items():
+                logging.warning(f"{batch[index][0].name}: {count} duplicated sites on contig {contig}, "
+                                f"the last record of each was kept")
+
+            for proc, (source, _) in zip(procs, batch):
+                proc.stdout.close()
+                if proc.wait() != 0:
+                    logging.error(f"tabix failed on contig {contig} of {source.name}")
+                    return False
+            out.close()
+            if bgzip and bgzip.wait() != 0:
+                logging.error(f"bgzip failed on contig {contig}")
+                return False
+            ok = True
+            return True
+        finally:
+            for proc in procs:
+                proc.stdout.close()
+                if proc.poll() is None:
+                    proc.terminate()
+                proc.wait()
+            for handle in handles:
+                handle.close()
+            if bgzip:
+                try:
+                    bgzip.stdin.close()
+                except OSError:
+                    pass
+                bgzip.wait()
+            out_file.close()
+            if not ok:
+                target.unlink(missing_ok=True)
+
+    def run_merge(self):
+        """merge all per-sample VCFs into one bgzipped and indexed multi-sample VCF"""
+        vcf_files = self._parsing_path()
+        if not vcf_files:
+            logging.error(f"No per-sample VCF found in {self.call_dir}. Please run vg call first.")
+            sys.exit(1)
+
+        self.input_dir.mkdir(parents=True, exist_ok=True)
+        (self.merge_dir / "parts").mkdir(parents=True, exist_ok=True)
+        parallel_job = self.merge.get('Parallel_job', 1)
+
+        # 1. sort / bgzip / tabix every input once
+        logging.info(f"Indexing {len(vcf_files)} per-sample VCFs with {parallel_job} parallel jobs.")
+        scheduler = build_scheduler(self.config, "merge", parallel_job, self.merge_dir, 1 * GiB)
+        results = scheduler.run(self._prepare_input, {vcf.stem: (vcf,) for vcf in vcf_files})
+        if not all(results.values()):
+            logging.error("Some VCFs could not be indexed, merge aborted.")
+            sys.exit(1)
+
+        inputs = [self.input_dir / f"{vcf.stem}.vcf.gz" for vcf in vcf_files]
+        header, sample_counts, contigs = self._build_header(inputs)
+        logging.info(f"Merging {sum(sample_counts)} samples over {len(contigs)} contigs, "
+                     f"at most {self.merge['MaxOpenFiles']} open inputs per merge.")
+
+        # 2. merge every contig in parallel
+        parts: dict[int, Path] = {}
+        with ProcessPoolExecutor(max_workers=parallel_job) as executor:
+            future_to_contig = {
+                executor.submit(self._merge_contig, index, contig, inputs, sample_counts): (index, contig)
+                for index, contig in enumerate(contigs)
+            }
+            for future in as_completed(future_to_contig):
+                index, contig = future_to_contig[future]
+                try:
+                    part = future.result()
+                except Exception as e:
+                    logging.error(f">>> Contig {contig} crashed with exception: {e}")
+                    part = None
+                if part is None:
+                    logging.error(f">>> Contig {contig}: merge FAILED")
+                    sys.exit(1)
+                logging.info(f">>> Contig {contig}: merge SUCCESS")
+                parts[index] = part
+
+        # 3. bgzip members can be concatenated: header part followed by the contigs in order
+        header_part = self.merge_dir / "parts" / "header.vcf.gz"
+        with open(header_part, "wb") as out:
+            subprocess.run(["bgzip", "-c"], input=header.encode(), stdout=out, check=True)
+        with open(self.merged_vcf, "wb") as out:
+            for part in [header_part] + [parts[i] for i in sorted(parts)]:
+                with open(part, "rb") as f:
+                    shutil.copyfileobj(f, out)
+        try:
+            subprocess.run(["tabix", "-f", "-p", "vcf", str(self.merged_vcf)], check=True,
+                           stderr=subprocess.PIPE, text=True)
+        except subprocess.CalledProcessError as e:
+            logging.error(f"tabix error on merged VCF: {e.returncode}, stderr: {e.stderr}")
+            sys.exit(1)
+
+        shutil.rmtree(self.merge_dir / "parts", ignore_errors=True)
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        logging.info(f"Cohort VCF written to {self.merged_vcf}")
+
+if __name__ == "__main__":
+    from src.config_loader import ConfigManager
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    # This is mainly for local testing
+    config_path = sys.argv[1] if len(sys.argv) > 1 else "config/config.toml"
+    cfg = ConfigManager(config_path).get_config()
+    runner = VcfMergeRunner(cfg)
+    runner.run_merge()
@@ -0,0 +1,246 @@
+import logging
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "graph_pangenome"
+
+# runner -> (config section, threads key) of every runner in src/, None for single-threaded jobs
+RUNNER_THREADS = {
+    "AssemblyPreprocessor": ("Preprocess", "Threads"),
+    "CactusRunner": ("Cactus", "maxCores"),
+    "VgIndexStats": ("VgIndex", "threads"),
+    "VgWgsRunner": ("wgs", "Threads"),
+    "CallVariantRunner": ("call", "Threads"),
+    "VcfMergeRunner": ("merge", "Threads"),
+    "GenotypeExportRunner": ("GenotypeStore", None),
+    "VgRnaRunner": ("rna", "Threads"),
+}
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    """exact sample value: integers (byte counts, counters) in full, floats round-trip"""
+    if isinstance(value, int):
+        return str(int(value))
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+class Metric:
+    """one metric family, samples are keyed by their label values"""
+    def __init__(self, name: str, kind: str, documentation: str, labels: tuple[str, ...]):
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.labels = labels
+        self.samples: dict[tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.samples[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        with self.lock:
+            key = self._key(labels)
+            self.samples[key] = self.samples.get(key, 0) + amount
+
+    def render(self, openmetrics: bool) -> list[str]:
+        # OpenMetrics names the family without _total, the classic text format with it
+        sample_name = f"{self.name}_total" if self.kind == "counter" else self.name
+        family = self.name if openmetrics else sample_name
+        lines = [f"# HELP {family} {self.documentation}", f"# TYPE {family} {self.kind}"]
+        with self.lock:
+            for key, value in sorted(self.samples.items()):
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labels, key))
+                label_text = f"{{{label_text}}}" if label_text else ""
+                lines.append(f"{sample_name}{label_text} {_format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide metric families of the pipeline"""
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+        self.lock = threading.Lock()
+
+    def _get(self, name: str, kind: str, documentation: str, labels: tuple[str, ...]) -> Metric:
+        full_name = f"{PREFIX}_{name}"
+        with self.lock:
+            if full_name not in self.metrics:
+                self.metrics[full_name] = Metric(full_name, kind, documentation, labels)
+            return self.metrics[full_name]
+
+    def counter(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Metric:
+        return self._get(name, "counter", documentation, labels)
+
+    def gauge(self, name: str, documentation: str, labels: tuple[str, ...] = ()) -> Metric:
+        return self._get(name, "gauge", documentation, labels)
+
+    def render(self, openmetrics: bool = True) -> str:
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render(openmetrics))
+        if openmetrics:
+            lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STEP_DURATION = REGISTRY.gauge("step_duration_seconds", "Wall time of the last run of a pipeline step", ("step",))
+STEP_RUNNING = REGISTRY.gauge("step_running", "1 while a pipeline step is running", ("step",))
+QUEUE_DEPTH = REGISTRY.gauge("stage_queue_depth", "Samples waiting to be started", ("stage",))
+ACTIVE_JOBS = REGISTRY.gauge("stage_active_jobs", "Sample jobs currently running", ("stage",))
+SAMPLES = REGISTRY.counter("samples", "Finished sample jobs by status", ("stage", "status"))
+SPECULATIVE = REGISTRY.counter("speculative_attempts", "Speculative copies of straggler samples by outcome",
+                               ("stage", "outcome"))
+ARTIFACT_LOOKUPS = REGISTRY.counter("artifact_store_lookups", "Artifact store lookups by result", ("result",))
+BYTES_WRITTEN = REGISTRY.gauge("stage_bytes_written", "Bytes in the output directory of a stage", ("stage",))
+RUNNER_THREADS_GAUGE = REGISTRY.gauge("runner_threads", "Threads allocated per job of a runner", ("runner",))
+RUNNER_PARALLEL_GAUGE = REGISTRY.gauge("runner_parallel_jobs", "Concurrent jobs allowed for a runner", ("runner",))
+
+
+def directory_size(path: Path) -> int:
+    """total bytes of the regular files below path"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return total
+
+
+def publish_allocation(config: dict):
+    """current thread / parallel job allocation of every runner"""
+    for runner, (section, key) in RUNNER_THREADS.items():
+        values = config.get(section, {})
+        if key is not None and key in values:
+            RUNNER_THREADS_GAUGE.set(values[key], runner=runner)
+        if 'Parallel_job' in values:
+            RUNNER_PARALLEL_GAUGE.set(values['Parallel_job'], runner=runner)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+        body = REGISTRY.render(openmetrics=openmetrics).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # scrapes every few seconds would flood the pipeline log
+        pass
+
+
+class MetricsExporter:
+    """
+    Optional metrics surface of the pipeline
+    A node-exporter textfile rewritten every Interval seconds and/or a local HTTP /metrics endpoint.
+    """
+    def __init__(self, config: dict):
+        self.Metrics: dict = config.get('Metrics', {})
+        textfile = self.Metrics.get('textfile')
+        self.textfile: Path | None = Path(textfile) if textfile else None
+        self.port: int = self.Metrics.get('port', 0)
+        self.address: str = self.Metrics.get('address', "127.0.0.1")
+        self.interval: float = self.Metrics.get('Interval', 15)
+
+        self.server: ThreadingHTTPServer | None = None
+        self.stop_event = threading.Event()
+        self.threads: list[threading.Thread] = []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.textfile or self.port)
+
+    def write_textfile(self):
+        """atomic rewrite, node-exporter must never read a half written file"""
+        if not self.textfile:
+            return
+        self.textfile.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.textfile.with_name(f".{self.textfile.name}.{os.getpid()}.tmp")
+        tmp_file.write_text(REGISTRY.render(openmetrics=False))
+        tmp_file.replace(self.textfile)
+
+    def _textfile_loop(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.write_textfile()
+            except OSError as e:
+                logging.warning(f"Could not write metrics textfile {self.textfile}: {e}")
+
+    def start(self):
+        if self.port:
+            self.server = ThreadingHTTPServer((self.address, self.port), _MetricsHandler)
+            self.server.daemon_threads = True
+            thread = threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+            logging.info(f"Serving metrics on http://{self.address}:{self.server.server_port}/metrics")
+        if self.textfile:
+            thread = threading.Thread(target=self._textfile_loop, name="metrics-textfile", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+            logging.info(f"Writing metrics textfile {self.textfile} every {self.interval}s")
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        self.write_textfile()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+class StepTimer:
+    """time one pipeline step and publish its duration and output size"""
+    def __init__(self, step: str, output_dir: Path | None = None):
+        self.step = step
+        self.output_dir = output_dir
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        STEP_RUNNING.set(1, step=self.step)
+        return self
+
+    def __exit__(self, *exc):
+        STEP_DURATION.set(round(time.monotonic() - self.start, 3), step=self.step)
+        STEP_RUNNING.set(0, step=self.step)
+        if self.output_dir and self.output_dir.exists():
+            BYTES_WRITTEN.set(directory_size(self.output_dir), stage=self.step)
+        return False
@@ -0,0 +1,334 @@
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+# IUPAC nucleotide codes accepted by cactus (soft-masked lowercase is allowed too)
+VALID_BASES = frozenset(b"ACGTUNRYKMSWBDHVacgtunrykmswbdhv")
+# cactus-pangenome uses '#' as PanSN separator, so it can not be part of a contig name
+INVALID_NAME_CHARS = re.compile(r"[#\s]")
+LINE_WIDTH = 60
+READ_CHUNK = 4 * 1024 * 1024
+
+
+class _HashingReader(io.RawIOBase):
+    """raw file reader feeding every byte read into sha256, the checksum costs no extra pass"""
+    def __init__(self, raw):
+        self.raw = raw
+        self.digest = hashlib.sha256()
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = self.raw.readinto(b)
+        if n:
+            self.digest.update(memoryview(b)[:n])
+        return n
+
+
+class AssemblyPreprocessor:
+    """
+    Assembly preprocessing before cactus-pangenome
+    Validate fasta, normalize headers, recompress to bgzip (+faidx) and collect assembly stats
+    for every genome of seqFile. Results are cached by content checksum.
+    """
+    def __init__(self, config: dict):
+        self.config: dict = config
+        self.Global: dict = self.config['Global']
+        self.Cactus: dict = self.config['Cactus']
+        self.Preprocess: dict = self.config['Preprocess']
+
+        self.work_dir: Path = Path(self.Global['work_dir']).resolve()
+        self.preprocess_dir: Path = self.work_dir / "0.preprocess"
+        # checksum -> processed output, shared by all runs in this work_dir
+        self.cache_file: Path = self.preprocess_dir / "checksum_cache.json"
+        # the seqFile handed to cactus-pangenome
+        self.seq_file: Path = self.preprocess_dir / "seqfile"
+        self.stats_file: Path = self.preprocess_dir / "assembly_stats.tsv"
+
+    def parser_seqfile(self) -> list[tuple[str, Path]]:
+        """Parse seqFile as (genome name, fasta path), newick tree lines are skipped"""
+        genomes = []
+        with open(self.Cactus['seqFile'], 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#') or line.startswith('('):
+                    continue
+                parts = line.split()
+                if len(parts) < 2:
+                    logging.warning(f"Skipping seqFile line (missing path): {line}")
+                    continue
+                genomes.append((parts[0], Path(parts[1])))
+        return genomes
+
+    def _tool_prefix(self) -> list:
+        """bgzip and samtools are shipped in the cactus image, reuse it when configured"""
+        singularity_image = self.Cactus.get('singularityImage')
+        if singularity_image:
+            return ["singularity", "exec", str(singularity_image)]
+        return []
+
+    def _load_cache(self) -> dict:
+        if self.cache_file.exists():
+            with open(self.cache_file, 'r') as f:
+                return json.load(f)
+        return {}
+
+    def _save_cache(self, cache: dict):
+        tmp_file = self.cache_file.with_suffix(".tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(cache, f, indent=2)
+        tmp_file.replace(self.cache_file)
+
+    @staticmethod
+    def _cached_checksum(fasta: Path, cache: dict) -> str | None:
+        """sha256 of an input seen before with the same size and mtime, None for a new or changed file"""
+        stat = fasta.stat()
+        for entry in cache.values():
+            if (entry.get('source') == str(fasta) and entry.get('size') == stat.st_size
+                    and entry.get('mtime_ns') == stat.st_mtime_ns):
+                return entry['checksum']
+        return None
+
+    @staticmethod
+    def _open_fasta(reader: io.BufferedReader):
+        """plain or gzip (including bgzip) fasta in binary mode"""
+        if reader.peek(2)[:2] == b"\x1f\x8b":
+            return gzip.GzipFile(fileobj=reader, mode='rb')
+        return reader
+
+    @staticmethod
+    def _assembly_stats(lengths: list[int], gc: int, n_count: int) -> dict:
+        total = sum(lengths)
+        n50 = 0
+        running = 0
+        for length in sorted(lengths, reverse=True):
+            running += length
+            if running * 2 >= total:
+                n50 = length
+                break
+        acgt = total - n_count
+        return {
+            "contigs": len(lengths),
+            "total_length": total,
+            "longest": max(lengths) if lengths else 0,
+            "N50": n50,
+            "GC": round(gc / acgt, 4) if acgt else 0.0,
+            "N_count": n_count,
+        }
+
+    def _process_genome(self, name: str, fasta: Path) -> dict:
+        """
+        stream one fasta: validate records, normalize headers, rewrap and pipe into bgzip
+        runs inside the worker process, the sha256 is computed over the same read of the file
+        """
+        tmp_output = self.preprocess_dir / f".{name}.{os.getpid()}.fa.gz.tmp"
+        threads = str(self.Preprocess.get('Threads', 1))
+        bgzip_cmd = self._tool_prefix() + ["bgzip", "-@", threads, "-c"]
+
+        names = set()
+        lengths = []
+        gc = 0
+        n_count = 0
+        errors = []
+
+        try:
+            with open(tmp_output, 'wb') as out, open(fasta, 'rb', buffering=0) as raw:
+                hashed = _HashingReader(raw)
+                reader = io.BufferedReader(hashed, READ_CHUNK)
+                f = self._open_fasta(reader)
+                bgzip = subprocess.Popen(bgzip_cmd, stdin=subprocess.PIPE, stdout=out)
+                current = None
+                buffer = bytearray()
+
+                def flush_record():
+                    nonlocal gc, n_count
+                    if current is None:
+                        return
+                    if not buffer:
+                        errors.append(f"empty sequence: {current}")
+                        return
+                    upper = buffer.upper()
+                    gc += upper.count(b"G") + upper.count(b"C")
+                    n_count += upper.count(b"N")
+                    lengths.append(len(buffer))
+                    bgzip.stdin.write(b">" + current.encode() + b"\n")
+                    for i in range(0, len(buffer), LINE_WIDTH):
+                        bgzip.stdin.write(buffer[i:i + LINE_WIDTH] + b"\n")
+
+                try:
+                    for line_no, raw in enumerate(f, start=1):
+                        line = raw.rstrip(b"\r\n")
+                        if not line:
+                            continue
+                        if line.startswith(b">"):
+                            flush_record()
+                            buffer.clear()
+                            header = line[1:].decode(errors='replace').split()
+                            if not header:
+                                errors.append(f"line {line_no}: empty header")
+                                current = f"{name}_contig{len(names) + 1}"
+                            else:
+                                current = INVALID_NAME_CHARS.sub("_", header[0])
+                            if current in names:
+                                errors.append(f"line {line_no}: duplicated contig name {current}")
+                            names.add(current)
+                            continue
+                        if current is None:
+                            errors.append(f"line {line_no}: sequence before first header")
+                            break
+                        if not VALID_BASES.issuperset(line):
+                            bad = sorted(set(line) - VALID_BASES)
+                            errors.append(f"line {line_no}: invalid bases {bytes(bad)!r} in {current}")
+                            break
+                        buffer.extend(line)
+                    else:
+                        flush_record()
+                except BrokenPipeError:
+                    # bgzip died, its exit code is reported below
+                    errors.append("bgzip closed its input")
+                finally:
+                    try:
+                        bgzip.stdin.close()
+                    except BrokenPipeError:
+                        pass
+                    if bgzip.wait() != 0:
+                        errors.append(f"bgzip exited with {bgzip.returncode}")
+
+                # bytes the parser did not need (e.g. after the last gzip member) still go into the checksum
+                while not errors and reader.read(READ_CHUNK):
+                    pass
+
+            if not lengths and not errors:
+                errors.append("no sequence found")
+            if errors:
+                return {"name": name, "source": str(fasta), "errors": errors}
+
+            checksum = hashed.digest.hexdigest()
+            # the output is named after the checksum: a changed input never overwrites the file
+            # an older cache entry points to
+            output = self.preprocess_dir / f"{name}.{checksum[:12]}.fa.gz"
+            tmp_output.replace(output)
+        finally:
+            # also when bgzip can not be started, no partial output is left behind
+            tmp_output.unlink(missing_ok=True)
+
+        # .fai + .gzi for random access of the bgzip fasta
+        faidx_cmd = self._tool_prefix() + ["samtools", "faidx", str(output)]
+        try:
+            subprocess.run(faidx_cmd, check=True, stderr=subprocess.PIPE, text=True)
+        except subprocess.CalledProcessError as e:
+            return {"name": name, "source": str(fasta), "errors": [f"samtools faidx error: {e.stderr}"]}
+
+        stat = fasta.stat()
+        return {
+            "name": name,
+            "source": str(fasta),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "checksum": checksum,
+            "output": str(output),
+            "stats": self._assembly_stats(lengths, gc, n_count),
+        }
+
+    def _write_outputs(self, genomes: list[tuple[str, Path]], results: dict):
+        """write the cactus seqFile (same order as input) and the assembly stats table"""
+        with open(self.seq_file, 'w') as f:
+            for name, _ in genomes:
+                f.write(f"{name}\t{results[name]['output']}\n")
+
+        columns = ["contigs", "total_length", "longest", "N50", "GC", "N_count"]
+        with open(self.stats_file, 'w') as f:
+            f.write("\t".join(["Genome"] + columns + ["checksum"]) + "\n")
+            for name, _ in genomes:
+                stats = results[name]['stats']
+                row = [name] + [str(stats[c]) for c in columns] + [results[name]['checksum']]
+                f.write("\t".join(row) + "\n")
+
+    def run_preprocess(self) -> Path:
+        """
+        preprocess all genomes of seqFile in parallel
+        :return: path of the seqFile pointing to the processed assemblies
+        """
+        genomes = self.parser_seqfile()
+        if not genomes:
+            logging.error(f"No genome found in seqFile: {self.Cactus['seqFile']}")
+            sys.exit(1)
+
+        missing = [str(path) for _, path in genomes if not path.exists()]
+        if missing:
+            logging.error(f"Assembly file(s) not found: {', '.join(missing)}")
+            sys.exit(1)
+
+        self.preprocess_dir.mkdir(parents=True, exist_ok=True)
+        cache = self._load_cache()
+        results = {}
+        pending = []
+        for name, fasta in genomes:
+            # new or changed inputs are hashed by the worker while it parses them
+            checksum = self._cached_checksum(fasta.resolve(), cache)
+            cached = cache.get(checksum) if checksum else None
+            # entries of older versions wrote {name}.fa.gz, a file later inputs may have overwritten
+            if (cached and cached['output'].endswith(f".{checksum[:12]}.fa.gz")
+                    and Path(cached['output']).exists() and Path(cached['output'] + ".fai").exists()):
+                logging.info(f"[{name}] unchanged (sha256 {checksum[:12]}), reuse {cached['output']}")
+                results[name] = cached
+            else:
+                pending.append((name, fasta.resolve()))
+
+        parallel_job = self.Preprocess.get('Parallel_job', 1)
+        if pending:
+            logging.info(f"Preprocessing {len(pending)} assemblies with {parallel_job} parallel jobs.")
+
+        failed = False
+        with ProcessPoolExecutor(max_workers=parallel_job) as executor:
+            future_to_genome = {
+                executor.submit(self._process_genome, name, fasta): name
+                for name, fasta in pending
+            }
+            for future in as_completed(future_to_genome):
+                name = future_to_genome[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error(f">>> Genome {name} crashed with exception: {e}")
+                    failed = True
+                    continue
+                if result.get('errors'):
+                    for error in result['errors']:
+                        logging.error(f"[{name}] {result['source']}: {error}")
+                    failed = True
+                    continue
+                stats = result['stats']
+                logging.info(f">>> Genome {name}: {stats['contigs']} contigs, {stats['total_length']} bp, "
+                             f"N50 {stats['N50']}")
+                results[name] = result
+                cache[result['checksum']] = result
+
+        self._save_cache(cache)
+        if failed:
+            logging.error("Assembly preprocessing failed, fix the inputs above before running cactus.")
+            sys.exit(1)
+
+        self._write_outputs(genomes, results)
+        logging.info(f"Preprocessed seqFile written to {self.seq_file}")
+        return self.seq_file
+
+if __name__ == "__main__":
+    from src.config_loader import ConfigManager
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    # This is mainly for local testing
+    config_path = sys.argv[1] if len(sys.argv) > 1 else "config/config.toml"
+    cfg = ConfigManager(config_path).get_config()
+    runner = AssemblyPreprocessor(cfg)
+    runner.run_preprocess()
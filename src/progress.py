@@ -0,0 +1,234 @@
+import gzip
+import logging
+import os
+import time
+from pathlib import Path
+
+from rich.console import Console
+from rich.logging import RichHandler
+from rich.progress import BarColumn, Progress, TaskProgressColumn, TextColumn, TimeRemainingColumn
+
+from src.resource_planner import GiB
+from src.scheduler import descendant_pids, process_rss
+
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+# compressed bytes read from the head of a fastq to estimate bytes per read
+READ_SAMPLE_BYTES = 4 * 1024 * 1024
+
+
+def bytes_per_read(fastq: Path) -> float:
+    """on-disk bytes per read, estimated from the first records of the (gzip) fastq"""
+    try:
+        with open(fastq, 'rb') as raw:
+            compressed = raw.read(2) == b"\x1f\x8b"
+            raw.seek(0)
+            stream = gzip.GzipFile(fileobj=raw) if compressed else raw
+            lines = 0
+            for _ in stream:
+                lines += 1
+                if raw.tell() >= READ_SAMPLE_BYTES:
+                    break
+            consumed = raw.tell()
+    except (OSError, EOFError):
+        return 0.0
+    reads = lines // 4
+    return consumed / reads if reads else 0.0
+
+
+def _open_offsets(pid: int) -> dict[str, int]:
+    """{resolved path: file offset} of the regular files opened by pid"""
+    offsets = {}
+    try:
+        fds = os.listdir(f"/proc/{pid}/fd")
+    except OSError:
+        return offsets
+    for fd in fds:
+        try:
+            target = os.readlink(f"/proc/{pid}/fd/{fd}")
+            if not target.startswith("/"):
+                continue
+            with open(f"/proc/{pid}/fdinfo/{fd}", 'r') as f:
+                pos = int(f.readline().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        offsets[target] = max(pos, offsets.get(target, 0))
+    return offsets
+
+
+def _cpu_ticks(pid: int) -> int:
+    """utime + stime of pid"""
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return int(fields[11]) + int(fields[12])
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def rich_console() -> Console:
+    """the console the RichHandler logs to, so live output and log lines do not overwrite each other"""
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, RichHandler):
+            return handler.console
+    return Console()
+
+
+class BatchProgress:
+    """
+    Live progress of a sample batch
+    Per-sample progress is estimated from the offset of the fastq files in the mapping process,
+    reads/s from bytes per read sampled at the head of R1. Falls back to periodic log lines
+    when stdout is not a terminal.
+    """
+    def __init__(self, stage: str, inputs: dict[str, list], log_interval: float = 300):
+        """
+        :param inputs: {sample_id: [mate, ...]}, a mate is a fastq path or a list of its lane files
+        """
+        self.stage = stage
+        self.inputs = {}
+        # reads are consumed from every mate at the same time, lanes of one mate one after the other
+        self.mates = {}
+        for sample_id, mates in inputs.items():
+            mates = [[m] if isinstance(m, (str, Path)) else list(m) for m in mates]
+            mates = [[p for p in lanes if p] for lanes in mates]
+            self.mates[sample_id] = max(1, sum(1 for lanes in mates if lanes))
+            self.inputs[sample_id] = [Path(p).resolve() for lanes in mates for p in lanes]
+        self.sizes = {
+            sample_id: sum(p.stat().st_size for p in paths if p.exists())
+            for sample_id, paths in self.inputs.items()
+        }
+        self.total_bytes = sum(self.sizes.values()) or 1
+        self.log_interval = log_interval
+
+        self.consumed: dict[str, int] = {}
+        self.read_rate: dict[str, float] = {}
+        self.bytes_per_read: dict[str, float] = {}
+        self.started: dict[str, float] = {}
+        self.finished: dict[str, bool] = {}
+
+        self.last_update = time.monotonic()
+        self.last_ticks = 0
+        self.last_log = 0.0
+        self.cores_used = 0.0
+        self.mem_used = 0
+
+        self.console = rich_console()
+        self.live = self.console.is_terminal
+        self.progress = None
+        self.tasks = {}
+        if self.live:
+            self.progress = Progress(
+                TextColumn("[bold cyan]{task.description}"),
+                BarColumn(),
+                TaskProgressColumn(),
+                TextColumn("{task.fields[rate]}"),
+                TimeRemainingColumn(),
+                console=self.console,
+            )
+            self.tasks["__batch__"] = self.progress.add_task(
+                f"{stage} batch", total=self.total_bytes, rate="")
+
+    def __enter__(self):
+        if self.progress:
+            self.progress.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self.progress:
+            self.progress.stop()
+        return False
+
+    def start(self, sample_id: str):
+        self.started[sample_id] = time.monotonic()
+        self.consumed[sample_id] = 0
+        if self.inputs.get(sample_id):
+            self.bytes_per_read[sample_id] = bytes_per_read(self.inputs[sample_id][0]) * self.mates[sample_id]
+        if self.progress:
+            self.tasks[sample_id] = self.progress.add_task(
+                sample_id, total=self.sizes.get(sample_id) or 1, rate="")
+
+    def finish(self, sample_id: str, success: bool):
+        self.finished[sample_id] = success
+        self.consumed[sample_id] = self.sizes.get(sample_id, 0)
+        if self.progress and sample_id in self.tasks:
+            self.progress.remove_task(self.tasks.pop(sample_id))
+        self._refresh_batch()
+
+    def batch_consumed(self) -> int:
+        return sum(self.consumed.values())
+
+    def eta(self) -> float | None:
+        """seconds left for the whole batch at the throughput seen so far"""
+        if not self.started:
+            return None
+        elapsed = time.monotonic() - min(self.started.values())
+        consumed = self.batch_consumed()
+        if not consumed or not elapsed:
+            return None
+        return (self.total_bytes - consumed) / (consumed / elapsed)
+
+    def update(self):
+        """poll /proc for file offsets, cpu and memory of the running jobs"""
+        now = time.monotonic()
+        interval = now - self.last_update
+        pids = descendant_pids(os.getpid())
+
+        offsets: dict[str, int] = {}
+        ticks = 0
+        mem = 0
+        for pid in pids:
+            for path, pos in _open_offsets(pid).items():
+                offsets[path] = max(pos, offsets.get(path, 0))
+            ticks += _cpu_ticks(pid)
+            mem += process_rss(pid)
+
+        if interval > 0 and self.last_ticks:
+            self.cores_used = max(0.0, (ticks - self.last_ticks) / CLK_TCK / interval)
+        self.last_ticks = ticks
+        self.mem_used = mem
+
+        for sample_id in self.started:
+            if sample_id in self.finished:
+                continue
+            position = sum(offsets.get(str(p), 0) for p in self.inputs.get(sample_id, []))
+            # offsets disappear once the mapper closed its inputs (packing), keep the maximum
+            position = max(position, self.consumed.get(sample_id, 0))
+            delta = position - self.consumed.get(sample_id, 0)
+            per_read = self.bytes_per_read.get(sample_id)
+            if interval > 0 and per_read:
+                self.read_rate[sample_id] = delta / per_read / interval
+            self.consumed[sample_id] = position
+            if self.progress and sample_id in self.tasks:
+                self.progress.update(self.tasks[sample_id], completed=position,
+                                     rate=f"{self.read_rate.get(sample_id, 0):,.0f} reads/s")
+
+        self.last_update = now
+        self._refresh_batch()
+        if not self.live and now - self.last_log >= self.log_interval:
+            self.last_log = now
+            self.log_status()
+
+    def _refresh_batch(self):
+        if not self.progress:
+            return
+        done = len(self.finished)
+        self.progress.update(
+            self.tasks["__batch__"],
+            completed=self.batch_consumed(),
+            description=f"{self.stage} batch {done}/{len(self.inputs)}",
+            rate=f"{self.cores_used:.1f} cores, {self.mem_used / GiB:.1f} GiB",
+        )
+
+    def log_status(self):
+        """plain log lines for non-interactive output (tmux logging, batch schedulers)"""
+        eta = self.eta()
+        eta_text = f"{int(eta // 3600)}h{int(eta % 3600 // 60):02d}m" if eta is not None else "unknown"
+        logging.info(f"[{self.stage}] {len(self.finished)}/{len(self.inputs)} samples done, "
+                     f"{self.batch_consumed() / self.total_bytes:.1%} of input, ETA {eta_text}, "
+                     f"{self.cores_used:.1f} cores, {self.mem_used / GiB:.1f} GiB in use")
+        for sample_id in self.started:
+            if sample_id in self.finished:
+                continue
+            size = self.sizes.get(sample_id) or 1
+            logging.info(f"[{self.stage}]   {sample_id}: {self.consumed.get(sample_id, 0) / size:.1%}, "
+                         f"{self.read_rate.get(sample_id, 0):,.0f} reads/s")
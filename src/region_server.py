@@ -0,0 +1,373 @@
+import json
+import logging
+import mmap
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+# P line steps "12-" -> "-12"
+REVERSE_STEP = re.compile(rb"(\d+)-")
+# header columns read from a P / W line, the steps follow
+PATH_HEADER_BYTES = 4096
+MiB = 1024 ** 2
+
+
+class PathInfo:
+    """one P or W line of the GFA, the steps are parsed on first use"""
+    def __init__(self, name: str, sample: str, haplotype: str, contig: str, start: int,
+                 length: int | None, steps_start: int, steps_end: int, walk: bool):
+        self.name = name
+        self.sample = sample
+        self.haplotype = haplotype
+        self.contig = contig
+        # W lines may cover a sub-range of the contig
+        self.start = start
+        self.length = length
+        self.steps_start = steps_start
+        self.steps_end = steps_end
+        self.walk = walk
+
+    def to_dict(self) -> dict:
+        return {"name": self.name, "sample": self.sample, "haplotype": self.haplotype,
+                "contig": self.contig, "start": self.start, "length": self.length}
+
+
+class RegionCache:
+    """
+    LRU cache of /region answers bounded by their total size: one answer can be up to
+    MaxRegion bp of GFA text, so a bound on the number of entries does not bound memory.
+    Answers larger than max_entry bytes are returned without being cached.
+    """
+    def __init__(self, max_bytes: int, max_entry: int | None = None):
+        self.max_bytes = max_bytes
+        self.max_entry = max_bytes // 8 if max_entry is None else max_entry
+        self.entries: OrderedDict[tuple, str] = OrderedDict()
+        self.bytes = 0
+        self.hits = self.misses = self.skipped = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple, compute) -> str:
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.misses += 1
+        # computed outside the lock, concurrent misses of one key compute it twice
+        value = compute(*key)
+        size = len(value)
+        with self.lock:
+            if size > self.max_entry:
+                self.skipped += 1
+            elif key not in self.entries:
+                self.entries[key] = value
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    _, old = self.entries.popitem(last=False)
+                    self.bytes -= len(old)
+        return value
+
+    def info(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "not_cached": self.skipped,
+                    "size": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "max_entry_bytes": self.max_entry}
+
+
+class GfaGraph:
+    """
+    In-memory view of the cactus GFA for repeated region queries
+    One pass over the memory-mapped GFA records segment lengths and sequence offsets, links
+    and the position of every P / W line. Sequences stay in the page cache, path steps are
+    parsed on first use and kept for the MaxPaths most recently used paths. Nodes of the
+    reference paths get their reference coordinate at load time. Region answers are cached
+    up to cache_bytes in total.
+    """
+    def __init__(self, gfa_file: Path, reference: str = "", max_paths: int = 64, cache_bytes: int = 256 * MiB):
+        self.gfa_file = Path(gfa_file)
+        self.reference = reference
+        start = time.monotonic()
+        with open(self.gfa_file, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.paths: dict[str, PathInfo] = {}
+        self._load()
+        self.steps = lru_cache(maxsize=max_paths)(self._parse_steps)
+        self.region_cache = RegionCache(cache_bytes)
+        self._index_reference()
+        self.load_seconds = round(time.monotonic() - start, 1)
+        logging.info(f"Loaded {self.gfa_file.name}: {int((self.seg_len > 0).sum())} segments, "
+                     f"{len(self.link_from)} links, {len(self.paths)} paths in {self.load_seconds}s")
+
+    def _load(self):
+        mm = self.mm
+        size = len(mm)
+        seg_id, seg_off, seg_len = array('q'), array('q'), array('q')
+        link_from, link_to, link_orient = array('q'), array('q'), array('b')
+        pos = 0
+        while pos < size:
+            nl = mm.find(b"\n", pos)
+            if nl < 0:
+                nl = size
+            kind = mm[pos:pos + 2]
+            if kind == b"S\t":
+                id_end = mm.find(b"\t", pos + 2, nl)
+                seq_end = mm.find(b"\t", id_end + 1, nl)
+                seq_end = nl if seq_end < 0 else seq_end
+                length = seq_end - id_end - 1
+                if mm[id_end + 1:seq_end] == b"*":
+                    tag = re.search(rb"LN:i:(\d+)", mm[seq_end:nl])
+                    length = int(tag.group(1)) if tag else 0
+                seg_id.append(int(mm[pos + 2:id_end]))
+                seg_off.append(id_end + 1)
+                seg_len.append(length)
+            elif kind == b"L\t":
+                fields = mm[pos:nl].split(b"\t")
+                link_from.append(int(fields[1]))
+                link_to.append(int(fields[3]))
+                # bit 1: from reverse, bit 0: to reverse
+                link_orient.append((fields[2] == b"-") * 2 + (fields[4] == b"-"))
+            elif kind in (b"P\t", b"W\t"):
+                self._add_path(kind == b"W\t", pos, nl)
+            pos = nl + 1
+
+        ids = np.frombuffer(seg_id, dtype=np.int64)
+        max_id = int(ids.max()) if len(ids) else 0
+        # node IDs of cactus graphs are dense, index arrays directly by ID
+        self.seg_len = np.zeros(max_id + 1, dtype=np.int64)
+        self.seg_off = np.zeros(max_id + 1, dtype=np.int64)
+        self.seg_len[ids] = np.frombuffer(seg_len, dtype=np.int64)
+        self.seg_off[ids] = np.frombuffer(seg_off, dtype=np.int64)
+
+        self.link_from = np.frombuffer(link_from, dtype=np.int64)
+        self.link_to = np.frombuffer(link_to, dtype=np.int64)
+        self.link_orient = np.frombuffer(link_orient, dtype=np.int8)
+        # links of every node, both directions, as a CSR adjacency
+        ends = np.concatenate([self.link_from, self.link_to])
+        order = np.argsort(ends, kind="stable")
+        self.adj_links = np.concatenate([np.arange(len(self.link_from))] * 2)[order]
+        self.adj_ptr = np.zeros(max_id + 2, dtype=np.int64)
+        np.cumsum(np.bincount(ends, minlength=max_id + 1), out=self.adj_ptr[1:])
+
+    def _add_path(self, walk: bool, pos: int, nl: int):
+        header = self.mm[pos:min(nl, pos + PATH_HEADER_BYTES)].split(b"\t")
+        if walk:
+            # W sample hap seqid start end walk
+            sample, haplotype, contig = (value.decode() for value in header[1:4])
+            start = int(header[4]) if header[4] != b"*" else 0
+            length = int(header[5]) - start if header[5] != b"*" else None
+            name = f"{sample}#{haplotype}#{contig}"
+            column = 6
+        else:
+            # P name steps overlaps, PanSN names sample#hap#contig
+            name = header[1].decode()
+            parts = name.split("#")
+            sample, haplotype, contig = (parts + ["", ""])[:3] if len(parts) == 3 else (name, "", name)
+            start, length = 0, None
+            column = 2
+        steps_start = pos + sum(len(field) + 1 for field in header[:column])
+        steps_end = self.mm.find(b"\t", steps_start, nl)
+        self.paths[name] = PathInfo(name, sample, haplotype, contig, start, length,
+                                    steps_start, nl if steps_end < 0 else steps_end, walk)
+
+    def _parse_steps(self, name: str) -> tuple[np.ndarray, np.ndarray]:
+        """
+        :return: signed node IDs (negative = reverse) and the path offset of every step,
+                 offsets has one more entry, the path end
+        """
+        info = self.paths[name]
+        text = self.mm[info.steps_start:info.steps_end]
+        if info.walk:
+            text = text.replace(b">", b" ").replace(b"<", b" -")
+        else:
+            text = REVERSE_STEP.sub(rb"-\1", text).replace(b"+", b"").replace(b",", b" ")
+        nodes = np.array(text.split(), dtype=np.int64)
+        offsets = np.empty(len(nodes) + 1, dtype=np.int64)
+        offsets[0] = info.start
+        np.cumsum(self.seg_len[np.abs(nodes)], out=offsets[1:])
+        offsets[1:] += info.start
+        if info.length is None:
+            info.length = int(offsets[-1] - info.start)
+        return nodes, offsets
+
+    def _index_reference(self):
+        """reference path and offset of every node on a path of the reference sample"""
+        self.ref_path = np.full(len(self.seg_len), -1, dtype=np.int32)
+        self.ref_offset = np.zeros(len(self.seg_len), dtype=np.int64)
+        self.ref_reverse = np.zeros(len(self.seg_len), dtype=np.bool_)
+        self.ref_names = [name for name, info in self.paths.items() if info.sample == self.reference]
+        for i, name in enumerate(self.ref_names):
+            nodes, offsets = self._parse_steps(name)
+            ids = np.abs(nodes)
+            # the first reference path of a node wins
+            free = self.ref_path[ids] < 0
+            self.ref_path[ids[free]] = i
+            self.ref_offset[ids[free]] = offsets[:-1][free]
+            self.ref_reverse[ids[free]] = nodes[free] < 0
+        if self.reference and not self.ref_names:
+            logging.warning(f"No path of reference sample {self.reference} in {self.gfa_file.name}")
+
+    def list_paths(self, sample: str | None = None) -> list[dict]:
+        return [info.to_dict() for info in self.paths.values() if not sample or info.sample == sample]
+
+    def positions(self, nodes: list[int]) -> list[dict]:
+        """reference coordinate (0-based) of each node, path null when it is off the reference"""
+        result = []
+        for node in nodes:
+            if node <= 0 or node >= len(self.seg_len) or not self.seg_len[node]:
+                raise KeyError(f"node {node} not in graph")
+            i = int(self.ref_path[node])
+            result.append({
+                "node": node,
+                "length": int(self.seg_len[node]),
+                "path": self.ref_names[i] if i >= 0 else None,
+                "offset": int(self.ref_offset[node]) if i >= 0 else None,
+                "strand": ("-" if self.ref_reverse[node] else "+") if i >= 0 else None,
+            })
+        return result
+
+    def sequence(self, node: int) -> str:
+        offset = int(self.seg_off[node])
+        return self.mm[offset:offset + int(self.seg_len[node])].decode()
+
+    def _region(self, name: str, start: int, end: int, context: int) -> str:
+        """
+        GFA of the path range [start, end) (0-based) plus context link steps around it
+        not cached, see region
+        """
+        if name not in self.paths:
+            raise KeyError(f"path {name} not in graph")
+        nodes, offsets = self.steps(name)
+        first = max(0, int(np.searchsorted(offsets, start, side="right")) - 1)
+        last = min(len(nodes), int(np.searchsorted(offsets, end, side="left")))
+        steps = nodes[first:last]
+        if not len(steps):
+            raise ValueError(f"no step of {name} overlaps [{start}, {end}), "
+                             f"the path covers [{int(offsets[0])}, {int(offsets[-1])})")
+        selected = set(np.abs(steps).tolist())
+        frontier = selected
+        for _ in range(context):
+            reached = set()
+            for node in frontier:
+                for link in self.adj_links[self.adj_ptr[node]:self.adj_ptr[node + 1]].tolist():
+                    reached.add(int(self.link_from[link]))
+                    reached.add(int(self.link_to[link]))
+            frontier = reached - selected
+            selected |= reached
+
+        lines = ["H\tVN:Z:1.1"]
+        links = set()
+        for node in sorted(selected):
+            lines.append(f"S\t{node}\t{self.sequence(node)}")
+            links.update(self.adj_links[self.adj_ptr[node]:self.adj_ptr[node + 1]].tolist())
+        for link in sorted(links):
+            a, b = int(self.link_from[link]), int(self.link_to[link])
+            if a in selected and b in selected:
+                orient = int(self.link_orient[link])
+                lines.append(f"L\t{a}\t{'-' if orient & 2 else '+'}\t{b}\t{'-' if orient & 1 else '+'}\t0M")
+        walk = ",".join(f"{abs(n)}{'-' if n < 0 else '+'}" for n in steps.tolist())
+        lines.append(f"P\t{name}[{int(offsets[first])}-{int(offsets[last])}]\t{walk}\t*")
+        return "\n".join(lines) + "\n"
+
+    def region(self, name: str, start: int, end: int, context: int) -> str:
+        """GFA of the path range [start, end) (0-based) plus context link steps around it"""
+        return self.region_cache.get((name, start, end, context), self._region)
+
+    def cache_info(self) -> dict:
+        return {**self.region_cache.info(), "parsed_paths": self.steps.cache_info().currsize}
+
+
+class _RegionHandler(BaseHTTPRequestHandler):
+    server: "RegionServer"
+
+    def _reply(self, code: int, body: str, content_type: str = "application/json"):
+        data = body.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    @staticmethod
+    def _param(params: dict, key: str) -> str:
+        if key not in params:
+            raise ValueError(f"missing parameter {key}")
+        return params[key]
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        graph = self.server.graph
+        try:
+            if url.path == "/region":
+                start, end = int(self._param(params, 'start')), int(self._param(params, 'end'))
+                if not 0 <= start < end or end - start > self.server.max_region:
+                    raise ValueError(f"region must satisfy 0 <= start < end, at most {self.server.max_region} bp")
+                context = int(params.get('context', self.server.context))
+                if not 0 <= context <= self.server.max_context:
+                    # every link step walks more of the graph in Python
+                    raise ValueError(f"context must satisfy 0 <= context <= {self.server.max_context}")
+                gfa = graph.region(self._param(params, 'path'), start, end, context)
+                self._reply(200, gfa, "text/plain; charset=utf-8")
+            elif url.path == "/paths":
+                self._reply(200, json.dumps(graph.list_paths(params.get('sample'))))
+            elif url.path == "/position":
+                nodes = [int(node) for node in self._param(params, 'node').split(",")]
+                self._reply(200, json.dumps(graph.positions(nodes)))
+            elif url.path == "/health":
+                self._reply(200, json.dumps({"gfa": str(graph.gfa_file), "load_seconds": graph.load_seconds,
+                                             "paths": len(graph.paths), "cache": graph.cache_info()}))
+            else:
+                self._reply(404, json.dumps({"error": f"unknown endpoint {url.path}"}))
+        except KeyError as e:
+            # unknown path or node
+            self._reply(404, json.dumps({"error": e.args[0]}))
+        except ValueError as e:
+            self._reply(400, json.dumps({"error": str(e)}))
+
+    def log_message(self, format, *args):
+        logging.debug(f"{self.address_string()} {format % args}")
+
+
+class RegionServer(ThreadingHTTPServer):
+    """
+    Local HTTP query service over a GfaGraph loaded once
+        GET /region?path=sy#0#chr1&start=1000&end=2000[&context=1]   subgraph as GFA
+        GET /paths[?sample=sy]                                      paths as JSON
+        GET /position?node=12,13                                    reference coordinates as JSON
+        GET /health                                                 load time and cache statistics
+    """
+    daemon_threads = True
+
+    def __init__(self, config: dict):
+        self.Serve: dict = config.get('Serve', {})
+        self.Global: dict = config['Global']
+        work_dir = Path(self.Global['work_dir']).resolve()
+        gfa_file = work_dir / "1.cactus" / f"{self.Global['filePrefix']}.full.gfa"
+        if not gfa_file.exists():
+            raise FileNotFoundError(f"{gfa_file} does not exist, run cactus and vg (decompresses the gfa) first")
+        self.context: int = self.Serve.get('Context', 1)
+        self.max_region: int = self.Serve.get('MaxRegion', 10_000_000)
+        self.max_context: int = self.Serve.get('MaxContext', 10)
+        self.graph = GfaGraph(gfa_file, config.get('Cactus', {}).get('reference', ""),
+                              max_paths=self.Serve.get('MaxPaths', 64),
+                              cache_bytes=int(self.Serve.get('CacheMB', 256) * MiB))
+        super().__init__((self.Serve.get('address', "127.0.0.1"), self.Serve.get('port', 8765)), _RegionHandler)
+
+    def serve(self):
+        """block until interrupted"""
+        host, port = self.server_address[:2]
+        logging.info(f"Serving graph regions on http://{host}:{port} (/region, /paths, /position, /health)")
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            logging.info("Stopping region server")
+        finally:
+            self.server_close()
@@ -0,0 +1,233 @@
+import csv
+import logging
+import os
+import shutil
+from pathlib import Path
+
+from src.fastq_stream import fastq_bytes
+
+GiB = 1024 ** 3
+# in-memory footprint of the giraffe index set relative to its on-disk size, plus fixed per-process overhead
+GIRAFFE_INDEX_FACTOR = 1.2
+GIRAFFE_OVERHEAD = 2 * GiB
+# giraffe indexes are roughly this many times larger than the gbz they are built from
+GBZ_TO_INDEX_FACTOR = 6
+# vg call holds the graph plus the packed coverage in memory
+CALL_GRAPH_FACTOR = 4
+CALL_PACK_FACTOR = 2
+CALL_OVERHEAD = 1 * GiB
+# vg mpmap holds the spliced xg / gcsa / dist, rpvg the haplotype-transcript gbwt
+RNA_INDEX_FACTOR = 1.5
+RNA_OVERHEAD = 4 * GiB
+# vg autoindex peak memory relative to the gfa size
+AUTOINDEX_GFA_FACTOR = 10
+
+
+def read_meminfo() -> dict:
+    """/proc/meminfo in bytes"""
+    meminfo = {}
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                meminfo[key] = int(value.split()[0]) * 1024
+    except OSError:
+        pass
+    return meminfo
+
+
+def _cgroup_limit(path: str) -> int | None:
+    """cgroup v2 limit file, None when unlimited or not available"""
+    try:
+        value = Path(path).read_text().split()
+    except OSError:
+        return None
+    if not value or value[0] == "max":
+        return None
+    if len(value) == 2:
+        # cpu.max: "<quota> <period>"
+        return max(1, int(value[0]) // int(value[1]))
+    return int(value[0])
+
+
+class ResourcePlanner:
+    """
+    Resource-aware auto tuning
+    Look at the machine (cores, memory, disk), the vg index and the sample inputs,
+    then choose Threads / Parallel_job for every stage and explain the choice.
+    """
+    def __init__(self, config: dict):
+        self.config: dict = config
+        self.Global: dict = self.config['Global']
+        self.AutoTune: dict = self.config['AutoTune']
+        self.work_dir: Path = Path(self.Global['work_dir']).resolve()
+        self.cactus_dir: Path = self.work_dir / "1.cactus"
+        self.vg_index: Path = self.work_dir / "3.vg_index"
+        self.wgs_dir: Path = self.work_dir / "5.wgs_analysis"
+
+    def probe_machine(self) -> dict:
+        """cores, memory and local disk available to this process"""
+        cores = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+        cpu_quota = _cgroup_limit("/sys/fs/cgroup/cpu.max")
+        if cpu_quota:
+            cores = min(cores, cpu_quota)
+
+        meminfo = read_meminfo()
+        mem_total = meminfo.get("MemTotal", 0)
+        mem_available = meminfo.get("MemAvailable", mem_total)
+        mem_limit = _cgroup_limit("/sys/fs/cgroup/memory.max")
+        if mem_limit:
+            mem_total = min(mem_total, mem_limit)
+            mem_available = min(mem_available, mem_limit)
+
+        disk_dir = self.work_dir if self.work_dir.exists() else self.work_dir.parent
+        while not disk_dir.exists():
+            disk_dir = disk_dir.parent
+        disk_free = shutil.disk_usage(disk_dir).free
+
+        return {
+            "cores": max(1, cores - self.AutoTune.get('ReserveCores', 0)),
+            "mem_total": mem_total,
+            "mem_usable": max(0, mem_available - int(self.AutoTune.get('ReserveMemGB', 4) * GiB)),
+            "disk_free": disk_free,
+        }
+
+    def index_size(self) -> tuple[int, bool]:
+        """
+        on-disk size of the giraffe index set
+        :return: (bytes, estimated) estimated is True when autoindex has not run yet
+        """
+        index_files = list(self.vg_index.glob("vg_index.*")) if self.vg_index.exists() else []
+        if index_files:
+            return sum(f.stat().st_size for f in index_files), False
+        gbz_file = self.cactus_dir / f"{self.Global['filePrefix']}.full.gbz"
+        if gbz_file.exists():
+            return gbz_file.stat().st_size * GBZ_TO_INDEX_FACTOR, True
+        return 0, True
+
+    def sample_sizes(self) -> list[int]:
+        """total fastq bytes of every sample in the wgs DataTable"""
+        data_table = self.config.get('wgs', {}).get('DataTable')
+        sizes = []
+        if not data_table or not Path(data_table).exists():
+            return sizes
+        with open(data_table, 'r', newline='') as f:
+            for row in csv.DictReader(f, skipinitialspace=True):
+                sizes.append(fastq_bytes([row.get("R1"), row.get("R2")]))
+        return sizes
+
+    def giraffe_job_memory(self) -> tuple[int, bool]:
+        """
+        expected peak memory of one giraffe + pack job
+        :return: (bytes, estimated) estimated is True when autoindex has not run yet
+        """
+        index_bytes, estimated = self.index_size()
+        return int(index_bytes * GIRAFFE_INDEX_FACTOR) + GIRAFFE_OVERHEAD, estimated
+
+    def call_job_memory(self) -> int:
+        """expected peak memory of one vg call job"""
+        gbz_file = self.vg_index / "vg_index.giraffe.gbz"
+        if not gbz_file.exists():
+            gbz_file = self.cactus_dir / f"{self.Global['filePrefix']}.full.gbz"
+        gbz_bytes = gbz_file.stat().st_size if gbz_file.exists() else 0
+        packs = list(self.wgs_dir.rglob("*.pack")) if self.wgs_dir.exists() else []
+        # pack size is proportional to the graph, not to the sample
+        pack_bytes = max((p.stat().st_size for p in packs), default=gbz_bytes)
+        return gbz_bytes * CALL_GRAPH_FACTOR + pack_bytes * CALL_PACK_FACTOR + CALL_OVERHEAD
+
+    def rna_job_memory(self) -> int:
+        """expected peak memory of one vg mpmap | rpvg job"""
+        rna_index = self.vg_index / "rna"
+        index_files = list(rna_index.glob("rna.*")) if rna_index.exists() else []
+        index_bytes = sum(f.stat().st_size for f in index_files)
+        return int(index_bytes * RNA_INDEX_FACTOR) + RNA_OVERHEAD
+
+    def _split_cores(self, cores: int, jobs: int) -> tuple[int, int]:
+        """never run more jobs than cores, hand the rest of the cores out as threads"""
+        jobs = max(1, min(jobs, cores))
+        return jobs, max(1, cores // jobs)
+
+    def _plan_vg(self, machine: dict) -> dict:
+        gfa_file = self.cactus_dir / f"{self.Global['filePrefix']}.full.gfa"
+        reasons = [f"autoindex is a single job, use all {machine['cores']} cores"]
+        if gfa_file.exists():
+            need = gfa_file.stat().st_size * AUTOINDEX_GFA_FACTOR
+            if need > machine['mem_usable']:
+                reasons.append(f"WARNING: autoindex may need ~{need / GiB:.1f} GiB, "
+                               f"only {machine['mem_usable'] / GiB:.1f} GiB usable")
+        return {"section": "VgIndex", "threads_key": "threads", "Threads": machine['cores'],
+                "Parallel_job": None, "reasons": reasons}
+
+    def _plan_wgs(self, machine: dict) -> dict:
+        sizes = self.sample_sizes()
+        mem_per_job, estimated = self.giraffe_job_memory()
+        min_threads = self.AutoTune.get('MinThreads', 4)
+        reasons = []
+
+        limits = {"cores": max(1, machine['cores'] // min_threads), "samples": max(1, len(sizes))}
+        reasons.append(f"{machine['cores']} cores / {min_threads} min threads per giraffe -> {limits['cores']} jobs")
+        reasons.append(f"{len(sizes)} samples in DataTable")
+
+        limits["memory"] = max(1, machine['mem_usable'] // mem_per_job)
+        reasons.append(f"each giraffe loads ~{mem_per_job / GiB:.1f} GiB "
+                       f"({'estimated from gbz' if estimated else 'measured 3.vg_index'}), "
+                       f"{machine['mem_usable'] / GiB:.1f} GiB usable -> {limits['memory']} jobs")
+
+        bottleneck = min(limits, key=limits.get)
+        jobs, threads = self._split_cores(machine['cores'], limits[bottleneck])
+        reasons.append(f"bound by {bottleneck}: {jobs} jobs x {threads} threads")
+        return {"section": "wgs", "threads_key": "Threads", "Threads": threads,
+                "Parallel_job": jobs, "reasons": reasons}
+
+    def _plan_call(self, machine: dict) -> dict:
+        packs = list(self.wgs_dir.rglob("*.pack")) if self.wgs_dir.exists() else []
+        n_samples = len(packs) or len(self.sample_sizes())
+        min_threads = self.AutoTune.get('MinThreads', 4)
+        mem_per_job = self.call_job_memory()
+        limits = {
+            "cores": max(1, machine['cores'] // min_threads),
+            "samples": max(1, n_samples),
+            "memory": max(1, machine['mem_usable'] // mem_per_job),
+        }
+        reasons = [
+            f"{n_samples} samples to call",
+            f"each vg call holds ~{mem_per_job / GiB:.1f} GiB, "
+            f"{machine['mem_usable'] / GiB:.1f} GiB usable -> {limits['memory']} jobs",
+        ]
+        bottleneck = min(limits, key=limits.get)
+        jobs, threads = self._split_cores(machine['cores'], limits[bottleneck])
+        reasons.append(f"bound by {bottleneck}: {jobs} jobs x {threads} threads")
+        return {"section": "call", "threads_key": "Threads", "Threads": threads,
+                "Parallel_job": jobs, "reasons": reasons}
+
+    def plan(self, run_modules: dict) -> dict:
+        """
+        build the per-stage plan for the selected modules
+        :return: {"machine": dict, "stages": {module: plan}}
+        """
+        machine = self.probe_machine()
+        planners = {"vg": self._plan_vg, "wgs": self._plan_wgs, "call": self._plan_call}
+        stages = {
+            module: planner(machine)
+            for module, planner in planners.items()
+            if run_modules.get(module)
+        }
+        return {"machine": machine, "stages": stages}
+
+    def apply(self, plan: dict, keep: dict | None = None) -> dict:
+        """
+        write the chosen Threads / Parallel_job back into the config
+        :param keep: explicit CLI overrides ({section: {key: value}}), these are never replaced
+        """
+        keep = keep or {}
+        for stage in plan['stages'].values():
+            section = self.config.setdefault(stage['section'], {})
+            fixed = keep.get(stage['section'], {})
+            chosen = {stage['threads_key']: stage['Threads'], 'Parallel_job': stage['Parallel_job']}
+            for key, value in chosen.items():
+                if value is None or key in fixed:
+                    continue
+                section[key] = value
+            logging.info(f"Auto-tune [{stage['section']}]: {stage['threads_key']}={section[stage['threads_key']]}"
+                         + (f", Parallel_job={section['Parallel_job']}" if stage['Parallel_job'] else ""))
+        return self.config
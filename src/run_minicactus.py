@@ -4,6 +4,9 @@ import subprocess
 import shlex
 from pathlib import Path
 
+from src.artifact_store import ArtifactStore, detach_links
+from src.preprocess_assembly import AssemblyPreprocessor
+
 
 class CactusRunner:
     """
@@ -29,10 +32,11 @@ class CactusRunner:
 
         return cactus_dir
 
-    def _cactus_command(self) -> list:
+    def _cactus_command(self, seq_file: Path) -> list:
         """
         generate run command
         cactus jobStore will use the new directory which created by generate_cactus_dir
+        :param seq_file: seqFile handed to cactus (raw or preprocessed)
         :return: cmd
         """
         # use generate_cactus_dir object to create cactus directory
@@ -44,7 +48,7 @@ class CactusRunner:
         cmd = [
             "cactus-pangenome",
             str(cactus_job_store),
-            str(self.Cactus['seqFile']),
+            str(seq_file),
             "--outDir", str(cactus_dir),
             "--outName", str(self.Global['filePrefix']),
             "--maxCores", str(self.Cactus['maxCores']),
@@ -61,9 +65,63 @@ class CactusRunner:
             cmd = prefix_cmd + cmd
         return cmd
 
+    @staticmethod
+    def _outputs(cactus_dir: Path) -> list[Path]:
+        """cactus outputs, the toil jobStore is scratch space"""
+        if not cactus_dir.exists():
+            return []
+        return [path for path in cactus_dir.rglob("*")
+                if path.is_file() and "jobStore" not in path.relative_to(cactus_dir).parts]
+
+    def _cactus_version(self) -> str:
+        cmd = ["cactus-pangenome", "--version"]
+        singularity_image = self.Cactus.get('singularityImage')
+        if singularity_image:
+            cmd = ["singularity", "exec", str(singularity_image)] + cmd
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        except (OSError, subprocess.CalledProcessError):
+            return ""
+        lines = (result.stdout or result.stderr).strip().splitlines()
+        return lines[0] if lines else ""
+
+    def _artifact_key(self, store: ArtifactStore) -> str:
+        """inputs and parameters that change the cactus outputs"""
+        genomes = AssemblyPreprocessor(self.config).parser_seqfile()
+        with open(self.Cactus['seqFile'], 'r') as f:
+            tree = [line.strip() for line in f if line.strip().startswith('(')]
+        params = {
+            "genomes": [name for name, _ in genomes],
+            "tree": tree,
+            "reference": self.Cactus['reference'],
+            "filePrefix": self.Global['filePrefix'],
+            "outFormat": self.CactusOutFormat,
+            "singularityImage": self.Cactus.get('singularityImage', ""),
+            "preprocess": bool(self.config.get('Preprocess', {}).get('enable')),
+            # graph and index formats change between cactus releases
+            "cactus": self._cactus_version(),
+        }
+        return store.key("cactus", params, [fasta for _, fasta in genomes])
+
+    def _build(self):
+        seq_file = Path(self.Cactus['seqFile'])
+        if self.config.get('Preprocess', {}).get('enable'):
+            logging.info("Preprocessing assemblies before cactus-pangenome")
+            seq_file = AssemblyPreprocessor(self.config).run_preprocess()
+
+        cactus_cmd = self._cactus_command(seq_file)
+        logging.info(f"Start running cactus-pangenome: {' '.join(cactus_cmd)}")
+
+        try:
+            subprocess.run(cactus_cmd, capture_output=False, check=True, text=True)
+            logging.info(f"cactus-pangenome finished")
+        except subprocess.CalledProcessError as e:
+            logging.error(f"cactus-pangenome error: {e.returncode}")
+            sys.exit(1)
+
     def run_cactus(self) -> None:
         """
-        run cactus
+        run cactus, or reuse the outputs of an identical run from the artifact store
         :return:
         """
         if not Path(self.Cactus['seqFile']).exists():
@@ -71,15 +129,21 @@ class CactusRunner:
                           f"pangenome.")
             sys.exit(1)
 
-        cactus_cmd = self._cactus_command()
-        logging.info(f"Start running cactus-pangenome: {' '.join(cactus_cmd)}")
+        store = ArtifactStore(self.config)
+        cactus_dir = self.generate_cactus_dir()
+        if not store.enabled:
+            # outputs an earlier run materialized from a store are still links into it
+            detach_links(self._outputs(cactus_dir))
+            self._build()
+            return
 
-        try:
-            subprocess.run(cactus_cmd, capture_output=False, check=True, text=True)
-            logging.info(f"cactus-pangenome finished")
-        except subprocess.CalledProcessError as e:
-            logging.error(f"cactus-pangenome error: {e.returncode}")
-            sys.exit(1)
+        key = self._artifact_key(store)
+        with store.building(key):
+            if store.materialize(key, cactus_dir):
+                return
+            detach_links(self._outputs(cactus_dir))
+            self._build()
+            store.publish(key, "cactus", cactus_dir, self._outputs(cactus_dir))
 
 if __name__ == '__main__':
     from src.config_loader import ConfigManager
@@ -0,0 +1,143 @@
+import logging
+import re
+from pathlib import Path
+
+from src.fastq_stream import LANE_SEPARATOR
+
+# file name hints of long-read runs -> ReadType (giraffe parameter preset)
+# hints must be whole tokens ("_", "." and "-" separate), so control / success do not match ont / ccs
+LONG_READ_HINTS = [
+    (re.compile(r"(?<![A-Za-z0-9])(hifi|ccs)(?![A-Za-z0-9])", re.IGNORECASE), "hifi"),
+    # PacBio CLR subreads and nanopore reads are error-prone, closest to the r10 preset
+    (re.compile(r"(?<![A-Za-z0-9])(subreads|ont|nanopore)(?![A-Za-z0-9])", re.IGNORECASE), "r10"),
+]
+
+# Paired-end R1: {SampleID}_1_clean.fq.gz
+# Paired-end R2: {SampleID}_2_clean.fq.gz
+R1_PATTERN = re.compile(r"(.+)_1_clean\.fq\.gz$")
+# Multi-lane: {SampleID}_L001_R1_001.fastq.gz, {SampleID}_L1_1.fq.gz, {SampleID}_L2_2_clean.fq.gz ...
+LANE_PATTERN = re.compile(r"(.+?)_L(\d+)_R?([12])(?:_\d+)?(?:_clean)?\.(?:fq|fastq)(?:\.gz)?$")
+# Common sequencing file suffixes (used for single-end identification)
+FQ_SUFFIXES = {".fq.gz", ".fastq.gz", ".fq", ".fastq"}
+
+
+def guess_read_type(name: str) -> str:
+    for pattern, read_type in LONG_READ_HINTS:
+        if pattern.search(name):
+            return read_type
+    return "short"
+
+
+def expects_mate(name: str) -> bool:
+    """True for an R1 file name whose R2 may still be missing (paired-end naming)"""
+    lane = LANE_PATTERN.match(name)
+    return bool(R1_PATTERN.match(name) or (lane and lane.group(3) == "1"))
+
+
+def scan_fastqs(input_path: Path, read_type: str = "auto", quiet: bool = False) -> dict[str, dict]:
+    """
+    find the samples of a FASTQ directory (recursive)
+    :param read_type: ReadType of every sample, "auto" guesses long reads from the file names
+    :param quiet: per-sample messages at debug level, for repeated scans
+    :return: {SampleID: {'SampleID', 'R1', 'R2', 'ReadType'}}, lanes of a mate joined with ';'
+    """
+    info = logging.debug if quiet else logging.info
+    warning = logging.debug if quiet else logging.warning
+
+    samples = {}  # {SampleID: {'SampleID': str, 'R1': str, 'R2': str, 'ReadType': str}}
+    all_files = sorted(list(Path(input_path).rglob("*")))
+
+    used_files = set()
+
+    # Phase 0: Identify multi-lane samples, lanes of one mate are joined with ';' in lane order
+    info("Searching for multi-lane files...")
+    lanes = {}  # {SampleID: {mate: [(lane, path)]}}
+    for file_path in all_files:
+        if file_path.is_dir():
+            continue
+        match_lane = LANE_PATTERN.match(file_path.name)
+        if match_lane:
+            sample_id, lane, mate = match_lane.group(1), int(match_lane.group(2)), match_lane.group(3)
+            lanes.setdefault(sample_id, {}).setdefault(mate, []).append((lane, file_path))
+    for sample_id, mates in lanes.items():
+        r1 = sorted(mates.get('1', []))
+        r2 = sorted(mates.get('2', []))
+        if not r1:
+            continue
+        if r2 and [lane for lane, _ in r1] != [lane for lane, _ in r2]:
+            warning(f"Lanes of R1 and R2 differ for {sample_id}, skipping its lane files")
+            continue
+        samples[sample_id] = {
+            'SampleID': sample_id,
+            'R1': LANE_SEPARATOR.join(str(path.resolve()) for _, path in r1),
+            'R2': LANE_SEPARATOR.join(str(path.resolve()) for _, path in r2),
+            'ReadType': 'short'
+        }
+        used_files.update(path for _, path in r1 + r2)
+        info(f"Found multi-lane sample: {sample_id} ({len(r1)} lanes, {'PE' if r2 else 'SE'})")
+
+    # Phase 1: Identify paired-end files
+    info("Searching for paired-end files...")
+    for file_path in all_files:
+        if file_path.is_dir() or file_path in used_files:
+            continue
+
+        name = file_path.name
+        match_r1 = R1_PATTERN.match(name)
+
+        if match_r1:
+            sample_id = match_r1.group(1)
+            # Construct expected R2 filename
+            r2_name = name.replace("_1_clean.fq.gz", "_2_clean.fq.gz")
+            r2_path = file_path.parent / r2_name
+
+            if r2_path.exists():
+                samples[sample_id] = {
+                    'SampleID': sample_id,
+                    'R1': str(file_path.resolve()),
+                    'R2': str(r2_path.resolve()),
+                    'ReadType': 'short'
+                }
+                used_files.add(file_path)
+                used_files.add(r2_path)
+                info(f"Found PE sample: {sample_id}")
+            else:
+                # Found R1 without corresponding R2, treat as single-end
+                samples[sample_id] = {
+                    'SampleID': sample_id,
+                    'R1': str(file_path.resolve()),
+                    'R2': '',
+                    'ReadType': 'short'
+                }
+                used_files.add(file_path)
+                warning(f"Found orphan R1 (treating as SE): {sample_id}")
+
+    # Phase 2: Identify single-end files (excluding already identified PE files)
+    info("Searching for single-end files...")
+    for file_path in all_files:
+        if file_path.is_dir() or file_path in used_files:
+            continue
+
+        # Check if the file has a sequencing suffix
+        is_fq = any(file_path.name.endswith(suffix) for suffix in FQ_SUFFIXES)
+        if is_fq:
+            # Simple SE logic: remove all known suffixes to get SampleID
+            sample_id = file_path.name
+            for suffix in sorted(list(FQ_SUFFIXES) + [".clean"], key=len, reverse=True):
+                if sample_id.endswith(suffix):
+                    sample_id = sample_id[:-len(suffix)]
+
+            if sample_id not in samples:
+                samples[sample_id] = {
+                    'SampleID': sample_id,
+                    'R1': str(file_path.resolve()),
+                    'R2': '',
+                    'ReadType': guess_read_type(file_path.name)
+                }
+                used_files.add(file_path)
+                info(f"Found SE sample: {sample_id} ({samples[sample_id]['ReadType']})")
+
+    if read_type != "auto":
+        for sample in samples.values():
+            sample['ReadType'] = read_type
+    return samples
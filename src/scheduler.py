@@ -0,0 +1,373 @@
+import json
+import logging
+import os
+import signal
+import time
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Callable
+
+from src.metrics import ACTIVE_JOBS, BYTES_WRITTEN, QUEUE_DEPTH, SAMPLES, SPECULATIVE, directory_size
+from src.resource_planner import GiB, read_meminfo
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def descendant_pids(root_pid: int) -> list[int]:
+    """all live descendants of root_pid, found by walking /proc/<pid>/stat parent links"""
+    children: dict[int, list[int]] = {}
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry.name}/stat", 'r') as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # the command name may contain spaces, fields after ")" are fixed
+        ppid = int(stat.rsplit(")", 1)[1].split()[1])
+        children.setdefault(ppid, []).append(int(entry.name))
+
+    pids, stack = [], [root_pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            pids.append(child)
+            stack.append(child)
+    return pids
+
+
+def process_rss(pid: int) -> int:
+    """resident memory of one process in bytes, 0 when it already exited"""
+    try:
+        with open(f"/proc/{pid}/statm", 'r') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+class AdmissionController:
+    """
+    Memory-aware admission control
+    Only let a new sample job start when MemAvailable can hold it together with the
+    remaining growth of the jobs already running. Throttling is recorded in a jsonl log.
+    """
+    def __init__(self, stage: str, log_file: Path, mem_per_job: int, reserve: int):
+        self.stage = stage
+        self.log_file = log_file
+        # prior estimate, raised by the largest per-job RSS actually observed
+        self.mem_per_job = mem_per_job
+        self.observed_per_job = 0
+        self.reserve = reserve
+
+        self.throttled_since: float | None = None
+        self.throttle_count = 0
+        self.throttle_seconds = 0.0
+
+    def _record(self, event: str, **fields):
+        self.log_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.log_file, 'a') as f:
+            f.write(json.dumps({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "stage": self.stage,
+                                "event": event, **fields}) + "\n")
+
+    def admit(self, running: int) -> bool:
+        """
+        decide whether one more job may start now
+        :param running: number of jobs currently running
+        """
+        available = read_meminfo().get("MemAvailable")
+        if available is None:
+            # no /proc/meminfo, nothing to base a decision on
+            return True
+
+        children_rss = sum(process_rss(pid) for pid in descendant_pids(os.getpid()))
+        if running:
+            self.observed_per_job = max(self.observed_per_job, children_rss // running)
+        per_job = max(self.mem_per_job, self.observed_per_job)
+        # running jobs that have not reached their peak yet will still take memory
+        outstanding = max(0, per_job * running - children_rss)
+        need = per_job + outstanding + self.reserve
+
+        # always keep at least one job running, otherwise the batch can never finish
+        if running == 0 or available >= need:
+            if self.throttled_since is not None:
+                waited = time.monotonic() - self.throttled_since
+                self.throttle_seconds += waited
+                self.throttled_since = None
+                self._record("admitted", waited_s=round(waited, 1), available=available, need=need,
+                             running=running)
+                logging.info(f"[{self.stage}] memory headroom back after {waited:.0f}s, starting next job")
+            return True
+
+        if self.throttled_since is None:
+            self.throttled_since = time.monotonic()
+            self.throttle_count += 1
+            self._record("throttled", available=available, need=need, running=running,
+                         children_rss=children_rss, per_job=per_job)
+            logging.warning(f"[{self.stage}] throttled: {available / GiB:.1f} GiB available, next job needs "
+                            f"~{need / GiB:.1f} GiB ({running} running, {children_rss / GiB:.1f} GiB RSS)")
+        return False
+
+    def summary(self) -> str:
+        return f"throttled {self.throttle_count} time(s), {self.throttle_seconds:.0f}s waiting for memory"
+
+
+def _run_attempt(fn: Callable[..., bool], args: tuple, speculative: bool, pid_file: Path) -> bool:
+    """worker side wrapper: record the worker pid so the scheduler can kill the job's processes"""
+    pid_file.write_text(str(os.getpid()))
+    if speculative:
+        return fn(*args, speculative=True)
+    return fn(*args)
+
+
+class SpeculationPolicy:
+    """
+    Straggler detection for speculative re-execution
+    A running sample is a straggler when it has taken SlowdownFactor times longer than
+    its peers of similar input size needed, measured as bytes per second.
+    """
+    def __init__(self, sizes: dict[str, int], slowdown_factor: float = 2.0, min_peers: int = 3,
+                 similar_size: float = 2.0):
+        self.sizes = sizes
+        self.slowdown_factor = slowdown_factor
+        self.min_peers = min_peers
+        self.similar_size = similar_size
+        # bytes/s of every sample that finished successfully
+        self.rates: dict[str, float] = {}
+
+    def finished(self, sample_id: str, duration: float):
+        if duration > 0 and self.sizes.get(sample_id):
+            self.rates[sample_id] = self.sizes[sample_id] / duration
+
+    def expected_duration(self, sample_id: str) -> float | None:
+        size = self.sizes.get(sample_id)
+        if not size or len(self.rates) < self.min_peers:
+            return None
+        # prefer peers of similar size, fall back to all peers
+        peers = [rate for peer, rate in self.rates.items()
+                 if 1 / self.similar_size <= self.sizes[peer] / size <= self.similar_size]
+        if len(peers) < self.min_peers:
+            peers = list(self.rates.values())
+        peers.sort()
+        median_rate = peers[len(peers) // 2]
+        return size / median_rate
+
+    def is_straggler(self, sample_id: str, elapsed: float, fraction: float | None = None) -> bool:
+        """
+        :param fraction: share of the input already consumed, when progress is tracked
+        """
+        expected = self.expected_duration(sample_id)
+        if expected is None or elapsed < self.slowdown_factor * expected:
+            return False
+        if fraction:
+            # a sample close to the end is cheaper to wait for than to restart
+            projected = elapsed / fraction
+            return projected - elapsed > expected
+        return True
+
+
+class SampleScheduler:
+    """
+    Run one function per sample in a process pool
+    Jobs are started one by one so that admission control can hold them back.
+    With a speculation policy, stragglers get a duplicate attempt once the queue is empty
+    and slots are free; the first attempt to succeed wins and the other one is killed.
+    """
+    def __init__(self, stage: str, parallel_job: int, admission: AdmissionController | None = None,
+                 poll_interval: float = 5, refresh_interval: float = 2, stage_dir: Path | None = None):
+        self.stage = stage
+        self.stage_dir = stage_dir
+        self.parallel_job = max(1, parallel_job)
+        self.admission = admission
+        self.poll_interval = poll_interval
+        self.refresh_interval = refresh_interval
+
+    def _pid_file(self, sample_id: str, speculative: bool) -> Path:
+        job_dir = (self.stage_dir or Path(".")) / ".jobs"
+        job_dir.mkdir(parents=True, exist_ok=True)
+        return job_dir / f"{sample_id}.{'speculative' if speculative else 'primary'}.pid"
+
+    def _cancel(self, future, pid_file: Path):
+        """kill the processes of one attempt until its worker function has returned"""
+        while not future.done():
+            try:
+                worker_pid = int(pid_file.read_text())
+            except (OSError, ValueError):
+                worker_pid = None
+            # only the children: killing the pool worker itself would break the pool
+            for pid in descendant_pids(worker_pid) if worker_pid else []:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            wait([future], timeout=2)
+
+    def run(self, fn: Callable[..., bool], jobs: dict[str, tuple], progress=None,
+            speculation: SpeculationPolicy | None = None,
+            resolve: Callable[[str, bool], bool] | None = None,
+            feed: Callable[[float], dict[str, tuple] | None] | None = None,
+            on_done: Callable[[str, bool], None] | None = None) -> dict[str, bool]:
+        """
+        :param fn: picklable worker, returns True on success. With speculation it must accept
+                   speculative=True and write into an isolated directory in that case
+        :param jobs: {sample_id: args of fn}
+        :param progress: optional BatchProgress, polled while the jobs run
+        :param speculation: optional straggler policy
+        :param resolve: resolve(sample_id, speculative_won) called after a speculated sample is
+                        decided, moves the winning outputs in place and removes the duplicate;
+                        False fails the sample
+        :param feed: feed(timeout) returns jobs that arrived while the batch runs, None once no
+                     more will come; it may block up to timeout when nothing else is running
+        :param on_done: on_done(sample_id, success) called for every finished sample
+        :return: {sample_id: success}
+        """
+        jobs = dict(jobs)
+        pending = list(jobs.items())
+        results: dict[str, bool] = {}
+        timeout = self.poll_interval
+        if progress:
+            timeout = min(timeout, self.refresh_interval)
+
+        # future -> (sample_id, speculative)
+        running: dict = {}
+        started: dict[tuple[str, bool], float] = {}
+        speculated: set[str] = set()
+
+        def submit(executor, sample_id: str, speculative: bool):
+            pid_file = self._pid_file(sample_id, speculative)
+            future = executor.submit(_run_attempt, fn, jobs[sample_id], speculative, pid_file)
+            running[future] = (sample_id, speculative)
+            started[(sample_id, speculative)] = time.monotonic()
+
+        with ProcessPoolExecutor(max_workers=self.parallel_job) as executor, progress or nullcontext():
+            feeding = feed is not None
+            while pending or running or feeding:
+                if feeding:
+                    arrived = feed(0 if pending or running else timeout)
+                    if arrived is None:
+                        feeding = False
+                    else:
+                        jobs.update(arrived)
+                        pending.extend(arrived.items())
+
+                while pending and len(running) < self.parallel_job:
+                    if self.admission and not self.admission.admit(len(running)):
+                        break
+                    sample_id, _ = pending.pop(0)
+                    submit(executor, sample_id, False)
+                    if progress:
+                        progress.start(sample_id)
+
+                # other work is done and slots are free: duplicate the stragglers
+                if speculation and not pending and len(running) < self.parallel_job:
+                    for sample_id, speculative in list(running.values()):
+                        if len(running) >= self.parallel_job:
+                            break
+                        if speculative or sample_id in speculated:
+                            continue
+                        elapsed = time.monotonic() - started[(sample_id, False)]
+                        fraction = None
+                        if progress and progress.sizes.get(sample_id):
+                            fraction = progress.consumed.get(sample_id, 0) / progress.sizes[sample_id]
+                        if not speculation.is_straggler(sample_id, elapsed, fraction):
+                            continue
+                        if self.admission and not self.admission.admit(len(running)):
+                            break
+                        logging.warning(f"[{self.stage}] {sample_id} is a straggler ({elapsed:.0f}s), "
+                                        f"starting a speculative copy")
+                        speculated.add(sample_id)
+                        submit(executor, sample_id, True)
+                        SPECULATIVE.inc(stage=self.stage, outcome="started")
+
+                QUEUE_DEPTH.set(len(pending), stage=self.stage)
+                ACTIVE_JOBS.set(len(running), stage=self.stage)
+
+                if not running:
+                    # waiting for new jobs only, the feed blocks instead
+                    continue
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future not in running:
+                        # loser attempt already cancelled while its sibling won
+                        continue
+                    sample_id, speculative = running.pop(future)
+                    self._pid_file(sample_id, speculative).unlink(missing_ok=True)
+                    duration = time.monotonic() - started[(sample_id, speculative)]
+                    try:
+                        success = future.result()
+                    except Exception as e:
+                        success = False
+                        logging.error(f">>> Sample {sample_id} crashed with exception: {e}")
+
+                    sibling = next((f for f, job in running.items() if job[0] == sample_id), None)
+                    if sibling is not None:
+                        if not success:
+                            # keep waiting for the other attempt
+                            continue
+                        running.pop(sibling)
+                        self._cancel(sibling, self._pid_file(sample_id, not speculative))
+                        self._pid_file(sample_id, not speculative).unlink(missing_ok=True)
+                        logging.info(f"[{self.stage}] {sample_id}: "
+                                     f"{'speculative copy' if speculative else 'original'} finished first")
+                        SPECULATIVE.inc(stage=self.stage, outcome="won" if speculative else "lost")
+
+                    # outputs of the speculated sample that could not be kept fail this sample only
+                    if sample_id in speculated and resolve and not resolve(sample_id, speculative and success):
+                        success = False
+                    status = "SUCCESS" if success else "FAILED"
+                    logging.info(f">>> Sample {sample_id}: Pipeline {status}")
+                    results[sample_id] = success
+                    SAMPLES.inc(stage=self.stage, status="success" if success else "failure")
+                    if speculation and success:
+                        speculation.finished(sample_id, duration)
+                    if progress:
+                        progress.finish(sample_id, success)
+                    if on_done:
+                        on_done(sample_id, success)
+                if done and self.stage_dir and self.stage_dir.exists():
+                    BYTES_WRITTEN.set(directory_size(self.stage_dir), stage=self.stage)
+                if progress:
+                    progress.update()
+
+        ACTIVE_JOBS.set(0, stage=self.stage)
+        if self.admission:
+            logging.info(f"[{self.stage}] admission control {self.admission.summary()}")
+        if speculated:
+            logging.info(f"[{self.stage}] speculative copies started for {len(speculated)} sample(s)")
+        return results
+
+
+def build_speculation(config: dict, sizes: dict[str, int]) -> SpeculationPolicy | None:
+    """straggler policy when [Speculation] enable is set"""
+    speculation_cfg = config.get('Speculation', {})
+    if not speculation_cfg.get('enable'):
+        return None
+    return SpeculationPolicy(
+        sizes,
+        slowdown_factor=speculation_cfg.get('SlowdownFactor', 2.0),
+        min_peers=speculation_cfg.get('MinPeers', 3),
+        similar_size=speculation_cfg.get('SimilarSize', 2.0),
+    )
+
+
+def build_scheduler(config: dict, stage: str, parallel_job: int, stage_dir: Path,
+                    mem_per_job: int) -> SampleScheduler:
+    """
+    scheduler for one stage, with admission control when [Admission] enable is set
+    :param mem_per_job: estimated peak memory of one job, used until real RSS is observed
+    """
+    admission_cfg = config.get('Admission', {})
+    poll_interval = admission_cfg.get('PollInterval', 5)
+    admission = None
+    if admission_cfg.get('enable'):
+        if admission_cfg.get('MemPerJobGB'):
+            mem_per_job = int(admission_cfg['MemPerJobGB'] * GiB)
+        admission = AdmissionController(
+            stage,
+            log_file=stage_dir / "admission_log.jsonl",
+            mem_per_job=mem_per_job,
+            reserve=int(admission_cfg.get('ReserveMemGB', 2) * GiB),
+        )
+    refresh_interval = config.get('Progress', {}).get('RefreshInterval', 2)
+    return SampleScheduler(stage, parallel_job, admission=admission, poll_interval=poll_interval,
+                           refresh_interval=refresh_interval, stage_dir=stage_dir)
@@ -0,0 +1,182 @@
+import fcntl
+import heapq
+import json
+import logging
+import os
+import socket
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+SHARD_DIR = "shards"
+# stage -> (stage directory, per-sample output that marks a finished sample)
+STAGE_OUTPUTS = {
+    "wgs": ("5.wgs_analysis", "{sample}.pack"),
+    "call": ("6.call_variant", "{sample}.vcf"),
+}
+
+
+def parse_shard(value: str | None) -> tuple[int, int] | None:
+    """'i/N' (1 <= i <= N) -> (i, N), None when not sharded"""
+    if not value:
+        return None
+    index, sep, count = str(value).partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"shard must look like 'i/N', got {value!r}")
+    if not sep or count < 1 or not 1 <= index <= count:
+        raise ValueError(f"shard must look like 'i/N' with 1 <= i <= N, got {value!r}")
+    return index, count
+
+
+def assign_shards(sizes: dict[str, int], count: int) -> dict[str, int]:
+    """
+    size-balanced assignment of samples to shards 1..count (longest processing time first):
+    the largest sample goes to the least loaded shard. Ties are broken by sample ID and shard
+    number, so every invocation computes the same assignment from the same sizes.
+    """
+    loads = [(0, 0, shard) for shard in range(1, count + 1)]  # (bytes, samples, shard)
+    assignment = {}
+    for sample_id in sorted(sizes, key=lambda s: (-sizes[s], s)):
+        load, n, shard = heapq.heappop(loads)
+        assignment[sample_id] = shard
+        heapq.heappush(loads, (load + sizes[sample_id], n + 1, shard))
+    return assignment
+
+
+@contextmanager
+def file_lock(lock_file: Path):
+    """exclusive flock, serializes one-time preparation of concurrent shards in a shared work_dir"""
+    lock_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_file, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def write_json_atomic(path: Path, data: dict):
+    tmp_file = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp_file.write_text(json.dumps(data, indent=2))
+    tmp_file.replace(path)
+
+
+class ShardPlan:
+    """
+    --shard i/N: split one cohort over N independent invocations sharing a work_dir
+    The first invocation stores the size-balanced assignment in shards/plan_N.json, later ones
+    (and the call stage) reuse it, so the split does not change when inputs are cleaned up
+    or packs appear. Each shard records the samples it processed per stage in
+    shards/{stage}.{i}of{N}.json for `main.py shard-check`.
+    """
+    def __init__(self, config: dict):
+        self.work_dir = Path(config['Global']['work_dir']).resolve()
+        self.shard_dir = self.work_dir / SHARD_DIR
+        spec = parse_shard(config.get('Shard', {}).get('shard'))
+        self.index, self.count = spec or (1, 1)
+        self.enabled = spec is not None
+
+    @property
+    def name(self) -> str:
+        return f"{self.index}of{self.count}"
+
+    @property
+    def plan_file(self) -> Path:
+        return self.shard_dir / f"plan_{self.count}.json"
+
+    def load(self, sizes: dict[str, int], basis: str, verify: bool = True) -> dict:
+        """
+        the stored plan, created from sizes when there is none yet
+        :param basis: what sizes measure, recorded in the plan
+        :param verify: fail when the stored plan does not cover exactly these samples
+        """
+        with file_lock(self.shard_dir / ".plan.lock"):
+            if self.plan_file.exists():
+                plan = json.loads(self.plan_file.read_text())
+            else:
+                plan = {
+                    "shards": self.count,
+                    "basis": basis,
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "sizes": sizes,
+                    "assignment": assign_shards(sizes, self.count),
+                }
+                write_json_atomic(self.plan_file, plan)
+                logging.info(f"Shard plan of {len(sizes)} samples over {self.count} shards written to {self.plan_file}")
+        assignment = plan["assignment"]
+        if verify and set(assignment) != set(sizes):
+            added = sorted(set(sizes) - set(assignment))
+            removed = sorted(set(assignment) - set(sizes))
+            raise ValueError(f"cohort differs from {self.plan_file} (new: {added[:5]}, missing: {removed[:5]}), "
+                             f"delete it to re-shard")
+        return plan
+
+    def select(self, sizes: dict[str, int], basis: str, verify: bool = True) -> set[str]:
+        """samples of this shard"""
+        plan = self.load(sizes, basis, verify)
+        mine = {sample for sample, shard in plan["assignment"].items() if shard == self.index}
+        logging.info(f"Shard {self.index}/{self.count}: {len(mine)} of {len(plan['assignment'])} samples, "
+                     f"{sum(plan['sizes'].get(s, 0) for s in mine) / 1024 ** 3:.1f} GiB ({plan['basis']})")
+        return mine
+
+    def write_manifest(self, stage: str, status: dict[str, bool]):
+        """samples of this shard and whether their output exists"""
+        manifest = {
+            "stage": stage,
+            "shard": self.index,
+            "shards": self.count,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "samples": {sample: "done" if ok else "failed" for sample, ok in sorted(status.items())},
+        }
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(self.shard_dir / f"{stage}.{self.name}.json", manifest)
+
+
+def check_shards(work_dir: Path, count: int, cohort: set[str] | None = None) -> tuple[list[list], list[str]]:
+    """
+    check that the shards of plan_{count}.json together processed the cohort exactly once
+    :param cohort: sample IDs of the DataTable, compared with the plan when given
+    :return: (rows of stage, shard, samples, done, failed; problems)
+    """
+    shard_dir = Path(work_dir) / SHARD_DIR
+    plan_file = shard_dir / f"plan_{count}.json"
+    if not plan_file.exists():
+        return [], [f"no shard plan {plan_file}"]
+    assignment: dict[str, int] = json.loads(plan_file.read_text())["assignment"]
+    problems = []
+    if cohort is not None:
+        for sample in sorted(cohort - set(assignment)):
+            problems.append(f"{sample}: in the DataTable but not in the shard plan")
+        for sample in sorted(set(assignment) - cohort):
+            problems.append(f"{sample}: in the shard plan but not in the DataTable")
+
+    rows = []
+    for stage, (stage_dir, output) in STAGE_OUTPUTS.items():
+        manifests = {shard: shard_dir / f"{stage}.{shard}of{count}.json" for shard in range(1, count + 1)}
+        if not any(path.exists() for path in manifests.values()):
+            continue
+        seen: dict[str, int] = {}
+        for shard, path in manifests.items():
+            if not path.exists():
+                problems.append(f"{stage}: shard {shard}/{count} has no manifest ({path.name})")
+                continue
+            samples = json.loads(path.read_text())["samples"]
+            for sample, status in samples.items():
+                if sample in seen:
+                    problems.append(f"{stage}: {sample} processed by shards {seen[sample]} and {shard}")
+                seen[sample] = shard
+                if assignment.get(sample) != shard:
+                    problems.append(f"{stage}: {sample} processed by shard {shard}, "
+                                    f"planned for {assignment.get(sample, 'none')}")
+                output_file = Path(work_dir) / stage_dir / sample / output.format(sample=sample)
+                if status != "done" or not output_file.exists():
+                    problems.append(f"{stage}: {sample} of shard {shard} did not finish ({output_file} missing)")
+            done = sum(status == "done" for status in samples.values())
+            rows.append([stage, f"{shard}/{count}", len(samples), done, len(samples) - done])
+        for sample in sorted(set(assignment) - set(seen)):
+            problems.append(f"{stage}: {sample} was not processed by any shard")
+    return rows, problems
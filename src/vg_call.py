@@ -1,8 +1,44 @@
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
 from pathlib import Path
+import csv
+import gzip
+import json
 import logging
+import os
+import statistics
 import subprocess
 import sys
+import time
+
+from src.fastq_stream import fastq_bytes
+from src.resource_planner import ResourcePlanner
+from src.scheduler import build_scheduler
+from src.sharding import ShardPlan, file_lock
+
+def load_sites(sites_file: Path) -> frozenset[str]:
+    """known site IDs, read once per worker process instead of once per sample"""
+    return _read_sites(sites_file, sites_file.stat().st_mtime_ns)
+
+
+@lru_cache(maxsize=1)
+def _read_sites(sites_file: Path, mtime_ns: int) -> frozenset[str]:
+    with open(sites_file, "r") as f:
+        return frozenset(f.read().split())
+
+
+def _snarl_key(snarl: dict) -> tuple:
+    """(start node, backward, end node, backward) of a snarl in vg view -R JSON"""
+    start, end = snarl['start'], snarl['end']
+    return int(start['node_id']), bool(start.get('backward')), int(end['node_id']), bool(end.get('backward'))
+
+
+def _snarl_ids(snarl: dict) -> set[str]:
+    """site IDs of a snarl as written by vg deconstruct (>start>end), in both orientations"""
+    start, start_back, end, end_back = _snarl_key(snarl)
+    forward = f"{'<' if start_back else '>'}{start}{'<' if end_back else '>'}{end}"
+    reverse = f"{'>' if end_back else '<'}{end}{'>' if start_back else '<'}{start}"
+    return {forward, reverse}
+
 
 class CallVariantRunner:
     def __init__(self, config: dict):
@@ -15,21 +51,189 @@ class CallVariantRunner:
         self.gbz_file: Path = self.work_dir / "3.vg_index" / "vg_index.giraffe.gbz"
         # [call]
         self.call: dict = self.config['call']
+        # "denovo": full vg call, "known": genotype the sites of the cactus VCF
+        self.mode: str = self.call.get('mode', 'denovo')
+        self.known_dir: Path = self.call_dir / "known_sites"
+        self.snarls_file: Path = self.known_dir / "snarls.pb"
+        self.sites_file: Path = self.known_dir / "sites.txt"
+        # snarls of the known sites only, what vg call -a genotypes per sample
+        self.known_snarls_file: Path = self.known_dir / "known_snarls.pb"
+        # known mode: samples also called de novo, to report the speedup
+        self.baseline_samples: set[str] = set()
+        # samples of this shard (--shard), pack or not
+        self.shard_samples: list[str] = []
 
     def _parsing_path(self) -> list[Path]:
         """解析pack文件的地址, 以方便使用"""
-        return sorted(list(self.wgs_dir.rglob("*.pack")))
+        # skip leftovers of cancelled speculative copies (sample_dir/.speculative)
+        return sorted(p for p in self.wgs_dir.rglob("*.pack") if ".speculative" not in p.parts)
 
-    def _single_call_variant(self, pack_file: Path) -> bool:
-        """对单个pack文件进行输出"""
-        # 样本id前缀
-        sample_id = pack_file.stem
+    def _shard_packs(self, shard: ShardPlan, pack_files: list[Path]) -> list[Path]:
+        """
+        pack files of this shard, by the plan the wgs stage stored (same split as the mapping),
+        made from the DataTable FASTQ sizes or else the pack sizes when there is none yet
+        """
+        if shard.plan_file.exists() or not self._data_table():
+            sizes, basis = {p.stem: p.stat().st_size for p in pack_files}, "pack_bytes"
+        else:
+            from src.vg_wgs import VgWgsRunner
+            samples = VgWgsRunner(self.config).parser_csv()
+            sizes, basis = {s['SampleID']: fastq_bytes([s['R1'], s.get('R2')]) for s in samples}, "fastq_bytes"
+        # packs of other shards may still be missing, the plan is not compared with them
+        mine = shard.select(sizes, basis, verify=False)
+        found = {p.stem for p in pack_files}
+        missing = sorted(mine - found)
+        if missing:
+            logging.warning(f"Shard {shard.index}/{shard.count}: no pack for {len(missing)} samples "
+                            f"({', '.join(missing[:5])}), run --wgs with the same --shard first")
+        self.shard_samples = sorted(mine)
+        return [p for p in pack_files if p.stem in mine]
+
+    def _data_table(self) -> Path | None:
+        data_table = self.config.get('wgs', {}).get('DataTable')
+        return Path(data_table) if data_table and Path(data_table).exists() else None
+
+    def _cactus_vcf(self) -> Path | None:
+        """VCF written by cactus-pangenome (--vcf full)"""
+        prefix = self.config['Global']['filePrefix']
+        for name in (f"{prefix}.full.vcf.gz", f"{prefix}.vcf.gz"):
+            vcf = self.work_dir / "1.cactus" / name
+            if vcf.exists():
+                return vcf
+        return None
+
+    def _prepare_known_sites(self):
+        """
+        prepare the known sites once for all samples:
+        the snarl decomposition of the graph (so vg call does not recompute it per sample)
+        and the site IDs (>start>end snarl ids) of the cactus VCF
+        """
+        cactus_vcf = self._cactus_vcf()
+        if cactus_vcf is None:
+            logging.error("Known sites mode needs the cactus VCF ([CactusOutFormat] vcf = true) in 1.cactus.")
+            sys.exit(1)
+
+        self.known_dir.mkdir(parents=True, exist_ok=True)
+        if not self.snarls_file.exists() or self.snarls_file.stat().st_mtime < self.gbz_file.stat().st_mtime:
+            snarls_cmd = ["vg", "snarls", "--threads", str(self.call['Threads']), str(self.gbz_file.resolve())]
+            logging.info(f"Computing snarls once for all samples: {snarls_cmd}")
+            try:
+                with open(self.snarls_file, "wb") as w:
+                    subprocess.run(snarls_cmd, stdout=w, check=True, stderr=subprocess.PIPE)
+            except subprocess.CalledProcessError as e:
+                self.snarls_file.unlink(missing_ok=True)
+                logging.error(f"vg snarls error: {e.returncode}, stderr: {e.stderr}")
+                sys.exit(1)
+
+        if not self.sites_file.exists() or self.sites_file.stat().st_mtime < cactus_vcf.stat().st_mtime:
+            sites = set()
+            with gzip.open(cactus_vcf, "rt") as f:
+                for line in f:
+                    if line.startswith("#"):
+                        continue
+                    site_id = line.split("\t", 3)[2]
+                    if site_id != ".":
+                        sites.update(site_id.split(";"))
+            with open(self.sites_file, "w") as w:
+                w.writelines(f"{site}\n" for site in sorted(sites))
+            logging.info(f"{len(sites)} known sites taken from {cactus_vcf.name}")
+
+        if (not self.known_snarls_file.exists()
+                or self.known_snarls_file.stat().st_mtime < self.snarls_file.stat().st_mtime
+                or self.known_snarls_file.stat().st_mtime < self.sites_file.stat().st_mtime):
+            self._build_known_snarls()
+
+    def _build_known_snarls(self):
+        """
+        the snarls of the known sites (with their nested snarls and parents, vg call needs a
+        consistent snarl tree), so `vg call -a` genotypes only these instead of every snarl
+        """
+        sites = load_sites(self.sites_file)
+        try:
+            view = subprocess.run(["vg", "view", "-R", str(self.snarls_file)], check=True,
+                                  capture_output=True, text=True)
+        except subprocess.CalledProcessError as e:
+            logging.error(f"vg view error: {e.returncode}, stderr: {e.stderr}")
+            sys.exit(1)
+        snarls = [json.loads(line) for line in view.stdout.splitlines() if line.strip()]
+        parents, children = {}, {}
+        for snarl in snarls:
+            if snarl.get('parent'):
+                parents[_snarl_key(snarl)] = _snarl_key(snarl['parent'])
+                children.setdefault(_snarl_key(snarl['parent']), []).append(_snarl_key(snarl))
+
+        keep = {_snarl_key(snarl) for snarl in snarls if _snarl_ids(snarl) & sites}
+        matched = len(keep)
+        stack = list(keep)
+        while stack:
+            for child in children.get(stack.pop(), []):
+                if child not in keep:
+                    keep.add(child)
+                    stack.append(child)
+        for key in list(keep):
+            while key in parents and parents[key] not in keep:
+                key = parents[key]
+                keep.add(key)
+
+        selected = "".join(json.dumps(snarl) + "\n" for snarl in snarls if _snarl_key(snarl) in keep)
+        tmp_file = self.known_snarls_file.with_suffix(".tmp")
+        try:
+            with open(tmp_file, "wb") as w:
+                subprocess.run(["vg", "view", "-J", "-R", "-"], input=selected.encode(), stdout=w,
+                               check=True, stderr=subprocess.PIPE)
+            # read it back: a snarl file vg cannot load would only fail later, in every sample
+            check = subprocess.run(["vg", "view", "-R", str(tmp_file)], check=True, capture_output=True, text=True)
+            if sum(1 for line in check.stdout.splitlines() if line.strip()) != len(keep):
+                raise ValueError("snarl count differs after conversion")
+        except (subprocess.CalledProcessError, ValueError) as e:
+            tmp_file.unlink(missing_ok=True)
+            logging.warning(f"Could not write the known snarl subset ({e}), genotyping every snarl instead")
+            return
+        tmp_file.replace(self.known_snarls_file)
+        logging.info(f"{matched} of {len(snarls)} snarls match a known site, {len(keep)} kept with their "
+                     f"nested / parent snarls in {self.known_snarls_file.name}")
+
+    def _call_command(self, pack_file: Path, sample_id: str, mode: str | None = None) -> list:
         call_cmd = [
             "vg", "call",
             "--pack", str(pack_file.resolve()),
             "--threads", str(self.call['Threads']),
-            str(self.gbz_file.resolve()),
+            # name the sample column after the sample so per-sample VCFs can be merged
+            "--sample", sample_id,
         ]
+        if (mode or self.mode) == "known":
+            # report the known snarls (also 0/0), falls back to every snarl without the subset
+            snarls = self.known_snarls_file if self.known_snarls_file.exists() else self.snarls_file
+            call_cmd.extend(["--all-snarls", "--snarls", str(snarls)])
+        call_cmd.append(str(self.gbz_file.resolve()))
+        return call_cmd
+
+    def _single_call_variant(self, pack_file: Path) -> bool:
+        """对单个pack文件进行输出"""
+        # 样本id前缀
+        sample_id = pack_file.stem
+        call_cmd = self._call_command(pack_file, sample_id)
+        sample_dir = self.call_dir / sample_id
+        start = time.monotonic()
+        if self.mode == "known":
+            ok = self._single_genotype_known(call_cmd, sample_id)
+        else:
+            ok = self._single_denovo(call_cmd, sample_id)
+        if not ok:
+            return False
+        report = {"sample": sample_id, "mode": self.mode, "seconds": round(time.monotonic() - start, 2)}
+        if self.mode == "known" and sample_id in self.baseline_samples:
+            # the same sample called de novo (output discarded) to measure the known-sites speedup
+            denovo_cmd = self._call_command(pack_file, sample_id, mode="denovo")
+            logging.info(f"[{sample_id}] de novo call for the baseline: {denovo_cmd}")
+            start = time.monotonic()
+            result = subprocess.run(denovo_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=sample_dir)
+            if result.returncode == 0:
+                report["denovo_seconds"] = round(time.monotonic() - start, 2)
+        (sample_dir / "call_report.json").write_text(json.dumps(report, indent=2))
+        return True
+
+    def _single_denovo(self, call_cmd: list, sample_id: str) -> bool:
         # 创建样本目录
         sample_dir = self.call_dir / sample_id
         try:
@@ -44,6 +248,57 @@ class CallVariantRunner:
             return False
         return True
 
+    def _single_genotype_known(self, call_cmd: list, sample_id: str) -> bool:
+        """genotype the known snarls of one sample and keep only the cactus sites (not their nested snarls)"""
+        sites = load_sites(self.sites_file)
+
+        sample_dir = self.call_dir / sample_id
+        sample_dir.mkdir(parents=True, exist_ok=True)
+        vcf_file = sample_dir / f"{sample_id}.vcf"
+        logging.info(f"starting vg call (known sites), now running in {sample_dir}, command: {call_cmd}")
+        kept = 0
+        with open(vcf_file, "w") as w, open(sample_dir / "vg_call.log", "w") as log:
+            proc = subprocess.Popen(call_cmd, stdout=subprocess.PIPE, stderr=log, cwd=sample_dir, text=True)
+            for line in proc.stdout:
+                if line.startswith("#"):
+                    w.write(line)
+                    continue
+                site_id = line.split("\t", 3)[2]
+                if site_id in sites:
+                    w.write(line)
+                    kept += 1
+            if proc.wait() != 0:
+                logging.error(f"Sample: [{sample_id}] call variant error: {proc.returncode}, "
+                              f"see {sample_dir / 'vg_call.log'}")
+                return False
+        if not kept:
+            logging.warning(f"Sample: [{sample_id}] no call matched a known site ID, check the cactus VCF")
+        return True
+
+    def write_call_report(self):
+        """cohort table of the call time per sample, with the de novo baseline when measured"""
+        rows = []
+        for report_file in sorted(self.call_dir.glob("*/call_report.json")):
+            report = json.loads(report_file.read_text())
+            denovo = report.get('denovo_seconds')
+            rows.append([report['sample'], report['mode'], report['seconds'], "" if denovo is None else denovo,
+                         round(denovo / report['seconds'], 2) if denovo is not None and report['seconds'] else ""])
+        if not rows:
+            return
+        report_file = self.call_dir / "call_report.tsv"
+        tmp_file = report_file.with_name(f".{report_file.name}.{os.getpid()}.tmp")
+        with open(tmp_file, "w", newline="") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["sample", "mode", "seconds", "denovo_seconds", "speedup"])
+            writer.writerows(rows)
+        tmp_file.replace(report_file)
+        speedups = [row[4] for row in rows if row[4] != ""]
+        if speedups:
+            logging.info(f"Known-sites calling is {statistics.median(speedups):.2f}x faster than de novo "
+                         f"(median of {len(speedups)} baseline samples), see {report_file}")
+        else:
+            logging.info(f"Call times of {len(rows)} samples written to {report_file}")
+
     def run_vg_call(self):
         """运行vg call variant"""
         if not self.gbz_file.exists():
@@ -51,28 +306,41 @@ class CallVariantRunner:
             sys.exit(1)
 
         pack_files = self._parsing_path()
+        shard = ShardPlan(self.config)
+        if shard.enabled and pack_files:
+            pack_files = self._shard_packs(shard, pack_files)
+            if not pack_files:
+                shard.write_manifest("call", {s: False for s in self.shard_samples})
+                return
         if not pack_files:
             logging.error("No pack files found.")
             sys.exit(1)
 
+        if self.mode == "known":
+            # concurrent shards: the first one prepares, the others wait and find it current
+            with file_lock(self.call_dir / ".known_sites.lock"):
+                self._prepare_known_sites()
+        elif self.mode != "denovo":
+            logging.error(f"Unknown [call] mode: {self.mode}, use 'denovo' or 'known'")
+            sys.exit(1)
+
+        if self.mode == "known":
+            # the first samples are also called de novo for the comparison
+            self.baseline_samples = {p.stem for p in pack_files[:self.call.get('BaselineSamples', 0)]}
+
         parallel_job = self.call.get('Parallel_job', 1)
 
         logging.info(f"开始vg call variant 流程, 并行{parallel_job}个")
 
-        with ProcessPoolExecutor(max_workers=parallel_job) as executor:
-            future_to_pack = {
-                executor.submit(self._single_call_variant, pack_file): pack_file
-                for pack_file in pack_files
-            }
-
-            for future in as_completed(future_to_pack):
-                pack_file = future_to_pack[future]
-                try:
-                    success = future.result()
-                    status = "SUCCESS" if success else "FAILED"
-                    logging.info(f">>> Sample {pack_file.name}: Pipeline {status}")
-                except Exception as e:
-                    logging.error(f">>> Sample {pack_file.name} crashed with exception: {e}")
+        mem_per_job = ResourcePlanner(self.config).call_job_memory()
+        scheduler = build_scheduler(self.config, "call", parallel_job, self.call_dir, mem_per_job)
+        results = scheduler.run(
+            self._single_call_variant,
+            {pack_file.name: (pack_file,) for pack_file in pack_files}
+        )
+        self.write_call_report()
+        if shard.enabled:
+            shard.write_manifest("call", {s: bool(results.get(f"{s}.pack")) for s in self.shard_samples})
 
 if __name__ == "__main__":
     from src.config_loader import ConfigManager
@@ -0,0 +1,218 @@
+import json
+import logging
+import subprocess
+import sys
+from pathlib import Path
+
+from src.artifact_store import ArtifactStore, vg_version
+from src.fastq_stream import LaneStream, read_data_table, split_fastqs
+from src.progress import BatchProgress
+from src.resource_planner import ResourcePlanner
+from src.scheduler import build_scheduler
+
+# files written by vg autoindex --workflow mpmap --workflow rpvg --prefix rna
+RNA_INDEX_SUFFIXES = (
+    "spliced.xg", "spliced.gcsa", "spliced.gcsa.lcp", "spliced.dist", "haplotx.gbwt", "txorigin.tsv",
+)
+
+
+class VgRnaRunner:
+    """
+    RNA-seq module
+    Build the spliced pangenome indexes once from the cactus graph and the [rna] GFF3,
+    then map (vg mpmap) and quantify (rpvg) every sample of the DataTable. Alignments are
+    streamed from mpmap into rpvg, no intermediate alignment file is written.
+    """
+    def __init__(self, config: dict):
+        self.config = config
+
+        self.Global: dict = self.config['Global']
+        self.rna: dict = self.config['rna']
+
+        self.work_dir = Path(self.Global['work_dir']).resolve()
+        self.threads = self.rna['Threads']
+        self.gfa_file = self.work_dir / "1.cactus" / f"{self.Global['filePrefix']}.full.gfa"
+        # spliced indexes live next to the giraffe indexes
+        self.rna_index = self.work_dir / "3.vg_index" / "rna"
+        self.index_prefix = self.rna_index / "rna"
+        self.index_stamp = self.rna_index / "index.json"
+        self.rna_output = self.work_dir / "9.rna_seq"
+
+    def index_file(self, suffix: str) -> Path:
+        return self.rna_index / f"rna.{suffix}"
+
+    def parser_csv(self) -> list:
+        """Parse the rna DataTable, same columns as the wgs one (SampleID, R1, R2)"""
+        return read_data_table(self.rna['DataTable'])
+
+    def _index_inputs(self) -> dict:
+        """size and mtime of the graph and annotation the indexes were built from"""
+        inputs = {}
+        for path in (self.gfa_file, Path(self.rna['gff3'])):
+            stat = path.stat()
+            inputs[str(path.resolve())] = [stat.st_size, stat.st_mtime_ns]
+        return inputs
+
+    def _index_is_current(self) -> bool:
+        if not self.index_stamp.exists():
+            return False
+        if not all(self.index_file(suffix).exists() for suffix in RNA_INDEX_SUFFIXES):
+            return False
+        return json.loads(self.index_stamp.read_text()) == self._index_inputs()
+
+    def _autoindex_command(self) -> list:
+        return [
+            "vg", "autoindex",
+            "--workflow", "mpmap",
+            "--workflow", "rpvg",
+            "--prefix", str(self.index_prefix),
+            "--gfa", str(self.gfa_file),
+            "--tx-gff", str(Path(self.rna['gff3']).resolve()),
+            "--threads", str(self.threads),
+        ]
+
+    def _build_index(self):
+        autoindex_cmd = self._autoindex_command()
+        logging.info(f"Building spliced indexes in {self.rna_index}: {' '.join(autoindex_cmd)}")
+        try:
+            subprocess.run(autoindex_cmd, check=True, stderr=subprocess.PIPE, text=True, cwd=self.rna_index)
+        except subprocess.CalledProcessError as e:
+            logging.error(f"vg autoindex (mpmap/rpvg) error: {e.returncode}, stderr: {e.stderr}")
+            sys.exit(1)
+
+    def prepare_index(self):
+        """build the spliced indexes once, rebuild only when the gfa or the gff3 changed"""
+        self.rna_index.mkdir(parents=True, exist_ok=True)
+        if self._index_is_current():
+            logging.info(f"Spliced indexes in {self.rna_index} are up to date")
+            return
+
+        store = ArtifactStore(self.config)
+        if not store.enabled:
+            self._build_index()
+        else:
+            key = store.key("vg_autoindex_rna", {"workflow": ["mpmap", "rpvg"], "vg": vg_version()},
+                            [self.gfa_file, Path(self.rna['gff3'])])
+            with store.building(key):
+                if not store.materialize(key, self.rna_index):
+                    self._build_index()
+                    store.publish(key, "vg_autoindex_rna", self.rna_index,
+                                  [self.index_file(suffix) for suffix in RNA_INDEX_SUFFIXES])
+        self.index_stamp.write_text(json.dumps(self._index_inputs()))
+
+    def single_sample_process(self, sample_info: dict) -> bool:
+        """map one sample with vg mpmap and quantify the streamed alignments with rpvg"""
+        sample_id = sample_info['SampleID']
+        r1 = split_fastqs(sample_info['R1'])
+        r2 = split_fastqs(sample_info.get('R2'))
+
+        sample_dir = self.rna_output / sample_id
+        sample_dir.mkdir(parents=True, exist_ok=True)
+        # rpvg writes <prefix>.txt, renamed once the sample is complete (resume marker)
+        tmp_prefix = sample_dir / f".{sample_id}.tmp"
+        quant_file = sample_dir / f"{sample_id}.txt"
+
+        mpmap_cmd = [
+            "vg", "mpmap",
+            "--nt-type", "rna",
+            "--graph-name", str(self.index_file("spliced.xg")),
+            "--gcsa-name", str(self.index_file("spliced.gcsa")),
+            "--dist-name", str(self.index_file("spliced.dist")),
+            "--threads", str(self.threads),
+        ]
+
+        rpvg_cmd = [
+            "rpvg",
+            "--graph", str(self.index_file("spliced.xg")),
+            "--paths", str(self.index_file("haplotx.gbwt")),
+            "--path-info", str(self.index_file("txorigin.tsv")),
+            "--alignments", "/dev/stdin",
+            "--inference-model", "haplotype-transcripts",
+            "--output", str(tmp_prefix),
+            "--threads", str(self.threads),
+        ]
+        if not r2:
+            # rpvg assumes paired-end alignments unless told otherwise
+            rpvg_cmd.append("--single-end")
+
+        # multi-lane mates are streamed through fifos
+        stream = LaneStream([r1, r2], sample_dir, threads=max(1, self.threads // 4))
+        with stream as reads, open(sample_dir / "mpmap.log", "w") as mpmap_log, \
+                open(sample_dir / "rpvg.log", "w") as rpvg_log:
+            for fastq in reads:
+                mpmap_cmd.extend(["--fastq", fastq])
+            logging.info(f"starting RNA quantification [{sample_id}, directory: {sample_dir}, "
+                         f"command: {' '.join(mpmap_cmd)} | {' '.join(rpvg_cmd)}]")
+            mpmap = subprocess.Popen(mpmap_cmd, stdout=subprocess.PIPE, stderr=mpmap_log, cwd=sample_dir)
+            rpvg = subprocess.Popen(rpvg_cmd, stdin=mpmap.stdout, stderr=rpvg_log, cwd=sample_dir)
+            # rpvg owns the read end, mpmap gets SIGPIPE if rpvg dies
+            mpmap.stdout.close()
+            rpvg_code = rpvg.wait()
+            mpmap_code = mpmap.wait()
+
+        if stream.errors:
+            logging.error(f"Sample: [{sample_id}] reading lanes failed: {'; '.join(stream.errors)}")
+            return False
+        if mpmap_code != 0 or rpvg_code != 0:
+            logging.error(f"Sample: [{sample_id}] mpmap exit {mpmap_code}, rpvg exit {rpvg_code}, "
+                          f"see the logs in {sample_dir}")
+            return False
+
+        tmp_quant = tmp_prefix.with_name(tmp_prefix.name + ".txt")
+        if not tmp_quant.exists() or tmp_quant.stat().st_size == 0:
+            logging.warning(f"[{sample_id}] rpvg output missing or empty.")
+            return False
+        tmp_quant.replace(quant_file)
+        return True
+
+    def run_rna(self):
+        """run the RNA-seq pipeline"""
+        if not self.gfa_file.exists():
+            logging.error(f"[{self.gfa_file}] does not exist. Please run cactus and vg (decompresses the gfa) first.")
+            sys.exit(1)
+        if not self.rna.get('gff3') or not Path(self.rna['gff3']).exists():
+            logging.error(f"[rna] gff3 can not found: {self.rna.get('gff3')}")
+            sys.exit(1)
+
+        samples = self.parser_csv()
+        if not samples:
+            logging.error("No samples found in the CSV file.")
+            sys.exit(1)
+
+        self.prepare_index()
+
+        # resume: samples with a finished quantification are not run again
+        pending = [s for s in samples if not (self.rna_output / s['SampleID'] / f"{s['SampleID']}.txt").exists()]
+        if len(pending) < len(samples):
+            logging.info(f"Skipping {len(samples) - len(pending)} samples already quantified in {self.rna_output}")
+        if not pending:
+            return
+
+        parallel_job = self.rna.get('Parallel_job', 1)
+        logging.info(f"Starting RNA-seq quantification with {parallel_job} parallel jobs.")
+
+        mem_per_job = ResourcePlanner(self.config).rna_job_memory()
+        scheduler = build_scheduler(self.config, "rna", parallel_job, self.rna_output, mem_per_job)
+        progress = None
+        if self.config.get('Progress', {}).get('enable'):
+            progress = BatchProgress(
+                "rna",
+                {s['SampleID']: [split_fastqs(s['R1']), split_fastqs(s.get('R2'))] for s in pending},
+                log_interval=self.config['Progress'].get('LogInterval', 300),
+            )
+        scheduler.run(
+            self.single_sample_process,
+            {sample_info['SampleID']: (sample_info,) for sample_info in pending},
+            progress=progress,
+        )
+
+if __name__ == "__main__":
+    from src.config_loader import ConfigManager
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    # This is mainly for local testing
+    config_path = sys.argv[1] if len(sys.argv) > 1 else "config/config.toml"
+    cfg = ConfigManager(config_path).get_config()
+    runner = VgRnaRunner(cfg)
+    runner.run_rna()
@@ -2,6 +2,9 @@ import subprocess
 from pathlib import Path
 import logging
 
+from src.artifact_store import ArtifactStore, detach_links, vg_version
+from src.vg_wgs import has_long_reads
+
 class VgIndexStats:
     def __init__(self, config: dict):
         self.config = config
@@ -57,12 +60,20 @@ class VgIndexStats:
             str(cactus_gbz_file.resolve())
         ]
 
+    def _workflows(self) -> list[str]:
+        """giraffe, plus lr-giraffe when long reads are mapped (longread = "auto" looks at the wgs DataTable)"""
+        longread = self.VgIndex.get('longread', "auto")
+        if longread == "auto":
+            longread = has_long_reads(self.config.get('wgs', {}).get('DataTable'))
+        return ["giraffe", "lr-giraffe"] if longread else ["giraffe"]
+
     def _autoindex_vg_command(self) -> list:
         cactus_gfa_file = self.cactus_dir / f"{self.Global['filePrefix']}.full.gfa"
         self._ensure_decompressed(cactus_gfa_file)
-        return [
-            "vg", "autoindex",
-            "--workflow", "giraffe",
+        cmd = ["vg", "autoindex"]
+        for workflow in self._workflows():
+            cmd.extend(["--workflow", workflow])
+        return cmd + [
             "-g", str(cactus_gfa_file.resolve()),
             "-p", "vg_index",  # Output prefix relative to cwd (3. vg_index)
             "-t", str(self.VgIndex['threads'])
@@ -89,18 +100,35 @@ class VgIndexStats:
 
         # 3. Run VG Autoindex if enabled
         if self.VgIndex.get('autoindex'):
+            self._run_autoindex()
+
+    def _run_autoindex(self):
+        autoindex_cmd = self._autoindex_vg_command()
+        store = ArtifactStore(self.config)
+        if not store.enabled:
+            # outputs an earlier run materialized from a store are still links into it
+            detach_links(list(self.vg_index_dir.glob("vg_index.*")))
             logging.info("Start running vg autoindex")
             # Runs in vg_index_dir, so -p vg_index creates files there
-            self._run_command(
-                self._autoindex_vg_command(), 
-                cwd=self.vg_index_dir
-            )
+            self._run_command(autoindex_cmd, cwd=self.vg_index_dir)
+            return
+
+        cactus_gfa_file = self.cactus_dir / f"{self.Global['filePrefix']}.full.gfa"
+        key = store.key("vg_autoindex", {"workflow": self._workflows(), "vg": vg_version()}, [cactus_gfa_file])
+        with store.building(key):
+            if store.materialize(key, self.vg_index_dir):
+                return
+            detach_links(list(self.vg_index_dir.glob("vg_index.*")))
+            logging.info("Start running vg autoindex")
+            self._run_command(autoindex_cmd, cwd=self.vg_index_dir)
+            store.publish(key, "vg_autoindex", self.vg_index_dir, sorted(self.vg_index_dir.glob("vg_index.*")))
 
     def _ensure_decompressed(self, file_path: Path):
         gz_path = file_path.with_name(file_path.name + ".gz")
         if gz_path.exists() and not file_path.exists():
             try:
-                subprocess.run(["gzip", "-d", str(gz_path.resolve())], check=True)
+                # -f: gzip refuses hardlinked files (materialized from the artifact store) otherwise
+                subprocess.run(["gzip", "-d", "-f", str(gz_path.resolve())], check=True)
                 logging.info(f"decompress over: {file_path.name}")
             except subprocess.CalledProcessError as e:
                 logging.error(f"decompress error: {e.returncode}")
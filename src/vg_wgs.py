@@ -1,8 +1,57 @@
 import logging
-from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 import csv
+import errno
+import json
+import os
+import shutil
 import subprocess
+import sys
+import time
+
+from src.alignment_qc import AlignmentQc, AlignmentTee
+from src.fastq_stream import LaneStream, decompress_command, fastq_bytes, read_data_table, split_fastqs
+from src.progress import BatchProgress
+from src.resource_planner import GiB, ResourcePlanner
+from src.scheduler import build_scheduler, build_speculation
+from src.sharding import ShardPlan, file_lock
+
+# per-sample steps of the personalized mode before mapping
+PERSONALIZE_STEPS = ("kmer_count", "haplotype_sampling", "distance_index", "minimizer_index")
+# ReadType column of the DataTable -> giraffe parameter preset, empty / "short" is the short-read default
+LONG_READ_PRESETS = {"hifi": "hifi", "r10": "r10"}
+
+
+def read_type(sample_info: dict) -> str:
+    """normalized ReadType of a DataTable row"""
+    value = (sample_info.get('ReadType') or "short").strip().lower()
+    return value if value in LONG_READ_PRESETS else "short"
+
+
+def has_long_reads(data_table: str | None) -> bool:
+    """True when the DataTable has at least one long-read sample"""
+    if not data_table or not Path(data_table).exists():
+        return False
+    with open(data_table, 'r', newline='') as f:
+        return any(read_type(row) != "short" for row in csv.DictReader(f, skipinitialspace=True))
+
+
+def _open_fifo_writer(fifo: Path, reader: subprocess.Popen):
+    """open the write end of a fifo once its reader opened it, fail if the reader died before"""
+    while True:
+        try:
+            fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+            break
+        except OSError as e:
+            # ENXIO: no reader yet, giraffe is still loading its indexes
+            if e.errno != errno.ENXIO:
+                raise
+            if reader.poll() is not None:
+                raise OSError(f"{fifo.name}: reader exited with {reader.returncode}")
+            time.sleep(0.5)
+    os.set_blocking(fd, True)
+    return os.fdopen(fd, "wb", buffering=1024 * 1024)
+
 
 class VgWgsRunner:
     def __init__(self, config: dict):
@@ -20,87 +69,477 @@ class VgWgsRunner:
         self.gbz_file = self.vg_index / "vg_index.giraffe.gbz"
         self.dist_file = self.vg_index / "vg_index.dist"
         self.min_file = self.vg_index / "vg_index.shortread.withzip.min"
+        # personalized mode: map each sample against a graph sampled from its own k-mers
+        self.personalized: bool = self.wgs.get('Personalized', False)
+        self.ri_file = self.vg_index / "vg_index.ri"
+        self.hapl_file = self.vg_index / "vg_index.hapl"
+        # samples also mapped against the full graph, to report the personalized speedup
+        self.baseline_samples: set[str] = set()
+        # long reads (ReadType hifi / r10): vg autoindex --workflow lr-giraffe
+        self.lr_min_file = self.vg_index / "vg_index.longread.withzip.min"
+        self.lr_zipcodes_file = self.vg_index / "vg_index.longread.zipcodes"
+        # very long inputs are split round-robin over several giraffe processes
+        self.long_read_chunks: int = self.wgs.get('LongReadChunks', 1)
+        self.chunk_min_bytes: int = int(self.wgs.get('ChunkMinGB', 10) * GiB)
 
     def parser_csv(self) -> list:
         """Parse the csv file and output each line as a list"""
-        samples = []
-        try:
-            with open(self.wgs['DataTable'], 'r', newline='') as f:
-                reader = csv.DictReader(f, skipinitialspace=True)
-                for row in reader:
-                    if 'SampleID' not in row or 'R1' not in row:
-                        logging.warning(f"Skipping row (missing SampleID or R1)")
-                        continue
-                    samples.append(row)
-        except Exception as e:
-            logging.error(f"Error parsing CSV: {e}")
-            sys.exit(1)
-        return samples
+        return read_data_table(self.wgs['DataTable'])
 
-    def single_sample_process(self, sample_info: dict) -> bool:
-        """single sample map process"""
+    @staticmethod
+    def _wait(proc: subprocess.Popen) -> int:
+        """wait for a child started with Popen, :return: peak RSS in bytes"""
+        # wait4 gives the resource usage of exactly this child
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        # ru_maxrss is in KiB on Linux
+        return usage.ru_maxrss * 1024
 
-        sample_id = sample_info['SampleID']
-        r1 = sample_info['R1']
-        r2 = sample_info.get('R2')
+    @staticmethod
+    def _timed_run(cmd: list, cwd: Path, stdout=None, stderr=subprocess.PIPE) -> tuple[int, float, int, bytes]:
+        """
+        run one command and measure it
+        :return: (exit code, wall seconds, peak RSS in bytes, stderr)
+        """
+        start = time.monotonic()
+        proc = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, cwd=cwd)
+        err = proc.stderr.read() if proc.stderr else b""
+        max_rss = VgWgsRunner._wait(proc)
+        return proc.returncode, time.monotonic() - start, max_rss, err
 
-        if r2 and not r2.strip():
-            r2 = None
+    def _step(self, report: dict, name: str, cmd: list, cwd: Path, stdout=None) -> bool:
+        """run one measured step of a sample, time and peak memory go into the mapping report"""
+        code, seconds, max_rss, err = self._timed_run(cmd, cwd, stdout=stdout)
+        report[name] = {"seconds": round(seconds, 1), "max_rss": max_rss}
+        if code != 0:
+            logging.error(f"Sample: [{report['sample']}] {name} error: {code}, stderr: {err.decode(errors='replace')[-2000:]}")
+            return False
+        return True
 
-        # create sample directory
-        sample_dir = self.vg_wgs_output / sample_id
-        sample_dir.mkdir(parents=True, exist_ok=True)
+    def prepare_haplotypes(self):
+        """r-index and haplotype information of the full graph, built once for all samples"""
+        # concurrent shards: the first one builds, the others wait and find it current
+        with file_lock(self.vg_index / ".haplotypes.lock"):
+            self._build_haplotypes()
 
-        # file name
-        gam_file = sample_dir / f"{sample_id}.gam"
-        pack_file = sample_dir / f"{sample_id}.pack"
+    def _build_haplotypes(self):
+        if self.hapl_file.exists() and self.hapl_file.stat().st_mtime >= self.gbz_file.stat().st_mtime:
+            return
+        ri_cmd = ["vg", "gbwt", "--num-threads", str(self.threads), "-r", str(self.ri_file), "-Z", str(self.gbz_file)]
+        hapl_cmd = [
+            "vg", "haplotypes",
+            "--threads", str(self.threads),
+            "-d", str(self.dist_file),
+            "-r", str(self.ri_file),
+            "-H", str(self.hapl_file),
+            str(self.gbz_file),
+        ]
+        for cmd in (ri_cmd, hapl_cmd):
+            logging.info(f"Building haplotype information once for all samples: {' '.join(cmd)}")
+            try:
+                subprocess.run(cmd, check=True, stderr=subprocess.PIPE, cwd=self.vg_index)
+            except subprocess.CalledProcessError as e:
+                self.hapl_file.unlink(missing_ok=True)
+                logging.error(f"{cmd[1]} error: {e.returncode}, stderr: {e.stderr}")
+                sys.exit(1)
 
-        # step1. vg giraffe map wgs data
-        giraffe_cmd = [
-            "vg", "giraffe",
-            "--gbz-name", str(self.gbz_file),
-            "--minimizer-name", str(self.min_file),
-            "--dist-name", str(self.dist_file),
+    def _personalize(self, report: dict, reads: list[str], sample_dir: Path) -> dict | None:
+        """
+        sample a personal graph from the k-mers of the reads and index it for giraffe
+        :return: index names for giraffe, None on error
+        """
+        sample_id = report['sample']
+        prefix = sample_dir / sample_id
+        kmc_tmp = sample_dir / "kmc_tmp"
+        kmc_tmp.mkdir(exist_ok=True)
+        reads_list = sample_dir / "reads.txt"
+        reads_list.write_text("".join(f"{Path(r).resolve()}\n" for r in reads))
+        personal = {
+            "gbz": sample_dir / f"{sample_id}.gbz",
+            "dist": sample_dir / f"{sample_id}.dist",
+            "min": sample_dir / f"{sample_id}.min",
+            "zipcodes": sample_dir / f"{sample_id}.zipcodes",
+        }
+
+        # one streaming pass over the reads, k must match the haplotype information (29)
+        kmc_cmd = [
+            "kmc", "-k29", f"-m{self.wgs.get('KmerMemGB', 16)}", "-okff", f"-t{self.threads}", "-hp",
+            f"@{reads_list}", str(prefix), str(kmc_tmp),
+        ]
+        sample_cmd = [
+            "vg", "haplotypes",
             "--threads", str(self.threads),
-            "--output-format", "gam",
-            "--fastq-in", r1,
+            "--include-reference",
+            "-i", str(self.hapl_file),
+            "-k", f"{prefix}.kff",
+            "-g", str(personal['gbz']),
+            str(self.gbz_file),
         ]
-        if r2:
-            giraffe_cmd.extend(["--fastq-in", r2])
+        dist_cmd = ["vg", "index", "--threads", str(self.threads), "-j", str(personal['dist']), str(personal['gbz'])]
+        min_cmd = [
+            "vg", "minimizer",
+            "--threads", str(self.threads),
+            "-d", str(personal['dist']),
+            "-o", str(personal['min']),
+            "-z", str(personal['zipcodes']),
+            str(personal['gbz']),
+        ]
+        logging.info(f"starting haplotype sampling [{sample_id}, directory: {sample_dir}]")
+        for name, cmd in (("kmer_count", kmc_cmd), ("haplotype_sampling", sample_cmd),
+                          ("distance_index", dist_cmd), ("minimizer_index", min_cmd)):
+            if not self._step(report, name, cmd, sample_dir):
+                return None
+        Path(f"{prefix}.kff").unlink(missing_ok=True)
+        reads_list.unlink(missing_ok=True)
+        shutil.rmtree(kmc_tmp, ignore_errors=True)
+        return personal
 
-        logging.info(f"starting Mapping [{sample_id}, directory: {sample_dir}, command: {giraffe_cmd}]")
-        try:
-            with open(gam_file, "w") as w:
-                subprocess.run(giraffe_cmd, stdout=w, check=True, stderr=subprocess.PIPE, cwd=sample_dir)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Sample: [{sample_id}] giraffe error: {e.returncode}")
-            return False
+    def _giraffe_command(self, index: dict, reads: list[str], preset: str | None = None,
+                         threads: int | None = None) -> list:
+        giraffe_cmd = [
+            "vg", "giraffe",
+            "--gbz-name", str(index['gbz']),
+            "--minimizer-name", str(index['min']),
+            "--dist-name", str(index['dist']),
+            "--threads", str(threads or self.threads),
+            # GAF is streamed into vg pack and the QC collector, no alignment file is written
+            "--output-format", "gaf",
+        ]
+        if index.get('zipcodes'):
+            giraffe_cmd.extend(["--zipcode-name", str(index['zipcodes'])])
+        if preset:
+            giraffe_cmd.extend(["--parameter-preset", preset])
+        for fastq in reads:
+            giraffe_cmd.extend(["--fastq-in", fastq])
+        return giraffe_cmd
 
-        # step2. vg pack gam file
-        pack_cmd = [
+    def _pack_command(self, pack: Path, threads: int | None = None) -> list:
+        """vg pack reading GAF records from stdin"""
+        return [
             "vg", "pack",
-            "--gam", str(gam_file),
+            "--gaf", "-",
             "--xg", str(self.gbz_file),
-            "--packs-out", str(pack_file),
-            "--threads", str(self.threads),
-            "--min-mapq", str(self.wgs['MinMapQ'])
+            "--packs-out", str(pack),
+            "--threads", str(threads or self.threads),
+            "--min-mapq", str(self.wgs['MinMapQ']),
         ]
 
-        logging.info(f"starting Packing [{gam_file}, directory: {sample_dir}, command: {pack_cmd}]")
+    def _split_records(self, lanes: list[str], writers: list):
+        """deal the 4-line fastq records of the lanes round-robin over the writers"""
+        n = 0
+        for lane in lanes:
+            decompress = subprocess.Popen(decompress_command(lane, 2), stdout=subprocess.PIPE)
+            source = decompress.stdout
+            try:
+                while True:
+                    record = [source.readline() for _ in range(4)]
+                    if not record[0]:
+                        break
+                    writers[n % len(writers)].write(b"".join(record))
+                    n += 1
+            finally:
+                source.close()
+                if decompress.wait() != 0:
+                    raise OSError(f"{lane}: decompression exited with {decompress.returncode}")
+
+    def _map_chunked(self, report: dict, index: dict, lanes: list[str], preset: str, sample_dir: Path,
+                     qc: AlignmentQc) -> list[Path] | None:
+        """
+        map one long-read input with several giraffe processes fed round-robin through fifos,
+        each giraffe streams into its own vg pack
+        :return: one pack per chunk, None on error
+        """
+        sample_id = report['sample']
+        chunks = self.long_read_chunks
+        threads = max(1, self.threads // chunks)
+        fifos, packs, giraffes, packers, tees, handles = [], [], [], [], [], []
+        start = time.monotonic()
+        for i in range(chunks):
+            fifo = sample_dir / f".chunk{i}.fq"
+            fifo.unlink(missing_ok=True)
+            os.mkfifo(fifo)
+            pack = sample_dir / f".{sample_id}.chunk{i}.pack"
+            log = open(sample_dir / f"giraffe.chunk{i}.log", "wb")
+            cmd = self._giraffe_command(index, [str(fifo)], preset, threads)
+            giraffe = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=log, cwd=sample_dir)
+            packer = subprocess.Popen(self._pack_command(pack, threads), stdin=subprocess.PIPE,
+                                      stderr=log, cwd=sample_dir)
+            # one collector per chunk, the tees run side by side
+            tee = AlignmentTee(giraffe.stdout, packer.stdin, AlignmentQc())
+            tee.start()
+            giraffes.append(giraffe)
+            packers.append(packer)
+            tees.append(tee)
+            handles.append(log)
+            fifos.append(fifo)
+            packs.append(pack)
+        logging.info(f"starting chunked Mapping [{sample_id}, {chunks} giraffe x {threads} threads, "
+                     f"directory: {sample_dir}]")
+
+        writers = []
+        split_error = None
         try:
-            subprocess.run(pack_cmd, check=True, stderr=subprocess.PIPE, cwd=sample_dir)
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Pack file: [{gam_file}] pack error: {e.returncode}")
+            writers = [_open_fifo_writer(fifo, proc) for fifo, proc in zip(fifos, giraffes)]
+            self._split_records(lanes, writers)
+        except OSError as e:
+            # BrokenPipeError included: a giraffe died while reading
+            split_error = e
+        finally:
+            for writer in writers:
+                try:
+                    writer.close()
+                except OSError:
+                    pass
+            if split_error:
+                for proc in giraffes:
+                    if proc.poll() is None:
+                        proc.terminate()
+
+        for tee in tees:
+            tee.join()
+        # the chunks run side by side, their peaks add up
+        giraffe_rss = sum(self._wait(proc) for proc in giraffes)
+        pack_rss = sum(self._wait(proc) for proc in packers)
+        for handle in handles:
+            handle.close()
+        for fifo in fifos:
+            fifo.unlink(missing_ok=True)
+        seconds = round(time.monotonic() - start, 1)
+        report['giraffe'] = {"seconds": seconds, "max_rss": giraffe_rss, "chunks": chunks}
+        report['pack'] = {"seconds": seconds, "max_rss": pack_rss, "chunks": chunks}
+        for tee in tees:
+            qc.merge(tee.qc)
+
+        codes = [proc.returncode for proc in giraffes + packers]
+        tee_errors = [f"chunk {i}: {tee.error}" for i, tee in enumerate(tees) if tee.error]
+        if split_error or any(codes) or tee_errors:
+            logging.error(f"Sample: [{sample_id}] chunked giraffe | vg pack error: exit codes {codes}"
+                          + (f", {split_error}" if split_error else "")
+                          + (f", alignment copy stopped ({'; '.join(tee_errors)})" if tee_errors else "")
+                          + f", see giraffe.chunk*.log in {sample_dir}")
+            return None
+        if qc.malformed:
+            logging.warning(f"[{sample_id}] {qc.malformed} malformed GAF records skipped by the QC")
+        return packs
+
+    def _map_step(self, report: dict, name: str, index: dict, mates: list[list[str]], preset: str | None,
+                  sample_dir: Path, stdout) -> bool:
+        """one giraffe run, multi-lane mates are streamed through fifos"""
+        # giraffe parses the decompressed stream, leave it most of the cores
+        stream = LaneStream(mates, sample_dir, threads=max(1, self.threads // 4), name=name)
+        with stream as reads:
+            giraffe_cmd = self._giraffe_command(index, reads, preset)
+            logging.info(f"starting Mapping [{report['sample']}, directory: {sample_dir}, command: {giraffe_cmd}]")
+            success = self._step(report, name, giraffe_cmd, sample_dir, stdout=stdout)
+        if stream.errors:
+            logging.error(f"Sample: [{report['sample']}] reading lanes failed: {'; '.join(stream.errors)}")
+            return False
+        return success
+
+    def _map_and_pack(self, report: dict, index: dict, mates: list[list[str]], preset: str | None,
+                      sample_dir: Path, pack: Path, qc: AlignmentQc) -> bool:
+        """giraffe | tee (QC) | vg pack, the alignments are read once and never written to disk"""
+        sample_id = report['sample']
+        stream = LaneStream(mates, sample_dir, threads=max(1, self.threads // 4), name="giraffe")
+        with stream as reads, open(sample_dir / "giraffe.log", "wb") as giraffe_log, \
+                open(sample_dir / "pack.log", "wb") as pack_log:
+            giraffe_cmd = self._giraffe_command(index, reads, preset)
+            pack_cmd = self._pack_command(pack)
+            logging.info(f"starting Mapping & Packing [{sample_id}, directory: {sample_dir}, "
+                         f"command: {' '.join(giraffe_cmd)} | {' '.join(pack_cmd)}]")
+            start = time.monotonic()
+            giraffe = subprocess.Popen(giraffe_cmd, stdout=subprocess.PIPE, stderr=giraffe_log, cwd=sample_dir)
+            packer = subprocess.Popen(pack_cmd, stdin=subprocess.PIPE, stderr=pack_log, cwd=sample_dir)
+            tee = AlignmentTee(giraffe.stdout, packer.stdin, qc)
+            tee.start()
+            tee.join()
+            giraffe_rss = self._wait(giraffe)
+            giraffe_seconds = time.monotonic() - start
+            pack_rss = self._wait(packer)
+        report['giraffe'] = {"seconds": round(giraffe_seconds, 1), "max_rss": giraffe_rss}
+        report['pack'] = {"seconds": round(time.monotonic() - start, 1), "max_rss": pack_rss}
+
+        if stream.errors:
+            logging.error(f"Sample: [{sample_id}] reading lanes failed: {'; '.join(stream.errors)}")
             return False
+        if giraffe.returncode != 0 or packer.returncode != 0:
+            logging.error(f"Sample: [{sample_id}] giraffe exit {giraffe.returncode}, vg pack exit {packer.returncode}"
+                          + (f", {tee.error}" if tee.error else "") + f", see giraffe.log / pack.log in {sample_dir}")
+            return False
+        if tee.error:
+            # the copy into vg pack stopped early, the pack would miss alignments
+            logging.error(f"Sample: [{sample_id}] alignment copy into vg pack stopped: {tee.error}")
+            return False
+        if qc.malformed:
+            logging.warning(f"[{sample_id}] {qc.malformed} malformed GAF records skipped by the QC")
+        return True
+
+    def single_sample_process(self, sample_info: dict, speculative: bool = False) -> bool:
+        """
+        single sample map process
+        :param speculative: duplicate attempt of a straggler, writes into sample_dir/.speculative
+        """
+
+        sample_id = sample_info['SampleID']
+        # lanes of each mate, several files per cell are streamed as one input
+        r1 = split_fastqs(sample_info['R1'])
+        r2 = split_fastqs(sample_info.get('R2'))
+        mates = [r1, r2] if r2 else [r1]
+
+        # create sample directory
+        sample_dir = self.vg_wgs_output / sample_id
+        if speculative:
+            sample_dir = sample_dir / ".speculative"
+        sample_dir.mkdir(parents=True, exist_ok=True)
+
+        # file name
+        pack_file = sample_dir / f"{sample_id}.pack"
+        # renamed once packing finished, an existing pack marks the sample as done (resume)
+        tmp_pack = sample_dir / f".{sample_id}.pack.tmp"
+        sample_read_type = read_type(sample_info)
+        preset = LONG_READ_PRESETS.get(sample_read_type)
+        # haplotype sampling is tuned for short reads, long reads keep the full graph
+        personalized = self.personalized and preset is None
+        report = {"sample": sample_id, "mode": "personalized" if personalized else "full",
+                  "read_type": sample_read_type}
+
+        full_index = {"gbz": self.gbz_file, "min": self.min_file, "dist": self.dist_file}
+        if preset:
+            if r2:
+                logging.warning(f"[{sample_id}] long reads are mapped single-ended, R2 is ignored")
+                mates = [r1]
+            full_index = {"gbz": self.gbz_file, "min": self.lr_min_file, "dist": self.dist_file,
+                          "zipcodes": self.lr_zipcodes_file}
+        index = full_index
+        if personalized:
+            # kmc reads every lane file itself
+            index = self._personalize(report, [lane for lanes in mates for lane in lanes], sample_dir)
+            if index is None:
+                return False
 
-        # clean gam file
-        if pack_file.exists() and pack_file.stat().st_size > 0:
-            logging.info(f"[{sample_id}] Mapping & Packing done. Removing intermediate GAM file.")
-            gam_file.unlink(missing_ok=True)
-        else:
-            logging.warning(f"[{sample_id}] Pack file missing or empty. Keeping GAM file for debugging.")
+        # step1. vg giraffe map wgs data, the GAF stream is packed and QC'd on the fly
+        # node IDs of the sampled graph are the ones of the full graph, so packs stay comparable for vg call
+        qc = AlignmentQc()
+        chunked = (preset and self.long_read_chunks > 1
+                   and fastq_bytes([sample_info['R1']]) >= self.chunk_min_bytes)
+        if chunked:
+            chunk_packs = self._map_chunked(report, index, r1, preset, sample_dir, qc)
+            if chunk_packs is None:
+                return False
+            # the coverage of the chunks sums up into the same pack format as a single run
+            merge_cmd = ["vg", "pack", "--xg", str(self.gbz_file), "--packs-out", str(tmp_pack),
+                         "--threads", str(self.threads)]
+            for pack in chunk_packs:
+                merge_cmd.extend(["--packs-in", str(pack)])
+            logging.info(f"merging {len(chunk_packs)} chunk packs of [{sample_id}]: {merge_cmd}")
+            if not self._step(report, "pack_merge", merge_cmd, sample_dir):
+                return False
+            for path in chunk_packs:
+                path.unlink(missing_ok=True)
+        elif not self._map_and_pack(report, index, mates, preset, sample_dir, tmp_pack, qc):
             return False
 
+        if sample_id in self.baseline_samples and personalized:
+            # same reads against the full graph, only the cost is kept
+            logging.info(f"[{sample_id}] mapping against the full graph for the baseline")
+            with open(os.devnull, "w") as w:
+                if not self._map_step(report, "giraffe_full_graph", full_index, mates, None, sample_dir, w):
+                    return False
+
+        if not tmp_pack.exists() or tmp_pack.stat().st_size == 0:
+            logging.warning(f"[{sample_id}] Pack file missing or empty.")
+            return False
+        # written before the pack, so every finished sample has its QC
+        qc.write(sample_dir / "qc.json", sample_id, self.wgs['MinMapQ'])
+        tmp_pack.replace(pack_file)
+        logging.info(f"[{sample_id}] Mapping & Packing done, {qc.mapped}/{qc.reads} reads mapped.")
+
+        if index is not full_index:
+            for path in index.values():
+                path.unlink(missing_ok=True)
+        (sample_dir / "mapping_report.json").write_text(json.dumps(report, indent=2))
+        return True
+
+    def _pack_file(self, sample_id: str) -> Path:
+        return self.vg_wgs_output / sample_id / f"{sample_id}.pack"
+
+    def write_qc_table(self):
+        """cohort table of the per-sample qc.json"""
+        rows = []
+        for qc_file in sorted(self.vg_wgs_output.glob("*/qc.json")):
+            qc = json.loads(qc_file.read_text())
+            insert = qc.get('insert_size', {})
+            rows.append([
+                qc['sample'], qc['reads'], qc['mapped'], qc['mapped_fraction'],
+                qc['mean_mapq'] if qc['mean_mapq'] is not None else "",
+                round(qc['passing_mapq'] / qc['reads'], 4) if qc['reads'] else "",
+                insert.get('median', ""), insert.get('mean', ""), insert.get('sd', ""),
+            ])
+        if not rows:
+            return
+        qc_table = self.vg_wgs_output / "qc.tsv"
+        # shards sharing the work_dir rewrite the cohort table concurrently, each one atomically
+        tmp_file = qc_table.with_name(f".{qc_table.name}.{os.getpid()}.tmp")
+        with open(tmp_file, "w", newline="") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["sample", "reads", "mapped", "mapped_fraction", "mean_mapq", "passing_mapq_fraction",
+                             "insert_median", "insert_mean", "insert_sd"])
+            writer.writerows(rows)
+        tmp_file.replace(qc_table)
+        logging.info(f"Alignment QC of {len(rows)} samples written to {qc_table}")
+
+    def write_mapping_report(self):
+        """cohort table of the mapping cost per sample, compared with the full-graph baseline when measured"""
+        rows = []
+        for report_file in sorted(self.vg_wgs_output.glob("*/mapping_report.json")):
+            report = json.loads(report_file.read_text())
+            giraffe = report.get('giraffe', {})
+            sampling = sum(report.get(step, {}).get('seconds', 0) for step in PERSONALIZE_STEPS)
+            full = report.get('giraffe_full_graph', {})
+            rows.append([
+                report['sample'], report['mode'],
+                giraffe.get('seconds', ""), round(giraffe.get('max_rss', 0) / GiB, 2),
+                round(sampling, 1) if report['mode'] == "personalized" else "",
+                full.get('seconds', ""), round(full['max_rss'] / GiB, 2) if full else "",
+                round(full['seconds'] / giraffe['seconds'], 2) if full and giraffe.get('seconds') else "",
+            ])
+        if not rows:
+            return
+        report_file = self.vg_wgs_output / "mapping_report.tsv"
+        tmp_file = report_file.with_name(f".{report_file.name}.{os.getpid()}.tmp")
+        with open(tmp_file, "w", newline="") as f:
+            writer = csv.writer(f, delimiter="\t")
+            writer.writerow(["sample", "mode", "giraffe_seconds", "giraffe_max_rss_gb", "sampling_seconds",
+                             "full_graph_seconds", "full_graph_max_rss_gb", "speedup"])
+            writer.writerows(rows)
+        tmp_file.replace(report_file)
+        logging.info(f"Mapping report of {len(rows)} samples written to {report_file}")
+
+    def resolve_speculation(self, sample_id: str, speculative_won: bool) -> bool:
+        """
+        keep the outputs of the attempt that finished first, drop the other copy
+        :return: False when the outputs could not be moved, the sample is then failed (and re-mapped on resume)
+        """
+        sample_dir = self.vg_wgs_output / sample_id
+        speculative_dir = sample_dir / ".speculative"
+        try:
+            if speculative_won:
+                # partial pack of the cancelled original
+                (sample_dir / f".{sample_id}.pack.tmp").unlink(missing_ok=True)
+                for path in speculative_dir.iterdir():
+                    target = sample_dir / path.name
+                    # leftovers of the cancelled original (kmc_tmp, per-step dirs) block a directory rename
+                    if target.is_dir() and not target.is_symlink():
+                        shutil.rmtree(target)
+                    # same filesystem, the rename is atomic
+                    os.replace(path, target)
+                logging.info(f"[{sample_id}] outputs of the speculative copy moved to {sample_dir}")
+        except OSError as e:
+            logging.error(f"[{sample_id}] could not keep the outputs of the speculative copy: {e}")
+            (sample_dir / f"{sample_id}.pack").unlink(missing_ok=True)
+            return False
+        finally:
+            shutil.rmtree(speculative_dir, ignore_errors=True)
         return True
 
     def run_wgs(self):
@@ -114,24 +553,63 @@ class VgWgsRunner:
             logging.error("No samples found in the CSV file.")
             sys.exit(1)
 
+        shard = ShardPlan(self.config)
+        if shard.enabled:
+            # the plan is made from the whole DataTable, before finished samples are dropped
+            sizes = {s['SampleID']: fastq_bytes([s['R1'], s.get('R2')]) for s in samples}
+            try:
+                mine = shard.select(sizes, basis="fastq_bytes")
+            except ValueError as e:
+                logging.error(f"Shard error: {e}")
+                sys.exit(1)
+            samples = [s for s in samples if s['SampleID'] in mine]
+        shard_samples = [s['SampleID'] for s in samples]
+
+        # resume: samples with a finished pack are not mapped again
+        finished = [s for s in samples if self._pack_file(s['SampleID']).exists()]
+        if finished:
+            logging.info(f"Skipping {len(finished)} samples already packed in {self.vg_wgs_output}")
+            samples = [s for s in samples if s not in finished]
+        if not samples:
+            if shard.enabled:
+                shard.write_manifest("wgs", {s: True for s in shard_samples})
+            return
+
+        if any(read_type(s) != "short" for s in samples) and not self.lr_min_file.exists():
+            logging.error(f"[{self.lr_min_file}] does not exist but the DataTable has long-read samples. "
+                          f"Please run vg autoindex with [VgIndex] longread = true (or \"auto\").")
+            sys.exit(1)
+        if self.personalized:
+            self.prepare_haplotypes()
+
         parallel_job = self.wgs.get('Parallel_job', 1)
         logging.info(f"Starting WGS analysis with {parallel_job} parallel jobs.")
 
-        with ProcessPoolExecutor(max_workers=parallel_job) as executor:
-            future_to_sample = {
-                executor.submit(self.single_sample_process, sample_info)
-                : sample_info
-                for sample_info in samples
-            }
-
-            for future in as_completed(future_to_sample):
-                sample_id = future_to_sample[future]
-                try:
-                    success = future.result()
-                    status = "SUCCESS" if success else "FAILED"
-                    logging.info(f">>> Sample {sample_id}: Pipeline {status}")
-                except Exception as e:
-                    logging.error(f">>> Sample {sample_id} crashed with exception: {e}")
+        mem_per_job, _ = ResourcePlanner(self.config).giraffe_job_memory()
+        scheduler = build_scheduler(self.config, "wgs", parallel_job, self.vg_wgs_output, mem_per_job)
+        progress = None
+        if self.config.get('Progress', {}).get('enable'):
+            progress = BatchProgress(
+                "wgs",
+                {s['SampleID']: [split_fastqs(s['R1']), split_fastqs(s.get('R2'))] for s in samples},
+                log_interval=self.config['Progress'].get('LogInterval', 300),
+            )
+        # straggler detection compares bytes/s of samples with similar FASTQ size
+        sizes = {s['SampleID']: fastq_bytes([s['R1'], s.get('R2')]) for s in samples}
+        if self.personalized:
+            # the first samples are also mapped against the full graph for the comparison
+            self.baseline_samples = {s['SampleID'] for s in samples[:self.wgs.get('BaselineSamples', 0)]}
+        scheduler.run(
+            self.single_sample_process,
+            {sample_info['SampleID']: (sample_info,) for sample_info in samples},
+            progress=progress,
+            speculation=build_speculation(self.config, sizes),
+            resolve=self.resolve_speculation,
+        )
+        if shard.enabled:
+            shard.write_manifest("wgs", {s: self._pack_file(s).exists() for s in shard_samples})
+        self.write_mapping_report()
+        self.write_qc_table()
 
 if __name__ == "__main__":
     from src.config_loader import ConfigManager
@@ -0,0 +1,296 @@
+import csv
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import statistics
+import struct
+import sys
+import time
+from pathlib import Path
+
+from src.fastq_stream import fastq_bytes, split_fastqs
+from src.resource_planner import ResourcePlanner
+from src.sample_scan import expects_mate, scan_fastqs
+from src.scheduler import build_scheduler
+from src.vg_call import CallVariantRunner
+from src.vg_wgs import VgWgsRunner, read_type
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Inotify:
+    """recursive inotify watch of a directory tree through libc, used to wake up the scan"""
+    def __init__(self, root: Path):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs: dict[int, Path] = {}
+        for directory, _, _ in os.walk(root):
+            self._add(Path(directory))
+
+    def _add(self, directory: Path):
+        wd = self.libc.inotify_add_watch(self.fd, str(directory).encode(), WATCH_MASK)
+        if wd < 0:
+            # ENOSPC: fs.inotify.max_user_watches reached, the periodic rescan still sees the files
+            logging.warning(f"Cannot watch {directory}: {os.strerror(ctypes.get_errno())}")
+            return
+        self.dirs[wd] = directory
+
+    def wait(self, timeout: float) -> bool:
+        """block until something changed below the root or timeout, :return: True on events"""
+        readable, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+        if not readable:
+            return False
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and wd in self.dirs:
+                # new delivery sub-directory, watch it and whatever was already copied into it
+                for directory, _, _ in os.walk(self.dirs[wd] / os.fsdecode(name)):
+                    self._add(Path(directory))
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class ArrivalTracker:
+    """
+    Detect complete, finished sample file sets in a delivery directory
+    A sample is ready once its file set (names, sizes, mtimes) has not changed for
+    StableSeconds. An R1 with paired-end naming but no R2 yet waits SingleEndAfter seconds
+    before it is taken as single-end, the R2 may still be copied.
+    """
+    def __init__(self, input_dir: Path, stable_seconds: float, single_end_after: float,
+                 poll_interval: float, read_type: str = "auto"):
+        self.input_dir = input_dir
+        self.stable_seconds = stable_seconds
+        self.single_end_after = single_end_after
+        self.poll_interval = poll_interval
+        self.read_type = read_type
+        # SampleID -> (signature, monotonic time of the last change, wall time first seen, hold seconds)
+        self.unstable: dict[str, tuple[tuple, float, float, float]] = {}
+        self.submitted: set[str] = set()
+        # files changed since the last scan (inotify), and when the last scan ran
+        self.dirty = True
+        self.last_scan = 0.0
+        try:
+            self.inotify = Inotify(input_dir)
+            logging.info(f"Watching {input_dir} with inotify (rescan every {poll_interval}s)")
+        except (OSError, AttributeError) as e:
+            # no inotify (other OS, no libc symbol): polling only
+            self.inotify = None
+            logging.info(f"inotify unavailable ({e}), polling {input_dir} every {poll_interval}s")
+
+    def _signature(self, row: dict) -> tuple | None:
+        try:
+            return tuple((path, os.stat(path).st_size, os.stat(path).st_mtime_ns)
+                         for path in split_fastqs(row['R1']) + split_fastqs(row.get('R2')))
+        except OSError:
+            # renamed or removed between the scan and the stat
+            return None
+
+    def _hold(self, row: dict) -> float:
+        if not row.get('R2') and any(expects_mate(Path(path).name) for path in split_fastqs(row['R1'])):
+            return self.single_end_after
+        return self.stable_seconds
+
+    def _due(self, now: float) -> bool:
+        """a scan can change something: file events, a pending stability check or the periodic rescan"""
+        if self.dirty or now - self.last_scan >= self.poll_interval:
+            return True
+        return any(now - since >= hold for _, since, _, hold in self.unstable.values())
+
+    def scan(self) -> list[tuple[dict, float]]:
+        """:return: (DataTable row, wall time first seen) of the samples that became ready"""
+        now = time.monotonic()
+        if self.inotify and self.inotify.wait(0):
+            self.dirty = True
+        if not self._due(now):
+            return []
+        self.dirty = False
+        self.last_scan = now
+        ready = []
+        for sample_id, row in scan_fastqs(self.input_dir, self.read_type, quiet=True).items():
+            if sample_id in self.submitted:
+                continue
+            signature = self._signature(row)
+            if signature is None:
+                continue
+            previous = self.unstable.get(sample_id)
+            if previous is None or previous[0] != signature:
+                first_seen = previous[2] if previous else time.time()
+                self.unstable[sample_id] = (signature, now, first_seen, self._hold(row))
+                continue
+            if now - previous[1] >= previous[3]:
+                ready.append((row, previous[2]))
+                self.submitted.add(sample_id)
+                del self.unstable[sample_id]
+        return ready
+
+    def wait(self, timeout: float):
+        """sleep until a file event, the next stability check or timeout"""
+        now = time.monotonic()
+        for _, since, _, hold in self.unstable.values():
+            timeout = min(timeout, since + hold - now)
+        timeout = max(0.0, min(timeout, self.poll_interval))
+        if self.inotify:
+            # first_seen is taken at the scan after the event
+            self.dirty = self.inotify.wait(timeout) or self.dirty
+        else:
+            time.sleep(timeout)
+
+
+class WatchRunner:
+    """
+    Streaming ingestion: map and call samples as their FASTQs arrive
+    Ready samples are fed into one running scheduler; each job maps the sample (giraffe,
+    pack) and calls its variants right away. Arrival-to-VCF latency and throughput are
+    logged and written to watch_latency.tsv.
+    """
+    def __init__(self, config: dict):
+        self.config = config
+        self.Global: dict = self.config['Global']
+        self.Watch: dict = self.config['Watch']
+        self.work_dir = Path(self.Global['work_dir']).resolve()
+        self.input_dir = Path(self.Watch.get('InputDir') or "").resolve()
+        self.wgs_runner = VgWgsRunner(config)
+        self.call_runner = CallVariantRunner(config)
+        # every sample taken in, so batch runs (--call, --merge) can use the same table
+        self.datatable = self.work_dir / "watch_datatable.csv"
+        self.latency_file = self.work_dir / "watch_latency.tsv"
+        self.arrivals: dict[str, float] = {}
+        self.ready_at: dict[str, float] = {}
+        self.latencies: list[float] = []
+        self.start_time = 0.0
+
+    def _vcf_file(self, sample_id: str) -> Path:
+        return self.call_runner.call_dir / sample_id / f"{sample_id}.vcf"
+
+    def process_sample(self, sample_info: dict) -> bool:
+        """worker side: mapping and variant calling of one sample"""
+        sample_id = sample_info['SampleID']
+        pack_file = self.wgs_runner.vg_wgs_output / sample_id / f"{sample_id}.pack"
+        # a pack from an interrupted watch is reused
+        if not pack_file.exists() and not self.wgs_runner.single_sample_process(sample_info):
+            return False
+        return self.call_runner._single_call_variant(pack_file)
+
+    def _append_datatable(self, row: dict):
+        new_file = not self.datatable.exists()
+        with open(self.datatable, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['SampleID', 'R1', 'R2', 'ReadType'], extrasaction='ignore')
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)
+
+    def _feed(self, tracker: ArrivalTracker, idle_exit: float):
+        """scheduler feed: ready samples as jobs, None once idle for IdleExit seconds"""
+        last_activity = time.monotonic()
+
+        def feed(timeout: float) -> dict[str, tuple] | None:
+            nonlocal last_activity
+            if timeout:
+                tracker.wait(timeout)
+            jobs = {}
+            for row, first_seen in tracker.scan():
+                sample_id = row['SampleID']
+                if self._vcf_file(sample_id).exists():
+                    logging.info(f"[watch] {sample_id} already has a VCF, skipping")
+                    continue
+                if read_type(row) != "short" and not self.wgs_runner.lr_min_file.exists():
+                    logging.error(f"[watch] {sample_id} is a long-read sample but "
+                                  f"{self.wgs_runner.lr_min_file} does not exist, skipping")
+                    continue
+                self.arrivals[sample_id] = first_seen
+                self.ready_at[sample_id] = time.time()
+                self._append_datatable(row)
+                logging.info(f"[watch] {sample_id} ready ({fastq_bytes([row['R1'], row.get('R2')]) / 1024 ** 3:.1f} GiB, "
+                             f"stable after {self.ready_at[sample_id] - first_seen:.0f}s), queued")
+                jobs[sample_id] = (row,)
+            if jobs or tracker.unstable:
+                last_activity = time.monotonic()
+            elif idle_exit and time.monotonic() - last_activity >= idle_exit:
+                logging.info(f"[watch] nothing arrived for {idle_exit}s, finishing the running samples")
+                return None
+            return jobs
+
+        return feed
+
+    def _on_done(self, sample_id: str, success: bool):
+        """log arrival-to-VCF latency and throughput of one finished sample"""
+        now = time.time()
+        latency = now - self.arrivals[sample_id]
+        new_file = not self.latency_file.exists()
+        with open(self.latency_file, 'a', newline='') as f:
+            writer = csv.writer(f, delimiter="\t")
+            if new_file:
+                writer.writerow(["sample", "status", "first_seen", "ready", "finished", "wait_stable_s",
+                                 "processing_s", "latency_s"])
+            writer.writerow([
+                sample_id, "success" if success else "failure",
+                time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.arrivals[sample_id])),
+                time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.ready_at[sample_id])),
+                time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)),
+                round(self.ready_at[sample_id] - self.arrivals[sample_id], 1),
+                round(now - self.ready_at[sample_id], 1), round(latency, 1),
+            ])
+        if not success:
+            return
+        self.latencies.append(latency)
+        hours = (time.monotonic() - self.start_time) / 3600
+        logging.info(f"[watch] {sample_id}: VCF {latency / 60:.1f} min after arrival; "
+                     f"{len(self.latencies)} samples done, {len(self.latencies) / hours:.1f} samples/h, "
+                     f"median latency {statistics.median(self.latencies) / 60:.1f} min")
+
+    def run_watch(self):
+        if not self.input_dir.is_dir():
+            logging.error(f"[Watch] InputDir is not a directory: {self.input_dir}")
+            sys.exit(1)
+        if not self.wgs_runner.gbz_file.exists():
+            logging.error(f"[{self.wgs_runner.gbz_file}] does not exist. Please run vg autoindex first.")
+            sys.exit(1)
+        # once-per-batch preparations of the mapping and call stages
+        if self.wgs_runner.personalized:
+            self.wgs_runner.prepare_haplotypes()
+        if self.call_runner.mode == "known":
+            self.call_runner._prepare_known_sites()
+
+        tracker = ArrivalTracker(
+            self.input_dir,
+            stable_seconds=self.Watch.get('StableSeconds', 60),
+            single_end_after=self.Watch.get('SingleEndAfter', 600),
+            poll_interval=self.Watch.get('PollInterval', 30),
+            read_type=self.Watch.get('ReadType', "auto"),
+        )
+        parallel_job = self.config['wgs'].get('Parallel_job', 1)
+        mem_per_job, _ = ResourcePlanner(self.config).giraffe_job_memory()
+        scheduler = build_scheduler(self.config, "watch", parallel_job, self.wgs_runner.vg_wgs_output, mem_per_job)
+        self.start_time = time.monotonic()
+        logging.info(f"[watch] mapping and calling new samples of {self.input_dir} with {parallel_job} parallel jobs")
+        try:
+            results = scheduler.run(self.process_sample, {},
+                                    feed=self._feed(tracker, self.Watch.get('IdleExit', 0)),
+                                    on_done=self._on_done)
+        finally:
+            if tracker.inotify:
+                tracker.inotify.close()
+        self.wgs_runner.write_mapping_report()
+        self.wgs_runner.write_qc_table()
+        failed = [sample_id for sample_id, success in results.items() if not success]
+        logging.info(f"[watch] {len(results) - len(failed)} samples called, {len(failed)} failed"
+                     + (f": {', '.join(failed)}" if failed else ""))